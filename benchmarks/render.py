@@ -0,0 +1,214 @@
+"""
+Render pipeline micro-benchmarks.
+
+    python benchmarks/render.py [--repeat 5] [--quick] [--output results.json]
+
+Times every stage between a string and the serialized AnimationData (font
+loading, reflow_text, lines_to_frames, gen_bitmap, render_frames,
+create_font_characters, gen_color_bitmap and AnimationData.serialize) for
+short, medium and long texts on the 48x12 display and larger ones, and
+records the memory each stage allocates with tracemalloc. Results are
+reported as JSON, so they can be compared across releases.
+"""
+import argparse
+import json
+import os.path
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# runs from a checkout without installing spotled
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spotled import *
+from spotled.bleak.fontops import font_registry, glyph_cache
+
+FONTS = ("4x6", "5x7", "5x8", "6x9", "6x10", "6x12")
+
+TEXTS = {
+    "short": "Hello!",
+    "medium": "The quick brown fox jumps over the lazy dog. 0123456789",
+    "long": " ".join(
+        [
+            "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do",
+            "eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim",
+            "ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut",
+            "aliquip ex ea commodo consequat.",
+        ]
+        * 4
+    ),
+}
+
+# name -> width, height, font, line height
+GEOMETRIES = {
+    "48x12": (48, 12, "4x6", 6),
+    "96x16": (96, 16, "5x8", 8),
+    "128x32": (128, 32, "6x12", 16),
+}
+
+COLOR_MAP = {".": (0, 0, 0), "1": (0, 255, 255)}
+
+# a timed batch runs for at least this long, in seconds
+MIN_BATCH_TIME = 0.05
+
+
+def measure(function, repeat):
+    """
+    Returns the min and median seconds per call of function over repeat
+    batches, and the memory one call allocates: its peak and the blocks
+    still allocated afterwards, including the result.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_BATCH_TIME or number >= 1 << 20:
+            break
+        number *= 2
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        # reset_peak is new in Python 3.9, before that the peak also
+        # includes taking the snapshot
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    allocated = [
+        stat for stat in after.compare_to(before, "filename") if stat.count_diff > 0
+    ]
+
+    return {
+        "calls": number * repeat,
+        "seconds": {"min": min(timings), "median": statistics.median(timings)},
+        "peak_bytes": peak,
+        "allocated_blocks": sum(stat.count_diff for stat in allocated),
+        "allocated_bytes": sum(stat.size_diff for stat in allocated),
+    }
+
+
+def load_cold(font):
+    font_registry.clear()
+    glyph_cache.clear()
+    return find_and_load_font(font)
+
+
+def font_cases(repeat):
+    for font in FONTS:
+        find_and_load_font(font)  # make sure the compiled font exists
+        yield {"stage": "find_and_load_font/cold", "font": font}, measure(
+            lambda: load_cold(font), repeat
+        )
+        yield {"stage": "find_and_load_font/warm", "font": font}, measure(
+            lambda: find_and_load_font(font), repeat
+        )
+
+
+def text_cases(repeat, geometries):
+    for geometry in geometries:
+        width, height, font, line_height = GEOMETRIES[geometry]
+        lines_per_frame = height // line_height
+        font_data = find_and_load_font(font)
+        for text_name, text in TEXTS.items():
+            lines = reflow_text(text, font_data, width)
+            text_frames = lines_to_frames(
+                lines, font_data, Align.CENTER, width, lines_per_frame, line_height
+            )
+            frames = render_frames(
+                lines, font_data, Align.CENTER, width, lines_per_frame, line_height
+            )
+            animation = AnimationData(
+                [FrameData.from_frame(frame) for frame in frames], 2, 20, Effect.NONE
+            )
+            case = {"geometry": geometry, "font": font, "text": text_name}
+            stages = {
+                "reflow_text": lambda: reflow_text(text, font_data, width),
+                "lines_to_frames": lambda: lines_to_frames(
+                    lines, font_data, Align.CENTER, width, lines_per_frame, line_height
+                ),
+                "gen_bitmap": lambda: [gen_bitmap(*rows) for rows in text_frames],
+                "render_frames": lambda: render_frames(
+                    lines, font_data, Align.CENTER, width, lines_per_frame, line_height
+                ),
+                "create_font_characters": lambda: create_font_characters(
+                    text, font_data, height
+                ),
+                "gen_color_bitmap": lambda: [
+                    gen_color_bitmap(*rows, color_map=COLOR_MAP) for rows in text_frames
+                ],
+                "AnimationData.serialize": animation.serialize,
+            }
+            for stage, function in stages.items():
+                result = measure(function, repeat)
+                result["frames"] = len(frames)
+                yield dict(case, stage=stage), result
+
+
+def run(repeat, geometries):
+    results = []
+    for case, result in [*font_cases(repeat), *text_cases(repeat, geometries)]:
+        result.update(case)
+        results.append(result)
+        label = " ".join(
+            str(case[k]) for k in ("geometry", "text", "font") if k in case
+        )
+        print(
+            f"{case['stage']:24} {label:20} "
+            f"{result['seconds']['median'] * 1e6:10.1f} us "
+            f"{result['allocated_blocks']:6} blocks "
+            f"{result['peak_bytes'] / 1024:8.1f} KiB peak",
+            file=sys.stderr,
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches per case")
+    parser.add_argument("--quick", action="store_true", help="only the 48x12 display")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    geometries = list(GEOMETRIES)[:1] if args.quick else list(GEOMETRIES)
+    results = run(args.repeat, geometries)
+
+    report = {
+        "benchmark": "render",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy is not None,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == "__main__":
+    main()
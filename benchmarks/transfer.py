@@ -0,0 +1,183 @@
+"""
+Transfer throughput benchmarks, run against the simulated device.
+
+    python benchmarks/transfer.py [--repeat 5] [--quick] [--output results.json]
+
+Sends representative payloads with LedConnection.send_data over a grid of
+simulated links (MTU, device buffer size and latency) and reports the
+end-to-end latency and payload bytes per second of every combination as
+JSON, so results can be compared across releases.
+"""
+import argparse
+import asyncio
+import json
+import os.path
+import platform
+import statistics
+import sys
+import time
+
+# runs from a checkout without installing spotled
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spotled import *
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+FRAME_WIDTH = 48
+FRAME_HEIGHT = 12
+
+# name -> SimulatedDevice timing, in seconds
+LATENCIES = {
+    "none": dict(write_latency=0.0, notify_latency=0.0, jitter=0.0),
+    "ble": dict(write_latency=0.001, notify_latency=0.0075, jitter=0.0025),
+}
+MTUS = (23, 185, 247)
+BUFFER_SIZES = (128, 512, 2048)
+
+
+def brightness_payload():
+    return BrightnessData(50)
+
+
+def short_text_payload():
+    return text_lines_animation(
+        "Hello!", FRAME_WIDTH, FRAME_HEIGHT, font="6x12", line_height=FRAME_HEIGHT
+    )
+
+
+def animation_payload():
+    frames = [
+        FrameData(
+            FRAME_WIDTH,
+            FRAME_HEIGHT,
+            bytes((i * 37 + j) & 255 for j in range(FRAME_WIDTH * FRAME_HEIGHT // 8)),
+        )
+        for i in range(20)
+    ]
+    return AnimationData(frames, 100, 0, Effect.NONE)
+
+
+def rgb_payload():
+    colors = "RGB."
+    rows = [
+        "".join(colors[(x + y) % len(colors)] for x in range(FRAME_WIDTH))
+        for y in range(FRAME_HEIGHT)
+    ]
+    color_map = {".": (0, 0, 0), "R": (0, 0, 255), "G": (0, 255, 0), "B": (255, 0, 0)}
+    frames = [
+        FrameData(
+            FRAME_WIDTH,
+            FRAME_HEIGHT,
+            gen_color_bitmap(*rows, color_map=color_map),
+            FrameData.COLOR_DEPTH_RGB,
+        )
+        for _ in range(4)
+    ]
+    return AnimationData(frames, 100, 0, Effect.NONE)
+
+
+def font_payload():
+    font_data = find_and_load_font("6x12")
+    text = "The quick brown fox jumps over the lazy dog!"
+    return FontData(create_font_characters(text, font_data, FRAME_HEIGHT))
+
+
+PAYLOADS = {
+    "brightness": brightness_payload,
+    "short_text": short_text_payload,
+    "animation_20_frames": animation_payload,
+    "rgb_frames": rgb_payload,
+    "font_upload": font_payload,
+}
+
+
+async def bench_case(content, mtu, buffer_size, latency, repeat):
+    device = SimulatedDevice(
+        mtu=mtu, buffer_size=buffer_size, seed=0, **LATENCIES[latency]
+    )
+    sender = LedConnection(
+        device.address, cache=None, client=SimulatedBleakClient(device)
+    )
+    await sender._init()
+    command = SendDataCommand(bytes(content.serialize_view()))
+    payload_size = command.serialized_size()
+
+    timings = []
+    stats_before = dict(device.stats)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await sender.send_data(command)
+        timings.append(time.perf_counter() - start)
+    await sender.disconnect()
+
+    median = statistics.median(timings)
+    return {
+        "payload_bytes": payload_size,
+        "mtu": mtu,
+        "buffer_size": buffer_size,
+        "latency": latency,
+        "seconds": {"min": min(timings), "median": median, "max": max(timings)},
+        "bytes_per_second": payload_size / median if median else None,
+        "writes_per_transfer": (device.stats["data_writes"] - stats_before["data_writes"])
+        / repeat,
+        "continues_per_transfer": (device.stats["continues"] - stats_before["continues"])
+        / repeat,
+        "pauses": device.stats["pauses"] - stats_before["pauses"],
+        # mean seconds per transfer spent in each phase of send_data
+        "phases": {
+            phase: sender.metrics.histograms[phase].sum / repeat
+            for phase in TRANSFER_PHASES
+        },
+    }
+
+
+async def run(repeat, mtus, buffer_sizes, latencies):
+    results = []
+    for name, payload in PAYLOADS.items():
+        content = payload()
+        for latency in latencies:
+            for mtu in mtus:
+                for buffer_size in buffer_sizes:
+                    result = await bench_case(content, mtu, buffer_size, latency, repeat)
+                    result["payload"] = name
+                    results.append(result)
+                    print(
+                        f"{name:20} {latency:5} mtu={mtu:<4} buffer={buffer_size:<5} "
+                        f"{result['seconds']['median'] * 1000:8.2f} ms "
+                        f"{result['bytes_per_second'] / 1024:9.1f} KiB/s",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="transfers per case")
+    parser.add_argument(
+        "--quick", action="store_true", help="only the largest MTU and buffer size"
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    mtus = MTUS[-1:] if args.quick else MTUS
+    buffer_sizes = BUFFER_SIZES[-1:] if args.quick else BUFFER_SIZES
+    results = asyncio.run(run(args.repeat, mtus, buffer_sizes, list(LATENCIES)))
+
+    report = {
+        "benchmark": "transfer",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == "__main__":
+    main()
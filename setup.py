@@ -19,6 +19,9 @@ setup(
         'gattlib': [
             'gattlib',
         ],
+        'numpy': [
+            'numpy',
+        ],
     },
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -28,7 +31,7 @@ setup(
     python_requires='>=3.8',
     include_package_data=True,
     package_data={
-        "spotled_bleak": ["fonts/*.yaff"],
+        "spotled": ["fonts/*.yaff", "fonts/*.spf"],
     },
 )
 
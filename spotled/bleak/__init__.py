@@ -1,53 +1,243 @@
 from bleak import BleakClient, BleakGATTCharacteristic, BleakScanner
-from asyncio import Event
-import time
+import asyncio
+import logging
 import os.path
+import time
 
 from .models.commands import * 
 from .models.animation import * 
 from .models.enums import *
 from .models.responses import * 
 from .graphics import *
+from .frame import *
 from .fontops import *
+from .dispatch import *
+from .devicecache import *
+from .fleet import *
+from .scheduler import *
+from .metrics import *
+from .trace import *
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MTU = 23
+# ATT MTUs stepped down through, largest first, when the device rejects writes
+MTU_FALLBACK = (247, 185, 128, 64, DEFAULT_MTU)
+
+SERVICE_UUID = "0000ff20-0000-1000-8000-00805f9b34fb"
+CMD_CHARACTERISTIC_UUID = "0000ff21-0000-1000-8000-00805f9b34fb"
+DATA_CHARACTERISTIC_UUID = "0000ff22-0000-1000-8000-00805f9b34fb"
+
+
+class TransferTimeouts:
+    """
+    Deadlines in seconds for each phase of talking to the device.
+    command bounds the reply to a query_command, start the SendingDataResponse
+    that opens a transfer, ack every ContinueSendingResponse and finish the
+    reply to SendingDataFinishCommand. total optionally bounds a whole
+    send_data call including its retries and connect bounds establishing
+    the bluetooth connection.
+    """
+
+    def __init__(
+        self, command=0.2, start=0.2, ack=0.2, finish=0.2, total=None, connect=5.0
+    ):
+        self.command = command
+        self.start = start
+        self.ack = ack
+        self.finish = finish
+        self.total = total
+        self.connect = connect
+
+    @classmethod
+    def coerce(cls, timeout):
+        """
+        Accepts a TransferTimeouts or a single number used for every phase.
+        """
+        if isinstance(timeout, cls):
+            return timeout
+        return cls(timeout, timeout, timeout, timeout)
+
+
+class TransferError(Exception):
+    """
+    The device could not receive a transfer. Like a TimeoutError, it is
+    retried by send_data and raised once all attempts failed.
+    """
+
+
+async def _wait_with_timeout(awaitable, timeout, what):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        # asyncio.TimeoutError is only an alias of TimeoutError from Python 3.11 on
+        raise TimeoutError(f"Timeout exceeded waiting for {what}.") from None
 
 
 class LedConnection:
-    def __init__(self, address):
-        self.mtu = 23
-        self.connection = BleakClient(address)
-        self.connection.on_connect = lambda mtu: self._set_mtu(mtu)
-        self.current_wait_event = Event()
-        self.last_data = None
+    def __init__(
+        self,
+        address,
+        timeouts=None,
+        cache=device_cache,
+        client=None,
+        metrics=None,
+        trace=None,
+    ):
+        """
+        cache is the DeviceCache remembering handles and display properties
+        between connections, None disables caching. client replaces the
+        BleakClient created for address, e.g. with a SimulatedBleakClient.
+        metrics is the TransferMetrics every send_data is recorded in, a new
+        one by default. trace is a TraceRecorder or the path of a file all
+        traffic with the device is recorded to, see spotled.bleak.trace.
+        """
+        self.timeouts = TransferTimeouts() if timeouts is None else timeouts
+        self.cache = cache
+        self.metrics = TransferMetrics() if metrics is None else metrics
+        # background check of cached capabilities started by _init, if any
+        self.revalidation = None
+        self.mtu = DEFAULT_MTU
+        # upper bound for the MTU once the device rejected a larger one
+        self.max_mtu = None
+        self.connection = BleakClient(address) if client is None else client
+        self.trace = trace
+        # a recorder created here is closed again by disconnect
+        self._owns_trace = trace is not None and not isinstance(trace, TraceRecorder)
+        if self._owns_trace:
+            self.trace = TraceRecorder(
+                trace, address=getattr(address, "address", address)
+            )
+        if self.trace is not None:
+            self.connection = TracingClient(self.connection, self.trace)
+        self.dispatcher = ResponseDispatcher()
         self.data_serial_no = 0
         self.command_serial_no = 0
+        self._connect_lock = asyncio.Lock()
+        # transfers share the data characteristic and cannot be interleaved
+        self._transfer_lock = asyncio.Lock()
 
     async def _init(self):
         await self._ensure_connection()
-        self.cmd_handle, self.data_handle = (
-            self.connection.services.services[75].characteristics[0],
-            self.connection.services.services[75].characteristics[1],
+
+        cached = self._cached()
+        capabilities = cached.get("capabilities")
+        if capabilities is None:
+            await self._query_capabilities()
+            return
+
+        # trust what the device reported last time and check in the background
+        # whether its firmware changed since
+        self._apply_capabilities(capabilities)
+        self.brightness = cached.get("brightness")
+        self.revalidation = asyncio.ensure_future(
+            self._revalidate_capabilities(capabilities.get("firmware"))
         )
-        await self.connection.write_gatt_char(self.cmd_handle, b"\x00\x00\x00\x01")
-        await self.connection.start_notify(self.cmd_handle, self._on_notification)
 
-        self.buffer_size = (
-            await self.query_command(GetBufferSizeCommand())
+    async def _query_capabilities(self, firmware=None, attempts=5):
+        if firmware is None:
+            version = await self.query_command(GetVersionCommand(), attempts=attempts)
+            firmware = [
+                version.device_type,
+                version.device_revision,
+                version.software_revision,
+            ]
+        buffer_size = (
+            await self.query_command(GetBufferSizeCommand(), attempts=attempts)
         ).buffer_size
-        
-        display_info = await self.query_command(GetDisplayInfoCommand())
-        self.width = display_info.width
-        self.height = display_info.height
-        self.frame_limit = display_info.frame_limit
+        display_info = await self.query_command(
+            GetDisplayInfoCommand(), attempts=attempts
+        )
+
+        capabilities = {
+            "firmware": firmware,
+            "buffer_size": buffer_size,
+            "width": display_info.width,
+            "height": display_info.height,
+            "frame_limit": display_info.frame_limit,
+            "color_depth": display_info.color_depth,
+        }
+        self._apply_capabilities(capabilities)
         self.brightness = display_info.brightness
-        self.color_depth = display_info.color_depth
+        self._update_cache(capabilities=capabilities, brightness=self.brightness)
+
+    async def _revalidate_capabilities(self, firmware):
+        """
+        Queries the firmware version and, only if it differs from the one the
+        cached capabilities were recorded for, the capabilities themselves.
+        Failures are logged and leave the cached values in place.
+        """
+        try:
+            # a single attempt, retrying would disconnect under a running transfer
+            version = await self.query_command(GetVersionCommand(), attempts=0)
+            current = [
+                version.device_type,
+                version.device_revision,
+                version.software_revision,
+            ]
+            if current != firmware:
+                logger.info(
+                    "Firmware of %s changed, updating its capabilities",
+                    self.connection.address,
+                )
+                await self._query_capabilities(current, attempts=0)
+        except Exception:
+            logger.warning("Could not revalidate cached capabilities", exc_info=True)
+
+    def _apply_capabilities(self, capabilities):
+        self.firmware = tuple(capabilities["firmware"])
+        self.buffer_size = capabilities["buffer_size"]
+        self.width = capabilities["width"]
+        self.height = capabilities["height"]
+        self.frame_limit = capabilities["frame_limit"]
+        self.color_depth = capabilities["color_depth"]
+
+    def _cached(self):
+        if self.cache is None:
+            return {}
+        return self.cache.get(self.connection.address)
+
+    def _update_cache(self, **values):
+        if self.cache is not None:
+            self.cache.update(self.connection.address, **values)
 
     def _on_notification(self, handle, data):
         if handle == self.cmd_handle:
-            self.last_data = data
-            self.current_wait_event.set()
+            self.dispatcher.dispatch(data)
 
-    def _set_mtu(self, mtu):
-        self.mtu = mtu
+    async def _negotiate_mtu(self):
+        """
+        Reads the ATT MTU negotiated for the connection. The MTU exchange
+        itself is done by the OS; BlueZ only reports the result once a write
+        has been acquired, which bleak leaves to the caller.
+        """
+        backend = getattr(self.connection, "_backend", None)
+        acquire_mtu = getattr(backend, "_acquire_mtu", None)
+        if acquire_mtu is not None:
+            try:
+                await acquire_mtu()
+            except Exception:
+                logger.debug("Could not acquire the MTU", exc_info=True)
+        try:
+            mtu = self.connection.mtu_size
+        except Exception:
+            mtu = DEFAULT_MTU
+        if self.max_mtu is not None:
+            mtu = min(mtu, self.max_mtu)
+        self.mtu = max(mtu, DEFAULT_MTU)
+
+    def _reduce_mtu(self):
+        """
+        Steps down the MTU fallback ladder after the device failed to read a write.
+        """
+        mtu = next((mtu for mtu in MTU_FALLBACK if mtu < self.mtu), DEFAULT_MTU)
+        if mtu != self.mtu:
+            logger.info(
+                "Device rejected %s byte writes, falling back to MTU %s",
+                self.mtu - 3,
+                mtu,
+            )
+        self.mtu = self.max_mtu = mtu
 
     def _next_data_serial_no(self):
         self.data_serial_no = (self.data_serial_no + 1) & 0xFFFFFFFF
@@ -58,18 +248,66 @@ class LedConnection:
         return self.command_serial_no
 
     async def _ensure_connection(self):
-        if not self.connection.is_connected:
+        if self.connection.is_connected:
+            return
+        # only one coroutine connects, the others wait for it to finish
+        async with self._connect_lock:
+            if self.connection.is_connected:
+                return
+            await _wait_with_timeout(
+                self._connect(), self.timeouts.connect, "bluetooth connection"
+            )
             try:
-                await self.connection.connect()
-            except:
-                # will sometimes throw if already trying to connect
-                pass
-            for _ in range(50):
-                if self.connection.is_connected:
-                    break
-                time.sleep(0.1)
-            else:
-                raise TimeoutError("Timeout exceeded waiting for bluetooth connection.")
+                await self._setup_connection()
+            except BaseException:
+                # a connection without handles or notifications is unusable,
+                # and while it stays up the next call would skip the setup
+                await self.connection.disconnect()
+                raise
+
+    async def _connect(self):
+        try:
+            await self.connection.connect()
+        except Exception:
+            # will sometimes throw if already trying to connect
+            pass
+        while not self.connection.is_connected:
+            await asyncio.sleep(0.1)
+
+    def _find_characteristics(self):
+        """
+        Looks up the command and data characteristics, by their cached
+        handles if possible and by UUID otherwise.
+        """
+        services = self.connection.services
+        cached = self._cached()
+        if "cmd_handle" in cached and "data_handle" in cached:
+            cmd_handle = services.get_characteristic(cached["cmd_handle"])
+            data_handle = services.get_characteristic(cached["data_handle"])
+            if (
+                cmd_handle is not None
+                and data_handle is not None
+                and cmd_handle.uuid == CMD_CHARACTERISTIC_UUID
+                and data_handle.uuid == DATA_CHARACTERISTIC_UUID
+            ):
+                return cmd_handle, data_handle
+
+        service = services.get_service(SERVICE_UUID)
+        if service is None:
+            raise Exception("The device does not provide the SpotLED service.")
+        cmd_handle = service.get_characteristic(CMD_CHARACTERISTIC_UUID)
+        data_handle = service.get_characteristic(DATA_CHARACTERISTIC_UUID)
+        if cmd_handle is None or data_handle is None:
+            raise Exception("The device does not provide the SpotLED characteristics.")
+        self._update_cache(cmd_handle=cmd_handle.handle, data_handle=data_handle.handle)
+        return cmd_handle, data_handle
+
+    async def _setup_connection(self):
+        self.cmd_handle, self.data_handle = self._find_characteristics()
+        # notifications have to be enabled again after every reconnect
+        await self.connection.write_gatt_char(self.cmd_handle, b"\x00\x00\x00\x01")
+        await self.connection.start_notify(self.cmd_handle, self._on_notification)
+        await self._negotiate_mtu()
 
     async def send_command(self, command):
         """
@@ -77,104 +315,255 @@ class LedConnection:
         Used for basic commands and data sending flow control.
         """
         await self._ensure_connection()
-        self.current_wait_event.clear()
-        await self.connection.write_gatt_char(self.cmd_handle, command.serialize())
+        # a reply to this command is what wait_for_response returns
+        self.dispatcher.take_unclaimed()
+        await self.connection.write_gatt_char(
+            self.cmd_handle, command.serialize_view()
+        )
 
-    async def query_command(self, command, timeout=0.2, attempts=5):
+    async def query_command(self, command, timeout=None, attempts=5):
         """
         Send a control command to the device and wait for a response.
         Used for basic commands and data sending flow control.
+        Only the response type the command is answered with is accepted,
+        see RESPONSE_TYPES. timeout defaults to timeouts.command.
         """
+        if timeout is None:
+            timeout = self.timeouts.command
+        match = match_response(RESPONSE_TYPES.get(type(command)))
         for i in range(attempts + 1):
+            # register before writing so a fast reply cannot be missed
+            response = self.dispatcher.expect(match)
             try:
                 await self.send_command(command)
-                return await self.wait_for_response(timeout)
+                return await _wait_with_timeout(response, timeout, "GATT response")
             except TimeoutError:
                 if i == attempts:
                     raise
                 await self.connection.disconnect()
+            finally:
+                response.cancel()
 
-    async def wait_for_response(self, timeout=0.2):
+    async def wait_for_response(self, timeout=None):
         """
-        Wait for and return a response, usually from a command sent via send_command.
+        Wait for and return the next response no other request is waiting for,
+        usually from a command sent via send_command. A response that arrived
+        since the last send_command is returned right away. Raises
+        TimeoutError if none arrives within timeout seconds (timeouts.command
+        by default). query_command also checks the response type.
         """
-        if not await self.current_wait_event.wait():
-            raise TimeoutError("Timeout exceeded waiting for GATT response.")
-        return getCommandResponse(self.last_data)
-
-    async def _send_data_internal(self, data_command, timeout=0.2):
+        if timeout is None:
+            timeout = self.timeouts.command
+        unclaimed = self.dispatcher.take_unclaimed()
+        if unclaimed is not None:
+            return unclaimed
+        response = self.dispatcher.expect(match_response())
+        try:
+            return await _wait_with_timeout(response, timeout, "GATT response")
+        finally:
+            response.cancel()
+
+    async def _send_data_internal(self, data_command, timeouts, transfer):
+        transfer.enter("connect")
+        if not self.connection.is_connected:
+            transfer.reconnects += 1
         await self._ensure_connection()
         data_command.serial_no = self._next_data_serial_no()
         serial_no = self._next_command_serial_no()
 
-        payload = data_command.serialize()
-        await self.send_command(
-            SendingDataStartCommand(serial_no, data_command.command_type, len(payload))
+        payload = data_command.serialize_view()
+        # responses of other transfers carry other serial numbers and are dropped
+        started = self.dispatcher.expect(match_response(SendingDataResponse, serial_no))
+        acks = self.dispatcher.subscribe(
+            match_response(FLOW_CONTROL_RESPONSES, serial_no)
         )
-        response = await self.wait_for_response(timeout)
-        assert type(response) == SendingDataResponse
-        assert response.serial_no == serial_no
-        assert response.command_type == data_command.command_type
-        assert response.error_code == 0
+        finished = None
+        try:
+            transfer.enter("handshake")
+            await self.send_command(
+                SendingDataStartCommand(
+                    serial_no, data_command.command_type, len(payload)
+                )
+            )
+            response = await _wait_with_timeout(
+                started, timeouts.start, "the transfer to start"
+            )
+            assert response.command_type == data_command.command_type
+            assert response.error_code == 0
 
-        seek = 0
-        sent_payloads = 0
-        send_size = self.mtu - 3
-        send_count = self.buffer_size // send_size
+            await self._write_payload(
+                payload, data_command.command_type, acks, timeouts, transfer
+            )
 
-        
+            transfer.enter("finish")
+            finished = self.dispatcher.expect(
+                match_response(
+                    serial_no=serial_no,
+                    exclude=FLOW_CONTROL_RESPONSES + QUERY_RESPONSES,
+                )
+            )
+            await self.send_command(
+                SendingDataFinishCommand(
+                    serial_no, data_command.command_type, len(payload)
+                )
+            )
+            response = await _wait_with_timeout(
+                finished, timeouts.finish, "the transfer to finish"
+            )
+            # the last window is never acked, so a pause for its writes (all
+            # of them, for payloads smaller than the buffer) only shows up
+            # now. It lowers the MTU and the retry resends everything
+            while not acks.empty():
+                ack = acks.get_nowait()
+                self._apply_flow_control(
+                    ack, data_command.command_type, len(payload), 0, transfer
+                )
+                if type(ack) == PauseSendingResponse:
+                    raise TransferError(
+                        "The device paused the transfer after its last write."
+                    )
+            if getattr(response, "error_code", 0) != 0:
+                # the status layout is unconfirmed, see SendingDataFinishResponse
+                logger.warning(
+                    "The device reported status %s finishing the transfer.",
+                    response.error_code,
+                )
+        finally:
+            transfer.enter(None)
+            started.cancel()
+            if finished is not None:
+                finished.cancel()
+            self.dispatcher.unsubscribe(acks)
+
+    async def _write_payload(self, payload, command_type, acks, timeouts, transfer):
+        """
+        Streams payload to the data characteristic, treating the device
+        buffer as a credit window: no more than buffer_size bytes past the
+        last position the device confirmed are ever in flight. Flow control
+        that arrived in the meantime is applied before every chunk without
+        waiting; the transfer only blocks when the window is used up.
+        """
+        seek = 0
+        acked = 0
+        transfer.enter("writes")
         while seek < len(payload):
-            self.current_wait_event.clear()
+            while not acks.empty():
+                seek, acked = self._apply_flow_control(
+                    acks.get_nowait(), command_type, seek, acked, transfer
+                )
+            # the MTU shrinks if the device pauses, a chunk larger than
+            # the whole window could never be sent
+            send_size = min(self.mtu - 3, self.buffer_size)
+            end = min(seek + send_size, len(payload))
+            if end - acked > self.buffer_size:
+                transfer.enter("stalls")
+                transfer.stall_count += 1
+                response = await _wait_with_timeout(
+                    acks.get(), timeouts.ack, "the device to accept more data"
+                )
+                transfer.enter("writes")
+                seek, acked = self._apply_flow_control(
+                    response, command_type, seek, acked, transfer
+                )
+                continue
 
             await self.connection.write_gatt_char(
-                self.data_handle, payload[seek : seek + send_size], response=False
+                self.data_handle, payload[seek:end], response=False
             )
-            sent_payloads += 1
-            seek += send_size
-            
-
-            if sent_payloads >= send_count:
-                sent_payloads = 0
-                
-                response = await self.wait_for_response(timeout)
-                assert type(response) == ContinueSendingResponse
-                assert response.serial_no == serial_no
-                assert response.command_type == data_command.command_type
-                seek = response.continue_from
-
-            
-
-        await self.send_command(
-            SendingDataFinishCommand(serial_no, data_command.command_type, len(payload))
-        )
-        await self.wait_for_response(timeout)
+            transfer.chunks += 1
+            transfer.bytes_sent += end - seek
+            seek = end
 
-    async def send_data(self, data_command, timeout=0.2, attempts=5):
+    def _apply_flow_control(self, response, command_type, seek, acked, transfer):
         """
-        Send a data command to the device.
-        Currently only SendDataCommand is used, which accepts raw serialized data.
+        Returns the new (seek, acked) positions after a flow control response.
         """
+        assert response.command_type == command_type
+        if type(response) == ContinueSendingResponse:
+            transfer.continues += 1
+            # everything before continue_from arrived. Writes past it may
+            # still be in flight, so this only ever moves forward; lost
+            # writes keep the window from completing and time out instead
+            return max(seek, response.continue_from), response.continue_from
+        # the device failed to read the data after offset bytes of the
+        # current window, usually because of the write size: resend from
+        # that point in smaller chunks (see PauseSendingResponse)
+        logger.debug("Device paused the transfer at window offset %s", response.offset)
+        transfer.pauses += 1
+        if self.mtu <= DEFAULT_MTU:
+            # every pause lowers the MTU, so this bounds the pauses per attempt
+            raise TransferError("The device cannot read even the smallest writes.")
+        self._reduce_mtu()
+        return acked + response.offset, acked
+
+    async def _send_data_attempts(self, data_command, timeouts, attempts, transfer):
+        transfer.enter("queued")
+        async with self._transfer_lock:
+            await self._send_data_retrying(data_command, timeouts, attempts, transfer)
+
+    async def _send_data_retrying(self, data_command, timeouts, attempts, transfer):
         for i in range(attempts + 1):
+            transfer.attempts += 1
             try:
-                await self._send_data_internal(data_command, timeout)
+                await self._send_data_internal(data_command, timeouts, transfer)
                 return
-            except TimeoutError:
+            except (TimeoutError, TransferError):
                 if i == attempts:
+                    # what we remember about the device may be what is wrong
+                    if self.cache is not None:
+                        self.cache.forget(self.connection.address)
                     raise
                 await self.connection.disconnect()
 
+    async def send_data(self, data_command, timeout=None, attempts=5):
+        """
+        Send a data command to the device.
+        Currently only SendDataCommand is used, which accepts raw serialized data.
+        timeout is either a TransferTimeouts or a number of seconds allowed for
+        every phase, and defaults to the connection's timeouts.
+        Every call is recorded in metrics, whether it succeeds or not.
+        Raises TimeoutError or TransferError once all attempts failed.
+        """
+        timeouts = self.timeouts if timeout is None else TransferTimeouts.coerce(timeout)
+        transfer = TransferRecord(
+            self.connection.address,
+            data_command.command_type,
+            data_command.serialized_size(),
+        )
+        error = None
+        try:
+            if timeouts.total is None:
+                await self._send_data_attempts(
+                    data_command, timeouts, attempts, transfer
+                )
+            else:
+                await _wait_with_timeout(
+                    self._send_data_attempts(
+                        data_command, timeouts, attempts, transfer
+                    ),
+                    timeouts.total,
+                    "the data transfer",
+                )
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            transfer.finish(error)
+            self.metrics.record(transfer)
+
     async def set_brightness(self, brightness):
         """
         Sets the display brightness. 0 is lowest and 100 is highest.
         """
-        await self.send_data(SendDataCommand(BrightnessData(brightness).serialize()))
+        await self.send_data(SendDataCommand(BrightnessData(brightness)))
         self.brightness = brightness
+        self._update_cache(brightness=brightness)
 
     async def set_screen_mode(self, mode: ScreenMode):
         """
         This allows flipping and mirroring the display. See ScreenMode Enum.
         """
-        await self.send_data(SendDataCommand(ScreenModeData(mode.value).serialize()))
+        await self.send_data(SendDataCommand(ScreenModeData(mode.value)))
 
     async def set_text_by_chars(
         self, text, effect=Effect.SCROLL_LEFT, font="6x12", speed=0, char_limit=72
@@ -188,8 +577,8 @@ class LedConnection:
 
         font_data = find_and_load_font(font)
         font_characters = create_font_characters(text, font_data, self.height)
-        font_character_data = SendDataCommand(FontData(font_characters).serialize())
-        text_data = SendDataCommand(TextData(text, speed, effect).serialize())
+        font_character_data = SendDataCommand(FontData(font_characters))
+        text_data = SendDataCommand(TextData(text, speed, effect))
         await self.send_data(font_character_data)
         await self.send_data(text_data)
 
@@ -207,31 +596,20 @@ class LedConnection:
         """
         Sends multi-line text as an animation. Can pack two lines of text onto the display.
         """
-        font_data = find_and_load_font(font)
-
-        if reflow:
-            lines = reflow_text(text, font_data, self.width)
-        else:
-            lines = text.replace("\r", "").split("\n")
-
-        frames = lines_to_frames(
-            lines, font_data, align, self.width, self.height // line_height, line_height
-        )
-
-        
-        if len(frames) > self.frame_limit:
-            raise ValueError("The animation exceeds the device frame limit.")
-
         frame_data = SendDataCommand(
-            AnimationData(
-                [
-                    FrameData(self.width, self.height, gen_bitmap(*frame))
-                    for frame in frames
-                ],
-                int(frame_duration * 1000),
-                speed,
+            text_lines_animation(
+                text,
+                self.width,
+                self.height,
+                self.frame_limit,
+                align,
+                font,
+                frame_duration,
+                line_height,
                 effect,
-            ).serialize()
+                speed,
+                reflow,
+            )
         )
 
         await self.send_data(frame_data)
@@ -266,30 +644,30 @@ class LedConnection:
                 0,
                 0,
                 Effect.NONE,
-            ).serialize()
+            )
         )
 
         await self.send_data(frame_data)
 
     async def disconnect(self):
+        if self.revalidation is not None:
+            self.revalidation.cancel()
         await self.connection.disconnect()
+        if self._owns_trace:
+            self.trace.close()
 
 
-async def createLedConnection():
-    device = None
-
-    for _ in range(50):
-         try:
-             device = await BleakScanner.find_device_by_filter(lambda d, ad: "SpotLED" in ad.local_name)
-         except TypeError:
-             pass
-         else:
-             break
-         time.sleep(0.1)
+async def createLedConnection(name="SpotLED", scan_timeout=10.0, timeouts=None):
+    """
+    Scans for the first device advertising a name containing name and connects to it.
+    """
+    device = await BleakScanner.find_device_by_filter(
+        lambda d, ad: name in (ad.local_name or ""), timeout=scan_timeout
+    )
 
     if device is None:
         raise Exception("No device found")
 
-    sender = LedConnection(device)
+    sender = LedConnection(device, timeouts)
     await sender._init()
     return sender
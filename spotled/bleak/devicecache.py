@@ -0,0 +1,117 @@
+import json
+import os
+import os.path
+import tempfile
+import threading
+
+
+def user_cache_dir():
+    """
+    The directory spotled keeps its caches in, spotled in the user's cache
+    directory ($XDG_CACHE_HOME or ~/.cache).
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "spotled")
+
+
+def default_cache_path():
+    """
+    The cache file used when none is given: $SPOTLED_CACHE, or
+    devices.json in user_cache_dir().
+    """
+    path = os.environ.get("SPOTLED_CACHE")
+    if path:
+        return path
+    return os.path.join(user_cache_dir(), "devices.json")
+
+
+class DeviceCache:
+    """
+    Remembers what was learned about each device in a JSON file, keyed by
+    device address, so reconnecting can skip GATT discovery and the startup
+    queries. The gattlib backend reads and writes the same file. A missing
+    or unreadable file is treated as empty and failing to write it is not
+    an error, the cache only saves time.
+
+    The entries are kept in memory. The file is only parsed again when
+    another process changed it, and only written when a value changes.
+    """
+
+    def __init__(self, path=None):
+        self.path = default_cache_path() if path is None else path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._stamp = None
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        stamp = self._file_stamp()
+        if self._entries is not None and stamp == self._stamp:
+            return self._entries
+        try:
+            with open(self.path) as fh:
+                entries = json.load(fh)
+        except (OSError, ValueError):
+            entries = {}
+        self._entries = entries if isinstance(entries, dict) else {}
+        self._stamp = stamp
+        return self._entries
+
+    def _store(self, entries):
+        # write to a temporary file first so readers never see a partial file
+        directory = os.path.dirname(self.path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix="devices.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(entries, fh, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            pass
+        self._stamp = self._file_stamp()
+
+    def get(self, address):
+        """
+        Returns the cached entry for address, an empty dict if there is none.
+        """
+        with self._lock:
+            return dict(self._load().get(address.upper(), {}))
+
+    def update(self, address, **values):
+        """
+        Merges values into the entry for address and writes the file if
+        that changed anything.
+        """
+        with self._lock:
+            entries = self._load()
+            entry = entries.setdefault(address.upper(), {})
+            # compare in JSON form, tuples and lists are both stored as lists
+            changed = {
+                key: value
+                for key, value in values.items()
+                if key not in entry or json.dumps(entry[key]) != json.dumps(value)
+            }
+            if changed:
+                entry.update(json.loads(json.dumps(changed)))
+                self._store(entries)
+
+    def forget(self, address):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(address.upper(), None) is not None:
+                self._store(entries)
+
+
+device_cache = DeviceCache()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from .models.commands import (
+    GetBufferSizeCommand,
+    GetDisplayInfoCommand,
+    GetVersionCommand,
+)
+from .models.responses import *
+
+logger = logging.getLogger(__name__)
+
+# the response each query command is answered with
+RESPONSE_TYPES = {
+    GetBufferSizeCommand: BufferSizeResponse,
+    GetDisplayInfoCommand: DisplayInfoResponse,
+    GetVersionCommand: VersionResponse,
+}
+QUERY_RESPONSES = tuple(RESPONSE_TYPES.values())
+FLOW_CONTROL_RESPONSES = (ContinueSendingResponse, PauseSendingResponse)
+
+
+def match_response(response_type=None, serial_no=None, exclude=()):
+    """
+    Builds a predicate for ResponseDispatcher matching responses of
+    response_type (a class or tuple of classes, any type if None) that are
+    not instances of exclude. If serial_no is given, responses carrying a
+    serial number must carry this one.
+    """
+
+    def match(response):
+        if response_type is not None and not isinstance(response, response_type):
+            return False
+        if exclude and isinstance(response, exclude):
+            return False
+        if serial_no is not None:
+            return getattr(response, "serial_no", serial_no) == serial_no
+        return True
+
+    return match
+
+
+class ResponseDispatcher:
+    """
+    Parses notifications from the command characteristic and routes every
+    response to the request waiting for it. Requests register before
+    writing their command: expect for a single reply, subscribe for a
+    stream of replies such as the flow control of a transfer. Responses
+    nobody is waiting for, like the late reply to a request that already
+    timed out, are logged and dropped; the last of them is kept for
+    take_unclaimed.
+    """
+
+    def __init__(self):
+        self._waiters = []
+        self._subscribers = []
+        self._unclaimed = None
+
+    def expect(self, match):
+        """
+        Returns a future resolved with the first response accepted by match.
+        Cancelling the future (as asyncio.wait_for does on timeout)
+        unregisters it.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((match, future))
+        return future
+
+    def subscribe(self, match):
+        """
+        Returns a queue receiving every response accepted by match
+        until it is passed to unsubscribe.
+        """
+        queue = asyncio.Queue()
+        self._subscribers.append((match, queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers = [
+            (match, q) for match, q in self._subscribers if q is not queue
+        ]
+
+    def dispatch(self, data):
+        """
+        Hands a raw notification to whoever is waiting for it. Single replies
+        take precedence over subscriptions, older requests over newer ones.
+        """
+        try:
+            response = getCommandResponse(data)
+        except Exception:
+            logger.warning("Dropping malformed notification %s", bytes(data).hex())
+            return
+
+        self._waiters = [(m, f) for m, f in self._waiters if not f.done()]
+        for i, (match, future) in enumerate(self._waiters):
+            if match(response):
+                del self._waiters[i]
+                future.set_result(response)
+                return
+
+        for match, queue in self._subscribers:
+            if match(response):
+                queue.put_nowait(response)
+                return
+
+        logger.debug(
+            "Dropping unexpected %s (serial %s)",
+            type(response).__name__,
+            getattr(response, "serial_no", None),
+        )
+        self._unclaimed = response
+
+    def take_unclaimed(self):
+        """
+        Returns and forgets the last response nobody was waiting for, if any.
+        """
+        response, self._unclaimed = self._unclaimed, None
+        return response
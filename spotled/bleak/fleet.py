@@ -0,0 +1,306 @@
+from bleak import BleakScanner
+from collections import Counter, OrderedDict
+import asyncio
+import logging
+import time
+
+from .models.byte import Serializable
+from .models.commands import SendDataCommand
+from .models.enums import Align, Effect
+from .fontops import text_lines_animation
+from .metrics import TransferMetrics, prometheus_text
+
+logger = logging.getLogger(__name__)
+
+
+def display_key(connection):
+    """
+    Devices with equal keys can be sent the same rendered content.
+    """
+    return connection.width, connection.height, connection.color_depth
+
+
+def _text_display_key(connection):
+    # rendered text is also checked against the frame limit
+    return display_key(connection) + (connection.frame_limit,)
+
+
+class DeviceResult:
+    """
+    The outcome of an operation on one device of a fleet: its result or the
+    exception it failed with, and how long it took in seconds.
+    """
+
+    def __init__(self, address, result=None, error=None, latency=0.0):
+        self.address = address
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        outcome = "ok" if self.ok else repr(self.error)
+        return f"<DeviceResult {self.address} {outcome} {self.latency * 1000:.0f}ms>"
+
+
+class LedFleet:
+    """
+    Drives many devices at once. Discovered devices are connected on first
+    use and kept in a pool of live connections; operations fan out to every
+    device (or a chosen subset) with at most max_concurrency of them running
+    at a time. If max_connections is set, the least recently used idle
+    connections are closed to stay below the adapter's connection limit.
+    Every operation returns one DeviceResult per device instead of raising,
+    so a single unreachable device does not hide the others' outcomes.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=4,
+        max_connections=None,
+        connection_factory=None,
+        **connection_options,
+    ):
+        """
+        connection_factory creates a connection from a device, the
+        connection_options (timeouts, cache) and the device's
+        TransferMetrics, LedConnection by default.
+        """
+        if connection_factory is None:
+            from . import LedConnection as connection_factory
+        if max_connections is not None and max_connections < max_concurrency:
+            raise ValueError("max_connections must be at least max_concurrency.")
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.connection_factory = connection_factory
+        self.connection_options = connection_options
+        self.devices = OrderedDict()
+        self.connections = OrderedDict()
+        # address -> TransferMetrics, kept when the connection is replaced
+        self.metrics = {}
+        # address -> task running the connection's _init
+        self._ready = {}
+        self._busy = Counter()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pool_lock = asyncio.Lock()
+
+    async def discover(self, name="SpotLED", scan_timeout=5.0):
+        """
+        Scans for devices advertising a name containing name and adds them to
+        the fleet. Returns the addresses found.
+        """
+        found = await BleakScanner.discover(timeout=scan_timeout, return_adv=True)
+        addresses = []
+        for device, advertisement in found.values():
+            if name in (advertisement.local_name or ""):
+                self.add(device)
+                addresses.append(device.address)
+        return addresses
+
+    def add(self, device):
+        """
+        Adds a device (a BLEDevice or an address) to the fleet.
+        """
+        address = getattr(device, "address", device)
+        self.devices[address] = device
+
+    async def _acquire(self, address):
+        async with self._pool_lock:
+            connection = self.connections.get(address)
+            if connection is not None:
+                self.connections.move_to_end(address)
+            else:
+                if (
+                    self.max_connections is not None
+                    and len(self.connections) >= self.max_connections
+                ):
+                    await self._evict()
+                metrics = self.metrics.setdefault(address, TransferMetrics())
+                connection = self.connection_factory(
+                    self.devices[address], metrics=metrics, **self.connection_options
+                )
+                self.connections[address] = connection
+                self._ready[address] = asyncio.ensure_future(connection._init())
+            ready = self._ready[address]
+        # operations on a device that is still connecting wait for it together
+        await asyncio.shield(ready)
+        return connection
+
+    async def _evict(self):
+        for address in self.connections:
+            if not self._busy[address]:
+                del self._ready[address]
+                await self._disconnect(self.connections.pop(address))
+                return
+
+    async def _drop(self, address):
+        async with self._pool_lock:
+            connection = self.connections.pop(address, None)
+            self._ready.pop(address, None)
+        if connection is not None:
+            await self._disconnect(connection)
+
+    async def _disconnect(self, connection):
+        try:
+            await connection.disconnect()
+        except Exception:
+            logger.debug("Error while disconnecting", exc_info=True)
+
+    async def _run_one(self, address, operation):
+        async with self._semaphore:
+            start = time.monotonic()
+            self._busy[address] += 1
+            try:
+                connection = await self._acquire(address)
+                result = await operation(connection)
+            except Exception as e:
+                logger.warning("Device %s failed: %r", address, e)
+                if not isinstance(e, ValueError):
+                    # reconnect from scratch next time, content the device
+                    # cannot show (ValueError) says nothing about the connection
+                    await self._drop(address)
+                return DeviceResult(address, error=e, latency=time.monotonic() - start)
+            finally:
+                self._busy[address] -= 1
+            return DeviceResult(address, result, latency=time.monotonic() - start)
+
+    async def run(self, operation, addresses=None):
+        """
+        Awaits operation(connection) for every device, or for the given
+        addresses, and returns their DeviceResults in the same order.
+        """
+        if addresses is None:
+            addresses = list(self.devices)
+        return await asyncio.gather(
+            *(self._run_one(address, operation) for address in addresses)
+        )
+
+    async def connect(self, addresses=None):
+        """
+        Connects the devices ahead of time, otherwise this happens on first use.
+        """
+        return await self.run(lambda connection: asyncio.sleep(0), addresses)
+
+    async def send_data(self, data_command, addresses=None, **kwargs):
+        return await self.run(
+            lambda connection: connection.send_data(data_command, **kwargs), addresses
+        )
+
+    async def set_text(self, text, addresses=None, **kwargs):
+        return await self.run(
+            lambda connection: connection.set_text(text, **kwargs), addresses
+        )
+
+    async def set_text_lines(self, text, addresses=None, **kwargs):
+        return await self.run(
+            lambda connection: connection.set_text_lines(text, **kwargs), addresses
+        )
+
+    async def set_brightness(self, brightness, addresses=None):
+        return await self.run(
+            lambda connection: connection.set_brightness(brightness), addresses
+        )
+
+    async def broadcast(self, render, addresses=None, key=display_key, **kwargs):
+        """
+        Sends the same content to many devices, rendering and serializing it
+        once per distinct display instead of once per device. render is
+        called with a connection and returns the content for a
+        SendDataCommand (a model or bytes); it may only depend on the
+        properties key(connection) returns, by default the display size and
+        color depth. Every device then gets its own command header and serial
+        number in front of the shared, already serialized content.
+        """
+        contents = {}
+
+        def content_for(connection):
+            display = key(connection)
+            if display not in contents:
+                try:
+                    content = render(connection)
+                    if isinstance(content, Serializable):
+                        content = bytes(content.serialize_view())
+                    contents[display] = content
+                except Exception as e:
+                    # devices with the same display would fail the same way
+                    contents[display] = e
+            content = contents[display]
+            if isinstance(content, Exception):
+                raise content
+            return content
+
+        return await self.run(
+            lambda connection: connection.send_data(
+                SendDataCommand(content_for(connection)), **kwargs
+            ),
+            addresses,
+        )
+
+    async def broadcast_text_lines(self, text, addresses=None, **kwargs):
+        """
+        Like set_text_lines, but renders the text once per display size,
+        see broadcast. Takes the same keyword arguments as set_text_lines.
+        """
+        return await self.broadcast(
+            lambda connection: text_lines_animation(
+                text,
+                connection.width,
+                connection.height,
+                connection.frame_limit,
+                **kwargs,
+            ),
+            addresses,
+            key=_text_display_key,
+        )
+
+    async def broadcast_text(
+        self, text, addresses=None, effect=Effect.SCROLL_LEFT, font="6x12", speed=0
+    ):
+        """
+        Like set_text, but renders the text once per display size, see broadcast.
+        """
+        return await self.broadcast(
+            lambda connection: text_lines_animation(
+                text,
+                connection.width,
+                connection.height,
+                connection.frame_limit,
+                Align.LEFT,
+                font,
+                line_height=connection.height,
+                effect=effect,
+                speed=speed,
+                reflow=False,
+            ),
+            addresses,
+            key=_text_display_key,
+        )
+
+    def to_prometheus(self, prefix="spotled"):
+        """
+        Renders the transfer metrics of every device in the Prometheus text
+        exposition format, labelled with their address.
+        """
+        return prometheus_text(
+            [
+                ({"address": address}, metrics)
+                for address, metrics in self.metrics.items()
+            ],
+            prefix,
+        )
+
+    async def clear(self, addresses=None):
+        return await self.run(lambda connection: connection.clear(), addresses)
+
+    async def disconnect(self):
+        """
+        Closes every pooled connection.
+        """
+        async with self._pool_lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+            self._ready.clear()
+        await asyncio.gather(*(self._disconnect(c) for c in connections))
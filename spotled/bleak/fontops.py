@@ -1,7 +1,25 @@
 from .models.enums import Effect, Align
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+import mmap
 import os.path
+import re
+import struct
+import sys
+import tempfile
+import threading
 from typing import List
 from .models.font import *
+from .models.animation import AnimationData, FrameData
+from .graphics import gen_bitmap
+from .frame import Frame
+from .fontpack import (
+    PackedFont,
+    PACKED_FONT_EXTENSION,
+    compile_font,
+    font_cache_path,
+    packed_font_path,
+)
 
 
 def parse_yaff_font(fontfile):
@@ -25,6 +43,127 @@ def parse_yaff_font(fontfile):
     return font
 
 
+_YAFF_LABEL = re.compile(rb"^[ \t]*(?:0x|u\+)([0-9a-fA-F]+):[ \t\r]*$", re.MULTILINE)
+_YAFF_INDEX_HEADER = struct.Struct(">4sBxxxQQI")  # magic, version, size, mtime, count
+_YAFF_INDEX_MAGIC = b"SPLI"
+_YAFF_INDEX_VERSION = 1
+
+
+def _parse_yaff_glyph(text):
+    glyph = []
+    for rl in text.splitlines()[1:]:
+        line = rl.strip()
+        if line.startswith("#"):
+            continue
+        if ("." in line or "@" in line) and not ":" in line:
+            glyph.append(line.replace("@", "1"))
+    return tuple(glyph)
+
+
+class LazyYaffFont(Mapping):
+    """
+    A yaff font which is indexed instead of parsed up front. A single scan
+    records the file offset of every glyph label and glyphs are parsed on
+    first access. The index is persisted in the user's cache directory (as
+    .idx) so the scan only happens once per font file.
+    """
+
+    def __init__(self, fontfile, cache_key=None):
+        with open(fontfile, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        stat = os.stat(fontfile)
+        index_file = font_cache_path(fontfile, "idx")
+        offsets = self._read_index(index_file, stat)
+        if offsets is None:
+            offsets = self._scan()
+            self._write_index(index_file, stat, offsets)
+
+        # a label's glyph ends where the next label starts
+        ends = offsets[1][1:] + (len(self._map),)
+        self._offsets = dict(zip(offsets[0], zip(offsets[1], ends)))
+        self._glyphs = {}
+        self.cache_key = cache_key
+        self.memory_size = sys.getsizeof(self._offsets) + len(self._offsets) * 120
+
+    def _scan(self):
+        codepoints = []
+        starts = []
+        for match in _YAFF_LABEL.finditer(self._map):
+            codepoints.append(int(match.group(1), 16))
+            starts.append(match.start())
+        return tuple(codepoints), tuple(starts)
+
+    @staticmethod
+    def _read_index(index_file, stat):
+        try:
+            with open(index_file, "rb") as fh:
+                data = fh.read()
+            magic, version, size, mtime, count = _YAFF_INDEX_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if (
+            magic != _YAFF_INDEX_MAGIC
+            or version != _YAFF_INDEX_VERSION
+            or size != stat.st_size
+            or mtime != stat.st_mtime_ns
+            or len(data) != _YAFF_INDEX_HEADER.size + count * 8
+        ):
+            return None
+        values = struct.unpack_from(f">{count * 2}I", data, _YAFF_INDEX_HEADER.size)
+        return values[:count], values[count:]
+
+    @staticmethod
+    def _write_index(index_file, stat, offsets):
+        codepoints, starts = offsets
+        count = len(codepoints)
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(
+                prefix=os.path.basename(index_file) + ".",
+                suffix=".tmp",
+                dir=os.path.dirname(index_file),
+            )
+        except OSError:
+            # the index is only an optimization, an unwritable cache is fine
+            return
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(
+                    _YAFF_INDEX_HEADER.pack(
+                        _YAFF_INDEX_MAGIC,
+                        _YAFF_INDEX_VERSION,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        count,
+                    )
+                )
+                fh.write(struct.pack(f">{count * 2}I", *codepoints, *starts))
+            os.replace(tmp, index_file)
+        except OSError:
+            os.unlink(tmp)
+
+    def __getitem__(self, char):
+        try:
+            return self._glyphs[char]
+        except KeyError:
+            pass
+        if len(char) != 1 or ord(char) not in self._offsets:
+            raise KeyError(char)
+        start, end = self._offsets[ord(char)]
+        glyph = _parse_yaff_glyph(self._map[start:end].decode())
+        self._glyphs[char] = glyph
+        return glyph
+
+    def __contains__(self, char):
+        return isinstance(char, str) and len(char) == 1 and ord(char) in self._offsets
+
+    def __iter__(self):
+        return map(chr, self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+
 def parse_draw_font(fontfile):
     font = {}
     with open(fontfile) as fh:
@@ -56,15 +195,140 @@ def parse_font(fontfile):
     raise TypeError("Unknown font type.")
 
 
+class Font(Mapping):
+    """
+    An immutable mapping of characters to glyphs. Each glyph is a tuple
+    of row strings consisting of . and 1, so a parsed font can be shared
+    between callers without being corrupted.
+    """
+
+    def __init__(self, glyphs, cache_key=None):
+        self._glyphs = {char: tuple(rows) for char, rows in glyphs.items()}
+        self.cache_key = cache_key
+        self.memory_size = sys.getsizeof(self._glyphs) + sum(
+            sys.getsizeof(char)
+            + sys.getsizeof(rows)
+            + sum(sys.getsizeof(row) for row in rows)
+            for char, rows in self._glyphs.items()
+        )
+
+    def __getitem__(self, char):
+        return self._glyphs[char]
+
+    def __iter__(self):
+        return iter(self._glyphs)
+
+    def __len__(self):
+        return len(self._glyphs)
+
+
+class FontRegistry:
+    """
+    Process-wide cache of parsed fonts. Fonts are keyed by their resolved
+    path and modification time, so editing a font file reloads it. Once the
+    estimated size of all cached fonts exceeds max_bytes, the least recently
+    used fonts are evicted.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.memory_size = 0
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, fontfile):
+        path = os.path.realpath(fontfile)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+
+            for stale_key in [k for k in self._fonts if k[0] == path]:
+                self._remove(stale_key)
+
+            if path.endswith("." + PACKED_FONT_EXTENSION):
+                font = PackedFont(path, key)
+            elif path.endswith(".yaff"):
+                font = LazyYaffFont(path, key)
+            else:
+                font = Font(parse_font(path), key)
+            self._fonts[key] = font
+            self.memory_size += font.memory_size
+            self._evict()
+            return font
+
+    def _remove(self, key):
+        self.memory_size -= self._fonts.pop(key).memory_size
+
+    def _evict(self):
+        # always keep the most recently loaded font, even if it is over budget
+        while self.memory_size > self.max_bytes and len(self._fonts) > 1:
+            self._remove(next(iter(self._fonts)))
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self.memory_size = 0
+
+    def __contains__(self, fontfile):
+        path = os.path.realpath(fontfile)
+        with self._lock:
+            return any(k[0] == path for k in self._fonts)
+
+    def __len__(self):
+        return len(self._fonts)
+
+
+font_registry = FontRegistry()
+
+_compile_lock = threading.Lock()
+
+
+def _is_fresh(packed_font, fontfile):
+    return (
+        os.path.exists(packed_font)
+        and os.stat(packed_font).st_mtime_ns >= os.stat(fontfile).st_mtime_ns
+    )
+
+
+def _find_packed_font(fontfile):
+    """
+    Returns an up to date packed version of fontfile: the one shipped next
+    to it if there is one, otherwise one compiled into the user's cache
+    directory. Returns None if the font can't be compiled.
+    """
+    shipped = os.path.splitext(fontfile)[0] + "." + PACKED_FONT_EXTENSION
+    if _is_fresh(shipped, fontfile):
+        return shipped
+    packed_font = packed_font_path(fontfile)
+    # compile once, other threads wait for the result instead of racing
+    with _compile_lock:
+        if not _is_fresh(packed_font, fontfile):
+            try:
+                os.makedirs(os.path.dirname(packed_font), exist_ok=True)
+                compile_font(fontfile, packed_font)
+            except OSError:
+                return None
+    return packed_font
+
+
 def find_and_load_font(font_name):
     base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../fonts")
     extensions = ["yaff", "draw"]
 
+    packed_font = os.path.join(base_path, f"{font_name}.{PACKED_FONT_EXTENSION}")
+
     # Try to find a file with one of the extensions
     for ext in extensions:
         try_font = os.path.join(base_path, f"{font_name}.{ext}")
         if os.path.exists(try_font):
-            return parse_font(try_font)
+            # no writable cache directory, parse the source instead
+            return font_registry.load(_find_packed_font(try_font) or try_font)
+
+    if os.path.exists(packed_font):
+        return font_registry.load(packed_font)
 
     # If no file is found with the given name and extensions
     raise FileNotFoundError(
@@ -73,15 +337,21 @@ def find_and_load_font(font_name):
 
 
 def pad_character_to_height(char_data: List[str], min_height: int, min_length: int = 0):
+    """
+    Returns the glyph as a tuple with filler lines added above and below
+    (the odd line goes on top) until it is min_height rows tall. char_data
+    itself is never modified, so glyphs from shared fonts are safe to pad.
+    """
     height = len(char_data)
+    if height >= min_height:
+        return tuple(char_data)
+    diff = min_height - height
     filler_line = "." * min_length
-    if height < min_height:
-        diff = min_height - height
-        for _ in range(diff // 2 + diff % 2):
-            char_data.insert(0, filler_line)
-        for _ in range(diff // 2):
-            char_data.append(filler_line)
-    return char_data
+    return (
+        (filler_line,) * (diff // 2 + diff % 2)
+        + tuple(char_data)
+        + (filler_line,) * (diff // 2)
+    )
 
 
 def pad_row_to_width(row_data: str, min_width: int, align: Align = Align.CENTER) -> str:
@@ -113,24 +383,179 @@ def find_char_in_font(char: str, font_data: dict[str : List[str]]) -> List[str]:
             return font_data[" "]
 
 
+_GLYPH_BITS = str.maketrans(".1", "01")
+
+GlyphRaster = namedtuple(
+    "GlyphRaster", ["width", "height", "rows", "bitmap", "row_bits"]
+)
+
+
+def pack_glyph(glyph, min_height=0, min_width=0) -> GlyphRaster:
+    """
+    Pads a glyph to at least min_height rows (centered vertically) and
+    min_width columns (left aligned) and packs it. rows holds one integer
+    per row, row_bits the same rows as strings of 0 and 1, and bitmap is
+    the same data as gen_bitmap produces.
+    """
+    glyph_height = len(glyph)
+    height = max(glyph_height, min_height)
+    width = max(len(glyph[0]) if glyph else 0, min_width)
+    top = (height - glyph_height + 1) // 2
+    rows = [0] * height
+    for i, glyph_row in enumerate(glyph):
+        if glyph_row:
+            rows[top + i] = int(glyph_row.translate(_GLYPH_BITS), 2) << (
+                width - len(glyph_row)
+            )
+    return _glyph_raster(width, rows)
+
+
+def pack_glyph_bitmap(
+    glyph_width, glyph_height, bitmap, min_height=0, min_width=0
+) -> GlyphRaster:
+    """
+    Same as pack_glyph, but for a glyph given as a bitmap with byte aligned
+    rows, as stored in packed fonts.
+    """
+    height = max(glyph_height, min_height)
+    width = max(glyph_width, min_width)
+    top = (height - glyph_height + 1) // 2
+    stride = (glyph_width + 7) // 8
+    shift = stride * 8 - glyph_width
+    rows = [0] * height
+    for i in range(glyph_height):
+        row = int.from_bytes(bitmap[i * stride : (i + 1) * stride], "big")
+        rows[top + i] = row >> shift << (width - glyph_width)
+    return _glyph_raster(width, rows)
+
+
+def _glyph_raster(width, rows):
+    stride = (width + 7) // 8
+    bitmap = b"".join(
+        (row << (stride * 8 - width)).to_bytes(stride, "big") for row in rows
+    )
+    row_bits = tuple(format(row, f"0{width}b") if width else "" for row in rows)
+    return GlyphRaster(width, len(rows), tuple(rows), bitmap, row_bits)
+
+
+def _pack_char(font_data, char, min_height, min_width):
+    if not isinstance(font_data, PackedFont):
+        return pack_glyph(find_char_in_font(char, font_data), min_height, min_width)
+    # packed fonts hand out their bitmaps directly, without going through rows
+    # of strings; the fallbacks are the same as find_char_in_font's
+    for fallback in (char, "\ufffd", "\x00"):
+        try:
+            return pack_glyph_bitmap(
+                *font_data.glyph_bitmap(fallback), min_height, min_width
+            )
+        except KeyError:
+            pass
+    return pack_glyph_bitmap(*font_data.glyph_bitmap(" "), min_height, min_width)
+
+
+class GlyphCache:
+    """
+    Bounded LRU cache of packed glyphs, keyed by (font, character, line
+    height, min width), so repeated characters and messages skip padding
+    and packing. Only fonts loaded through the font registry are cached,
+    since plain dicts have no stable identity. hits and misses can be used
+    to tune max_entries.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, font_data, char, min_height=0, min_width=0) -> GlyphRaster:
+        font_key = getattr(font_data, "cache_key", None)
+        if font_key is None:
+            return _pack_char(font_data, char, min_height, min_width)
+
+        key = (font_key, char, min_height, min_width)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self.hits += 1
+                self._glyphs.move_to_end(key)
+                return glyph
+            self.misses += 1
+
+        # glyph records are immutable, so a concurrent miss just packs twice
+        glyph = _pack_char(font_data, char, min_height, min_width)
+        with self._lock:
+            self._glyphs[key] = glyph
+            while len(self._glyphs) > self.max_entries:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def get_many(self, font_data, chars, min_height=0, min_width=0):
+        """
+        Same as get for several characters, taking the lock once instead of
+        once per character. Returns a dict of character to glyph.
+        """
+        font_key = getattr(font_data, "cache_key", None)
+        if font_key is None:
+            return {
+                char: _pack_char(font_data, char, min_height, min_width)
+                for char in chars
+            }
+
+        glyphs = {}
+        missing = []
+        with self._lock:
+            for char in chars:
+                key = (font_key, char, min_height, min_width)
+                glyph = self._glyphs.get(key)
+                if glyph is None:
+                    missing.append(char)
+                else:
+                    self._glyphs.move_to_end(key)
+                    glyphs[char] = glyph
+            self.hits += len(glyphs)
+            self.misses += len(missing)
+        if not missing:
+            return glyphs
+
+        for char in missing:
+            glyphs[char] = _pack_char(font_data, char, min_height, min_width)
+        with self._lock:
+            for char in missing:
+                self._glyphs[(font_key, char, min_height, min_width)] = glyphs[char]
+            while len(self._glyphs) > self.max_entries:
+                self._glyphs.popitem(last=False)
+        return glyphs
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._glyphs),
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+glyph_cache = GlyphCache()
+
+
 def create_font_characters(
     text: str, font_data: dict[str : List[str]], min_height=12
 ) -> [FontCharacterData]:
     font_characters = []
     for char in text:
         char_data = find_char_in_font(char, font_data)
-        height = len(char_data)
-        width = len(char_data[0])
-        if height < min_height:
-            pad_character_to_height(char_data, min_height)
-            height = min_height
-        if width < height:
-            width = height
-        font_characters.append(
-            FontCharacterData(
-                width, height, char, gen_bitmap(*char_data, min_len=width)
-            )
-        )
+        height = max(len(char_data), min_height)
+        width = max(len(char_data[0]), height)
+        glyph = glyph_cache.get(font_data, char, height, width)
+        font_characters.append(FontCharacterData(width, height, char, glyph.bitmap))
     return font_characters
 
 
@@ -190,7 +615,9 @@ def lines_to_frames(
             if height > line_height:
                 raise ValueError("Character height exceeds line height.")
             if height < line_height:
-                pad_character_to_height(char_data, line_height, len(char_data[0]))
+                char_data = pad_character_to_height(
+                    char_data, line_height, len(char_data[0])
+                )
             for i, char_line in enumerate(char_data):
                 raster_line[i] += char_line
         while len(raster_line[0]) > width:
@@ -221,3 +648,118 @@ def lines_to_frames(
         raster_frames.append(current_frame)
 
     return raster_frames
+
+
+def _line_glyphs(lines, font_data, line_height):
+    # the glyphs of every character used in lines, fetched in one go
+    glyphs = glyph_cache.get_many(font_data, set().union(*lines), line_height)
+    if any(glyph.height > line_height for glyph in glyphs.values()):
+        raise ValueError("Character height exceeds line height.")
+    return glyphs
+
+
+def _render_line_bits(line, glyphs, line_height):
+    # returns the line width and one integer per pixel row, leftmost pixel first
+    if not line:
+        return 0, [0] * line_height
+
+    line_glyphs = [glyphs[char] for char in line]
+    # join each row's bits across the glyphs, so the per glyph work happens
+    # in str.join instead of a Python loop over every glyph of every row
+    rows = [
+        int("".join(row_bits) or "0", 2)
+        for row_bits in zip(*[glyph.row_bits for glyph in line_glyphs])
+    ]
+    return sum(glyph.width for glyph in line_glyphs), rows
+
+
+def render_line(line: str, font_data: dict[str : List[str]], line_height=6) -> Frame:
+    """
+    Renders a line of text into a monochrome Frame which is as wide as the
+    text. Glyphs shorter than line_height are centered vertically.
+    """
+    glyphs = _line_glyphs([line], font_data, line_height)
+    return Frame.from_row_bits(*_render_line_bits(line, glyphs, line_height))
+
+
+def render_frames(
+    lines: List[str],
+    font_data: dict[str : List[str]],
+    align: Align = Align.CENTER,
+    width=48,
+    lines_per_frame=2,
+    line_height=6,
+) -> List[Frame]:
+    """
+    Same as lines_to_frames, but renders straight into packed Frame buffers
+    instead of building . and 1 strings. frame.data is identical to running
+    gen_bitmap on the corresponding lines_to_frames output.
+    """
+    mask = (1 << width) - 1
+    glyphs = _line_glyphs(lines, font_data, line_height)
+    raster_lines = []
+    for line in lines:
+        line_width, rows = _render_line_bits(line, glyphs, line_height)
+        # lines wider than the display overflow onto the following lines
+        while line_width > width:
+            line_width -= width
+            raster_lines.append([row >> line_width & mask for row in rows])
+            rows = [row & ((1 << line_width) - 1) for row in rows]
+        remaining = width - line_width
+        if align == Align.LEFT:
+            offset = remaining
+        elif align == Align.RIGHT:
+            offset = 0
+        else:
+            offset = remaining - remaining // 2
+        raster_lines.append([row << offset for row in rows])
+
+    frames = []
+    for i in range(0, len(raster_lines), lines_per_frame):
+        rows = [
+            row
+            for raster_line in raster_lines[i : i + lines_per_frame]
+            for row in raster_line
+        ]
+        rows.extend([0] * (line_height * lines_per_frame - len(rows)))
+        frames.append(Frame.from_row_bits(width, rows))
+    return frames
+
+
+def text_lines_animation(
+    text,
+    width,
+    height,
+    frame_limit=None,
+    align=Align.CENTER,
+    font="4x6",
+    frame_duration=2,
+    line_height=6,
+    effect=Effect.NONE,
+    speed=20,
+    reflow=True,
+) -> AnimationData:
+    """
+    Renders multi-line text into the AnimationData sent by
+    LedConnection.set_text_lines for a width x height display.
+    """
+    font_data = find_and_load_font(font)
+
+    if reflow:
+        lines = reflow_text(text, font_data, width)
+    else:
+        lines = text.replace("\r", "").split("\n")
+
+    frames = render_frames(
+        lines, font_data, align, width, height // line_height, line_height
+    )
+
+    if frame_limit is not None and len(frames) > frame_limit:
+        raise ValueError("The animation exceeds the device frame limit.")
+
+    return AnimationData(
+        [FrameData.from_frame(frame, width, height) for frame in frames],
+        int(frame_duration * 1000),
+        speed,
+        effect,
+    )
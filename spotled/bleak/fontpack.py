@@ -0,0 +1,188 @@
+from collections.abc import Mapping
+import hashlib
+import mmap
+import os.path
+import struct
+import sys
+import tempfile
+
+from .devicecache import user_cache_dir
+
+PACKED_FONT_EXTENSION = "spf"
+
+_MAGIC = b"SPLF"
+_VERSION = 1
+_HEADER = struct.Struct(">4sBxxxII")  # magic, version, glyph count, bitmap offset
+_INDEX_ENTRY = struct.Struct(">IIBB")  # codepoint, bitmap offset, width, height
+_ROW_CHARS = str.maketrans("01", ".1")
+
+
+def _pack_glyph(rows, width):
+    """
+    Packs glyph rows consisting of . and 1 into bytes, one byte aligned
+    row at a time (the same layout gen_bitmap produces).
+    """
+    stride = (width + 7) // 8
+    data = bytearray()
+    for row in rows:
+        bits = row.replace(".", "0").ljust(stride * 8, "0")
+        data.extend(int(bits, 2).to_bytes(stride, "big") if stride else b"")
+    return data
+
+
+def write_packed_font(font_data, dest):
+    """
+    Writes a character -> glyph mapping to dest in the packed font format:
+    a header, an index sorted by codepoint and the packed glyph bitmaps.
+    """
+    index = bytearray()
+    bitmaps = bytearray()
+    chars = sorted(font_data, key=ord)
+    for char in chars:
+        rows = font_data[char]
+        width = max((len(row) for row in rows), default=0)
+        if width > 255 or len(rows) > 255:
+            raise ValueError(f"Glyph for {char!r} is too large to pack.")
+        index.extend(_INDEX_ENTRY.pack(ord(char), len(bitmaps), width, len(rows)))
+        bitmaps.extend(_pack_glyph(rows, width))
+
+    # write to a temporary file of our own first, so neither a concurrent
+    # writer nor a reader ever sees a partial font
+    fd, tmp = tempfile.mkstemp(
+        prefix=os.path.basename(dest) + ".",
+        suffix=".tmp",
+        dir=os.path.dirname(dest) or ".",
+    )
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(
+                _HEADER.pack(_MAGIC, _VERSION, len(chars), _HEADER.size + len(index))
+            )
+            fh.write(index)
+            fh.write(bitmaps)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def font_cache_path(fontfile, extension):
+    """
+    Where files derived from a font at runtime are kept: the user's cache
+    directory, named after the font and a hash of its path so fonts of the
+    same name in different directories do not collide.
+    """
+    path = os.path.realpath(fontfile)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(user_cache_dir(), "fonts", f"{name}-{digest}.{extension}")
+
+
+def packed_font_path(fontfile):
+    """
+    Where fonts compiled at runtime are kept.
+    """
+    return font_cache_path(fontfile, PACKED_FONT_EXTENSION)
+
+
+def compile_font(fontfile, dest=None):
+    """
+    Compiles a yaff or draw font into the packed font format. By default
+    the packed font is written next to the source file, which is where
+    packaging puts the fonts shipped with spotled.
+    """
+    from .fontops import parse_font
+
+    if dest is None:
+        dest = os.path.splitext(fontfile)[0] + "." + PACKED_FONT_EXTENSION
+    write_packed_font(parse_font(fontfile), dest)
+    return dest
+
+
+class PackedFont(Mapping):
+    """
+    A font in the packed format, memory-mapped from disk. Glyph lookups
+    binary search the codepoint index, so only the index entries and
+    bitmaps of characters that are actually used get touched. Behaves like
+    the dict returned by parse_font.
+    """
+
+    def __init__(self, fontfile, cache_key=None):
+        with open(fontfile, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count, self._bitmap_offset = _HEADER.unpack_from(
+            self._map
+        )
+        if magic != _MAGIC or version != _VERSION:
+            raise TypeError("Unknown packed font format.")
+        self._glyphs = {}
+        self.cache_key = cache_key
+        self.memory_size = sys.getsizeof(self._glyphs) + len(self._map)
+
+    def _entry(self, i):
+        return _INDEX_ENTRY.unpack_from(self._map, _HEADER.size + i * _INDEX_ENTRY.size)
+
+    def _find(self, codepoint):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            if entry[0] < codepoint:
+                lo = mid + 1
+            elif entry[0] > codepoint:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def glyph_bitmap(self, char):
+        """
+        Returns (width, height, bitmap) for a character without converting
+        it to rows. The bitmap uses one byte aligned row per line.
+        """
+        entry = self._find(ord(char)) if len(char) == 1 else None
+        if entry is None:
+            raise KeyError(char)
+        _, offset, width, height = entry
+        start = self._bitmap_offset + offset
+        return width, height, self._map[start : start + (width + 7) // 8 * height]
+
+    def __getitem__(self, char):
+        try:
+            return self._glyphs[char]
+        except KeyError:
+            pass
+        width, height, bitmap = self.glyph_bitmap(char)
+        stride_bits = (width + 7) // 8 * 8
+        if stride_bits:
+            bits = format(int.from_bytes(bitmap, "big"), f"0{stride_bits * height}b")
+            glyph = tuple(
+                bits[i : i + width].translate(_ROW_CHARS)
+                for i in range(0, stride_bits * height, stride_bits)
+            )
+        else:
+            glyph = ("",) * height
+        self._glyphs[char] = glyph
+        return glyph
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield chr(self._entry(i)[0])
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+
+if __name__ == "__main__":
+    import glob
+
+    fonts = sys.argv[1:] or glob.glob(
+        os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts/*.yaff"
+        )
+    )
+    for fontfile in fonts:
+        print(compile_font(fontfile))
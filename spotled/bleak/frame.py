@@ -0,0 +1,198 @@
+from .graphics import gen_bitmap, gen_color_bitmap
+
+
+class Frame:
+    """
+    A width x height pixel buffer. Monochrome frames (depth 1) pack one bit
+    per pixel, most significant bit first, with every row padded to a whole
+    byte, which is the bitmap layout FrameData and FontCharacterData expect.
+    RGB frames (depth 24) store three bytes per pixel in color_map order.
+    """
+
+    COLOR_DEPTH_MONOCHROME = 1
+    COLOR_DEPTH_RGB = 24
+
+    def __init__(self, width, height, depth=COLOR_DEPTH_MONOCHROME, data=None):
+        if depth not in (self.COLOR_DEPTH_MONOCHROME, self.COLOR_DEPTH_RGB):
+            raise ValueError("Unsupported color depth.")
+        self.width = width
+        self.height = height
+        self.depth = depth
+        if depth == self.COLOR_DEPTH_MONOCHROME:
+            self.stride = (width + 7) // 8
+        else:
+            self.stride = width * 3
+        if data is None:
+            self.data = bytearray(self.stride * height)
+        else:
+            if len(data) != self.stride * height:
+                raise ValueError("Pixel data does not match the frame size.")
+            self.data = bytearray(data)
+
+    @classmethod
+    def from_rows(cls, rows, true_char="1"):
+        """
+        Creates a monochrome frame from a "text" bitmap consisting of . and 1.
+        """
+        width = max((len(row) for row in rows), default=0)
+        return cls(
+            width, len(rows), data=gen_bitmap(*rows, min_len=width, true_char=true_char)
+        )
+
+    @classmethod
+    def from_row_bits(cls, width, rows):
+        """
+        Creates a monochrome frame from one integer per row, where the most
+        significant of the width bits is the leftmost pixel.
+        """
+        stride = (width + 7) // 8
+        padding = stride * 8 - width
+        return cls(
+            width,
+            len(rows),
+            data=b"".join((row << padding).to_bytes(stride, "big") for row in rows),
+        )
+
+    @classmethod
+    def from_color_rows(cls, rows, color_map):
+        """
+        Creates an RGB frame from a "text" bitmap using gen_color_bitmap's color_map.
+        """
+        width = len(rows[0]) if rows else 0
+        return cls(
+            width,
+            len(rows),
+            cls.COLOR_DEPTH_RGB,
+            gen_color_bitmap(*rows, color_map=color_map),
+        )
+
+    def _row(self, y):
+        return int.from_bytes(self.data[y * self.stride : (y + 1) * self.stride], "big")
+
+    def _set_row(self, y, value):
+        self.data[y * self.stride : (y + 1) * self.stride] = value.to_bytes(
+            self.stride, "big"
+        )
+
+    def _span_mask(self, x, width):
+        # bits of pixels x..x+width-1 within a row, clipped to the frame
+        start = max(x, 0)
+        end = min(x + width, self.width)
+        if end <= start:
+            return 0
+        return ((1 << (end - start)) - 1) << (self.stride * 8 - end)
+
+    def get_pixel(self, x, y):
+        if self.depth == self.COLOR_DEPTH_MONOCHROME:
+            return (self.data[y * self.stride + x // 8] >> (7 - x % 8)) & 1
+        pos = y * self.stride + x * 3
+        return tuple(self.data[pos : pos + 3])
+
+    def set_pixel(self, x, y, value):
+        if self.depth == self.COLOR_DEPTH_MONOCHROME:
+            pos = y * self.stride + x // 8
+            if value:
+                self.data[pos] |= 0x80 >> (x % 8)
+            else:
+                self.data[pos] &= ~(0x80 >> (x % 8)) & 255
+        else:
+            pos = y * self.stride + x * 3
+            self.data[pos : pos + 3] = bytes(value[:3])
+
+    def fill(self, value, x=0, y=0, width=None, height=None):
+        """
+        Fills a rectangle (the whole frame by default) with a pixel value:
+        truthy/falsy for monochrome frames or a color tuple for RGB frames.
+        """
+        if width is None:
+            width = self.width - x
+        if height is None:
+            height = self.height - y
+        rows = range(max(y, 0), min(y + height, self.height))
+        if self.depth == self.COLOR_DEPTH_MONOCHROME:
+            mask = self._span_mask(x, width)
+            for row in rows:
+                if value:
+                    self._set_row(row, self._row(row) | mask)
+                else:
+                    self._set_row(row, self._row(row) & ~mask)
+        else:
+            start = max(x, 0)
+            end = min(x + width, self.width)
+            if end > start:
+                pixels = bytes(value[:3]) * (end - start)
+                for row in rows:
+                    pos = row * self.stride
+                    self.data[pos + start * 3 : pos + end * 3] = pixels
+
+    def blit(self, src, x=0, y=0):
+        """
+        Copies all pixels of src onto this frame with its top left corner
+        at x, y. Pixels falling outside of the frame are clipped.
+        """
+        if src.depth != self.depth:
+            raise ValueError("Cannot blit frames of different color depths.")
+        rows = range(max(y, 0), min(y + src.height, self.height))
+        if self.depth == self.COLOR_DEPTH_MONOCHROME:
+            mask = self._span_mask(x, src.width)
+            if not mask:
+                return
+            shift = (self.stride * 8 - x) - src.stride * 8
+            for row in rows:
+                pixels = src._row(row - y)
+                pixels = pixels << shift if shift >= 0 else pixels >> -shift
+                self._set_row(row, (self._row(row) & ~mask) | (pixels & mask))
+        else:
+            start = max(x, 0)
+            end = min(x + src.width, self.width)
+            if end <= start:
+                return
+            for row in rows:
+                src_pos = (row - y) * src.stride + (start - x) * 3
+                pos = row * self.stride + start * 3
+                self.data[pos : pos + (end - start) * 3] = src.data[
+                    src_pos : src_pos + (end - start) * 3
+                ]
+
+    def crop(self, x, y, width, height):
+        """
+        Returns a new frame containing the given rectangle of this frame.
+        Areas outside of this frame are left blank.
+        """
+        frame = Frame(width, height, self.depth)
+        frame.blit(self, -x, -y)
+        return frame
+
+    def shift(self, dx, dy):
+        """
+        Moves the contents of the frame by dx, dy pixels. Pixels shifted
+        out of the frame are lost and the vacated area is cleared.
+        """
+        frame = Frame(self.width, self.height, self.depth)
+        frame.blit(self, dx, dy)
+        self.data[:] = frame.data
+
+    def to_rows(self, true_char="1", false_char="."):
+        """
+        Converts a monochrome frame back to a "text" bitmap, mostly useful for debugging.
+        """
+        return [
+            "".join(
+                true_char if self.get_pixel(x, y) else false_char
+                for x in range(self.width)
+            )
+            for y in range(self.height)
+        ]
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __eq__(self, other):
+        if not isinstance(other, Frame):
+            return NotImplemented
+        return (
+            self.width == other.width
+            and self.height == other.height
+            and self.depth == other.depth
+            and self.data == other.data
+        )
@@ -1,17 +1,76 @@
 from .models.commands import ByteWriter
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# below this many pixels the NumPy setup costs more than it saves
+NUMPY_MIN_PIXELS = 256
+
+
+def _color_lookup(color_map):
+    return {char: bytes(color[:3]) for char, color in color_map.items()}
+
+
+def _gen_color_bitmap_numpy(text, color_map):
+    try:
+        pixels = numpy.frombuffer(text.encode("latin-1"), dtype=numpy.uint8)
+    except UnicodeEncodeError:
+        pixels = None
+    if pixels is None or any(ord(char) > 255 for char in color_map):
+        return b"".join(map(_color_lookup(color_map).__getitem__, text))
+
+    # index a 256 entry table by character code instead of looking up each pixel
+    table = numpy.zeros((256, 3), dtype=numpy.uint8)
+    known = numpy.zeros(256, dtype=bool)
+    for char, color in color_map.items():
+        table[ord(char)] = color[:3]
+        known[ord(char)] = True
+    missing = ~known[pixels]
+    if missing.any():
+        raise KeyError(chr(pixels[missing.argmax()]))
+    return table[pixels].tobytes()
+
+
 def gen_color_bitmap(*lines, color_map={".": (0, 0, 0), "1": (255, 255, 255)}):
     """
     Converts a "text" bitmap consisting of a predefined map of characters to a BGR tuple.
     """
-    data = bytearray()
-    for text in lines:
-        for i in range(0, len(text)):
-            color = color_map[text[i]]
-            data.append(color[0])
-            data.append(color[1])
-            data.append(color[2])
-    return bytes(data)
+    text = "".join(lines)
+    if numpy is not None and len(text) >= NUMPY_MIN_PIXELS and color_map:
+        return _gen_color_bitmap_numpy(text, color_map)
+    return b"".join(map(_color_lookup(color_map).__getitem__, text))
+
+
+def _row_stride(length, min_len):
+    return max(length, min_len) + 7 & ~7
+
+
+def _gen_bitmap_numpy(lines, stride, true_char):
+    """
+    Packs equally long rows with a single packbits call.
+    stride is the padded row length in bits.
+    """
+    pixels = numpy.frombuffer("".join(lines).encode("utf-32-le"), dtype=numpy.uint32)
+    pixels = (pixels == ord(true_char)).reshape(len(lines), -1)
+    if pixels.shape[1] != stride:
+        # rows are padded with ".", which only counts as set if it is the true_char
+        padded = numpy.full((len(lines), stride), true_char == ".", dtype=bool)
+        padded[:, : pixels.shape[1]] = pixels
+        pixels = padded
+    return numpy.packbits(pixels, axis=1).tobytes()
+
+
+def _gen_row_python(text, stride, true_char, bit_chars):
+    if not stride:
+        return b""
+    bits = text.translate(bit_chars)
+    if bits.strip("01"):
+        # characters other than . and true_char, compare them one by one
+        bits = "".join("1" if char == true_char else "0" for char in text)
+    padding = "1" if true_char == "." else "0"
+    return int(bits.ljust(stride, padding), 2).to_bytes(stride // 8, "big")
 
 
 def gen_bitmap(*lines: [str], min_len=0, true_char="1"):
@@ -23,23 +82,22 @@ def gen_bitmap(*lines: [str], min_len=0, true_char="1"):
     if min_len % 8 != 0:
         min_len += 8 - (min_len % 8)
 
-    data = bytearray()
-    for text in lines:
-        if len(text) < min_len:
-            text += "." * (min_len - len(text))
-        else:
-            excess = len(text) % 8
-            if excess != 0:
-                text += "." * (8 - excess)
-        for i in range(0, len(text), 8):
-            data.append(
-                ((text[i] == true_char) << 7)
-                | ((text[i + 1] == true_char) << 6)
-                | ((text[i + 2] == true_char) << 5)
-                | ((text[i + 3] == true_char) << 4)
-                | ((text[i + 4] == true_char) << 3)
-                | ((text[i + 5] == true_char) << 2)
-                | ((text[i + 6] == true_char) << 1)
-                | (text[i + 7] == true_char)
-            )
-    return bytes(data)
+    if not lines:
+        return b""
+
+    length = len(lines[0])
+    if (
+        numpy is not None
+        and length * len(lines) >= NUMPY_MIN_PIXELS
+        and all(len(text) == length for text in lines)
+    ):
+        return _gen_bitmap_numpy(lines, _row_stride(length, min_len), true_char)
+
+    bit_chars = str.maketrans(
+        {".": "0", "1": "0", true_char: "1"} if true_char != "1" else {".": "0"}
+    )
+    return b"".join(
+        _gen_row_python(text, _row_stride(len(text), min_len), true_char, bit_chars)
+        for text in lines
+    )
+
@@ -0,0 +1,240 @@
+from bisect import bisect_left
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the histogram buckets, Prometheus style
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TRANSFER_PHASES = ("queued", "connect", "handshake", "writes", "stalls", "finish")
+
+
+class Histogram:
+    """
+    Counts observed values into cumulative buckets bounded by buckets.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last bucket counts values above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Returns (upper bound, values <= bound) pairs, the last bound is inf.
+        """
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": [[bound, count] for bound, count in self.cumulative()],
+        }
+
+
+class TransferRecord:
+    """
+    What happened during one send_data call. phases holds the seconds spent
+    in each of TRANSFER_PHASES, summed over all attempts: waiting for other
+    transfers (queued), connecting, waiting for the transfer to start
+    (handshake), writing chunks, waiting for the device to accept more data
+    (stalls) and waiting for the finish reply.
+    """
+
+    def __init__(self, address, command_type, payload_size):
+        self.address = address
+        self.command_type = command_type
+        self.payload_size = payload_size
+        self.phases = dict.fromkeys(TRANSFER_PHASES, 0.0)
+        self.bytes_sent = 0
+        self.chunks = 0
+        self.continues = 0
+        self.pauses = 0
+        self.stall_count = 0
+        self.attempts = 0
+        self.reconnects = 0
+        self.duration = 0.0
+        self.error = None
+        self._started = self._phase_started = time.monotonic()
+        self._phase = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    def enter(self, phase):
+        """
+        Ends the running phase, adding its time, and starts timing phase
+        (nothing if None).
+        """
+        now = time.monotonic()
+        if self._phase is not None:
+            self.phases[self._phase] += now - self._phase_started
+        self._phase = phase
+        self._phase_started = now
+
+    def finish(self, error=None):
+        self.enter(None)
+        self.error = error
+        self.duration = time.monotonic() - self._started
+
+    def to_dict(self):
+        return {
+            "address": self.address,
+            "command_type": self.command_type,
+            "payload_size": self.payload_size,
+            "ok": self.ok,
+            "error": None if self.error is None else repr(self.error),
+            "duration": self.duration,
+            "phases": dict(self.phases),
+            "bytes_sent": self.bytes_sent,
+            "chunks": self.chunks,
+            "continues": self.continues,
+            "pauses": self.pauses,
+            "stall_count": self.stall_count,
+            "retries": self.retries,
+            "reconnects": self.reconnects,
+        }
+
+    def __repr__(self):
+        outcome = "ok" if self.ok else repr(self.error)
+        return (
+            f"<TransferRecord {self.address} {self.payload_size} bytes "
+            f"{outcome} {self.duration * 1000:.0f}ms>"
+        )
+
+
+class TransferMetrics:
+    """
+    Aggregates the TransferRecords of one or more connections into counters
+    and duration histograms per phase, which snapshot and to_prometheus
+    export. Every LedConnection has its own by default; passing one
+    instance to several connections aggregates over all of them. Callables
+    in listeners are called with every TransferRecord as it completes.
+    """
+
+    COUNTERS = (
+        "transfers",
+        "failed_transfers",
+        "bytes_sent",
+        "chunks",
+        "continues",
+        "pauses",
+        "stalls",
+        "retries",
+        "reconnects",
+    )
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = {
+            name: Histogram(buckets) for name in ("duration",) + TRANSFER_PHASES
+        }
+        self.last = None
+        self.listeners = []
+
+    def record(self, transfer):
+        counters = self.counters
+        counters["transfers" if transfer.ok else "failed_transfers"] += 1
+        counters["bytes_sent"] += transfer.bytes_sent
+        counters["chunks"] += transfer.chunks
+        counters["continues"] += transfer.continues
+        counters["pauses"] += transfer.pauses
+        counters["stalls"] += transfer.stall_count
+        counters["retries"] += transfer.retries
+        counters["reconnects"] += transfer.reconnects
+        self.histograms["duration"].observe(transfer.duration)
+        for phase, seconds in transfer.phases.items():
+            self.histograms[phase].observe(seconds)
+        self.last = transfer
+
+        for listener in list(self.listeners):
+            try:
+                listener(transfer)
+            except Exception:
+                # metrics must never break a transfer
+                logger.warning("Transfer metrics listener failed", exc_info=True)
+
+    def reset(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = {name: Histogram(self.buckets) for name in self.histograms}
+        self.last = None
+
+    def snapshot(self):
+        """
+        Returns the counters and histograms as a JSON serializable dict.
+        """
+        return {
+            "counters": dict(self.counters),
+            "histograms": {
+                name: histogram.snapshot()
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def to_prometheus(self, prefix="spotled", labels=None):
+        """
+        Renders the metrics in the Prometheus text exposition format.
+        labels, e.g. {"address": address}, are added to every sample.
+        """
+        return prometheus_text([(labels or {}, self)], prefix)
+
+
+def _label_text(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def prometheus_text(labelled_metrics, prefix="spotled"):
+    """
+    Renders several TransferMetrics in the Prometheus text exposition
+    format, given as (labels, metrics) pairs. Every metric family is
+    declared once and followed by the samples of all of them, as the
+    format requires.
+    """
+    labelled_metrics = [
+        (_label_text(labels), metrics) for labels, metrics in labelled_metrics
+    ]
+
+    def sample(name, value, label_text, extra=""):
+        joined = ",".join(filter(None, (label_text, extra)))
+        return f"{name}{{{joined}}} {value}" if joined else f"{name} {value}"
+
+    lines = []
+    for counter in TransferMetrics.COUNTERS:
+        name = f"{prefix}_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        for label_text, metrics in labelled_metrics:
+            lines.append(sample(name, metrics.counters[counter], label_text))
+    for histogram_name in ("duration",) + TRANSFER_PHASES:
+        name = f"{prefix}_transfer_{histogram_name}_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for label_text, metrics in labelled_metrics:
+            histogram = metrics.histograms[histogram_name]
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(sample(f"{name}_bucket", count, label_text, f'le="{le}"'))
+            lines.append(sample(f"{name}_sum", histogram.sum, label_text))
+            lines.append(sample(f"{name}_count", histogram.count, label_text))
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,7 @@
-from .byte import ByteWriter
+from .byte import ByteWriter, Serializable
 from .enums import Effect
 
-class TimeData:
+class TimeData(Serializable):
     """
     The amount of time in milliseconds to show each frame of
     an animation. Only used if there is no effect applied.
@@ -10,17 +10,19 @@ class TimeData:
     def __init__(self, time):
         self.time = time
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 10
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(10)  # length
         d.write_short(7)  # type
         d.write_byte(0)  # always zero?
         d.write_short(self.time)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class SpeedData:
+class SpeedData(Serializable):
     """
     The speed of the animation. Used if effect is not none.
     """
@@ -28,15 +30,17 @@ class SpeedData:
     def __init__(self, speed):
         self.speed = speed
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 8
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(8)  # length
         d.write_short(9)  # type
         d.write_byte(self.speed)
         d.write_checksum()
-        return d.to_bytes()
 
-class EffectData:
+class EffectData(Serializable):
     """
     Indicates the display mode (static, scrolling, etc)
     for text/animations on the device.
@@ -45,16 +49,18 @@ class EffectData:
     def __init__(self, effect: Effect):
         self.effect = effect
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 8
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(8)  # length
         d.write_short(8)  # type
         d.write_byte(self.effect.value)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class FrameData:
+class FrameData(Serializable):
     COLOR_DEPTH_MONOCHROME = 1
     COLOR_DEPTH_RGB = 24
     """
@@ -70,8 +76,24 @@ class FrameData:
         self.bitmap = bitmap
         self.depth = depth
 
-    def serialize(self):
-        d = ByteWriter()
+    @classmethod
+    def from_frame(cls, frame, width=None, height=None):
+        """
+        Wraps a Frame without copying its pixel buffer. width and height
+        default to the frame size.
+        """
+        return cls(
+            frame.width if width is None else width,
+            frame.height if height is None else height,
+            frame.data,
+            frame.depth,
+        )
+
+    def serialized_size(self):
+        return len(self.bitmap) + 12
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(len(self.bitmap) + 12)  # length
         d.write_short(96)  # type
         d.write_short(self.width)
@@ -79,10 +101,9 @@ class FrameData:
         d.write_byte(self.depth)
         d.write_bytes(self.bitmap)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class AnimationData:
+class AnimationData(Serializable):
     """
     Wraps a series of frames (max 20) along with speed, time,
     and effect data. Time is per-frame time, but it is only
@@ -95,21 +116,29 @@ class AnimationData:
         self.speed = speed
         self.effects = effects
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return (
+            9
+            + sum(frame.serialized_size() for frame in self.frames)
+            + TimeData(self.time).serialized_size()
+            + SpeedData(self.speed).serialized_size()
+            + EffectData(self.effects).serialized_size()
+        )
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(9)  # length
         d.write_short(11)  # type
         d.write_short(len(self.frames))
         d.write_checksum()
         for frame in self.frames:
-            d.write_bytes(frame.serialize())
-        d.write_bytes(TimeData(self.time).serialize())
-        d.write_bytes(SpeedData(self.speed).serialize())
-        d.write_bytes(EffectData(self.effects).serialize())
-        return d.to_bytes()
+            frame.write_to(d)
+        TimeData(self.time).write_to(d)
+        SpeedData(self.speed).write_to(d)
+        EffectData(self.effects).write_to(d)
 
 
-class ColorData:
+class ColorData(Serializable):
     """
     An RGB color value. Used for text.
     """
@@ -119,18 +148,20 @@ class ColorData:
         self.green = green
         self.blue = blue
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 10
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(10)  # length
         d.write_short(2)  # type
         d.write_byte(self.red)
         d.write_byte(self.green)
         d.write_byte(self.blue)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class NumberBarData:
+class NumberBarData(Serializable):
     """
     Graphs 16 values from 0-12 as a bar graph. Intended for
     displaying a music spectrum display.
@@ -139,12 +170,13 @@ class NumberBarData:
     def __init__(self, values):
         self.values = values
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return len(self.values) * 2 + 9
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(len(self.values) * 2 + 9)  # length
         d.write_short(10)  # type
         d.write_short(len(self.values))
-        for value in self.values:
-            d.write_short(value)
+        d.write_shorts(self.values)
         d.write_checksum()
-        return d.to_bytes()
\ No newline at end of file
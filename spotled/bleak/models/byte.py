@@ -1,42 +1,135 @@
+import struct
+
+_SHORT = struct.Struct(">H")
+_INT = struct.Struct(">I")
+
+
 class ByteWriter:
     """
     A class for writing bytes into binary blob by type sequentially.
-    Also supports writing checksums for written data.
+    Also supports writing checksums for written data. Passing size
+    preallocates the buffer, which lets nested models write into
+    one shared buffer without it being resized.
     """
 
-    def __init__(self):
-        self.content = bytearray()
+    def __init__(self, size=0):
+        self.content = bytearray(size)
+        self.position = 0
         self.checksum_start_pos = 0
+        self.checksum_value = 0
+        self._checksum_pos = 0
+
+    def _grow(self, count):
+        # grows the buffer geometrically when writing past its current size
+        self.content.extend(bytes(max(count, len(self.content))))
 
     def write_byte(self, value):
-        self.content.append(value & 255)
+        value &= 255
+        if self.position < len(self.content):
+            self.content[self.position] = value
+        else:
+            self.content.append(value)
+        self.position += 1
 
     def write_short(self, value):
-        self.content.append((value >> 8) & 255)
-        self.content.append(value & 255)
+        value &= 0xFFFF
+        position = self.position
+        if position + 2 > len(self.content):
+            self._grow(2)
+        _SHORT.pack_into(self.content, position, value)
+        self.position = position + 2
+
+    def write_shorts(self, values):
+        """
+        Writes a sequence of shorts with a single pack call.
+        """
+        values = [value & 0xFFFF for value in values]
+        position = self.position
+        end = position + len(values) * 2
+        if end > len(self.content):
+            self._grow(end - len(self.content))
+        struct.pack_into(f">{len(values)}H", self.content, position, *values)
+        self.position = end
 
     def write_int(self, value):
-        self.content.append((value >> 24) & 255)
-        self.content.append((value >> 16) & 255)
-        self.content.append((value >> 8) & 255)
-        self.content.append(value & 255)
+        value &= 0xFFFFFFFF
+        position = self.position
+        if position + 4 > len(self.content):
+            self._grow(4)
+        _INT.pack_into(self.content, position, value)
+        self.position = position + 4
 
     def write_bytes(self, value):
-        self.content.extend(value)
+        self._sum_pending()
+        position = self.position
+        end = position + len(value)
+        if end > len(self.content):
+            self._grow(end - len(self.content))
+        self.content[position:end] = value
+        self.position = end
+        # summing the whole slice at once runs at C speed
+        self.checksum_value += sum(value)
+        self._checksum_pos = end
+
+    def _sum_pending(self):
+        # adds bytes written by the small write methods to the running sum
+        if self._checksum_pos < self.position:
+            self.checksum_value += sum(self.content[self._checksum_pos : self.position])
+            self._checksum_pos = self.position
 
     def start_checksum(self):
-        self.checksum_start_pos = len(self.content)
+        self.checksum_start_pos = self.position
+        self.checksum_value = 0
+        self._checksum_pos = self.position
 
     def write_checksum(self):
-        value = 0
-        for b in self.content[self.checksum_start_pos :]:
-            value += 255 & b
+        """
+        Writes the checksum of everything written since start_checksum
+        (or since the writer was created). Every byte is added to the
+        running sum once, in bulk, so this does not rescan the buffer.
+        """
+        self._sum_pending()
+        value = self.checksum_value
         if value > 255:
             value = (~value) + 1
-        self.content.append(value & 255)
+        self.write_byte(value & 255)
+
+    def getbuffer(self):
+        """
+        Returns a memoryview of the written data without copying it.
+        The writer cannot grow while the view is alive, so this should
+        be called once writing is finished.
+        """
+        return memoryview(self.content)[: self.position]
 
     def to_bytes(self):
-        return bytes(self.content)
+        return bytes(self.getbuffer())
+
+
+class Serializable:
+    """
+    Base class for models which write themselves into a ByteWriter.
+    Subclasses implement serialized_size and write_to. Nested models
+    call write_to on their children with the same writer, so a whole
+    payload is serialized into one preallocated buffer.
+    """
+
+    def serialized_size(self):
+        raise NotImplementedError
+
+    def write_to(self, d: ByteWriter):
+        raise NotImplementedError
+
+    def serialize_view(self):
+        """
+        Serializes into a new buffer and returns a memoryview of it.
+        """
+        d = ByteWriter(self.serialized_size())
+        self.write_to(d)
+        return d.getbuffer()
+
+    def serialize(self):
+        return self.serialize_view().tobytes()
 
 
 class ByteReader:
@@ -54,17 +147,12 @@ class ByteReader:
         return value
 
     def read_short(self):
-        value = (self.content[self.current_pos] << 8) + self.content[self.current_pos + 1]
+        value = _SHORT.unpack_from(self.content, self.current_pos)[0]
         self.current_pos += 2
         return value
 
     def read_int(self):
-        value = (
-            (self.content[self.current_pos] << 24)
-            + (self.content[self.current_pos + 1] << 16)
-            + (self.content[self.current_pos + 2] << 8)
-            + self.content[self.current_pos + 3]
-        )
+        value = _INT.unpack_from(self.content, self.current_pos)[0]
         self.current_pos += 4
         return value
 
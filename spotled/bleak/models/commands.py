@@ -1,6 +1,6 @@
-from .byte import ByteWriter
+from .byte import ByteWriter, Serializable
 
-class SendingDataStartCommand:
+class SendingDataStartCommand(Serializable):
     """
     Indicates to the device that it is about to be sent
     new command data.
@@ -11,17 +11,18 @@ class SendingDataStartCommand:
         self.command_type = command_type
         self.command_length = command_length
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 10
+
+    def write_to(self, d):
         d.write_byte(10)  # length
         d.write_byte(1)  # SendingDataStartCommand
         d.write_short(self.serial_no)
         d.write_short(self.command_type)
         d.write_int(self.command_length)
-        return d.to_bytes()
 
 
-class SendingDataFinishCommand:
+class SendingDataFinishCommand(Serializable):
     """
     Indicates to the device that all of the command data
     has been sent off successfully.
@@ -32,60 +33,66 @@ class SendingDataFinishCommand:
         self.command_type = command_type
         self.command_length = command_length
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 10
+
+    def write_to(self, d):
         d.write_byte(10)  # length
         d.write_byte(3)  # SendingDataFinishCommand
         d.write_short(self.serial_no)
         d.write_short(self.command_type)
         d.write_int(self.command_length)
-        return d.to_bytes()
 
 
-class GetDisplayInfoCommand:
+class GetDisplayInfoCommand(Serializable):
     """
     Allows retrieving display parameters.
     """
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 4
+
+    def write_to(self, d):
         d.write_byte(4)  # length
         d.write_byte(18)  # GetDisplayInfoCommand
         d.write_short(0)
-        return d.to_bytes()
 
 
-class GetVersionCommand:
+class GetVersionCommand(Serializable):
     """
     Allows retrieving device version info.
     """
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 4
+
+    def write_to(self, d):
         d.write_byte(4)  # length
         d.write_byte(16)  # GetVersionCommand
         d.write_short(0)
-        return d.to_bytes()
 
 
-class GetBufferSizeCommand:
+class GetBufferSizeCommand(Serializable):
     """
     Allows retrieving data buffer size.
     """
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 4
+
+    def write_to(self, d):
         d.write_byte(4)  # length
         d.write_byte(20)  # GetBufferSizeCommand
         d.write_short(0)
-        return d.to_bytes()
 
 
-class SendDataCommand:
+class SendDataCommand(Serializable):
     """
     The main command used to send data to the device
     including animations, text, and display settings.
     This wraps ByteWriter and handles checksums for you.
+    content is either already serialized data or a model,
+    which is then serialized straight into the command buffer.
     """
 
     def __init__(self, content):
@@ -93,18 +100,28 @@ class SendDataCommand:
         self.command_type = 32772
         self.content = content
 
-    def serialize(self):
-        d = ByteWriter()
+    def _content_size(self):
+        if isinstance(self.content, Serializable):
+            return self.content.serialized_size()
+        return len(self.content)
+
+    def serialized_size(self):
+        return 15 + self._content_size()
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(15)  # length of header
         d.write_short(self.command_type)
         d.write_int(self.serial_no)
-        d.write_int(len(self.content))
+        d.write_int(self._content_size())
         d.write_checksum()
-        d.write_bytes(self.content)
-        return d.to_bytes()
+        if isinstance(self.content, Serializable):
+            self.content.write_to(d)
+        else:
+            d.write_bytes(self.content)
 
 
-class BrightnessData:
+class BrightnessData(Serializable):
     """
     Specifies the brightness of the display
     from 0-100. Sent using a data command.
@@ -113,16 +130,18 @@ class BrightnessData:
     def __init__(self, brightness):
         self.brightness = brightness
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 8
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(8)  # length
         d.write_short(14)  # type
         d.write_byte(self.brightness)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class ScreenModeData:
+class ScreenModeData(Serializable):
     """
     Specifies if the screen should be flipped or
     mirrored. Sent using a data command.
@@ -131,10 +150,12 @@ class ScreenModeData:
     def __init__(self, mode):
         self.mode = mode
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 8
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(8)  # length
         d.write_short(15)
         d.write_byte(self.mode)
         d.write_checksum()
-        return d.to_bytes()
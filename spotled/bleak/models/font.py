@@ -1,6 +1,8 @@
+from .byte import ByteWriter, Serializable
 from .enums import Effect
+from .animation import ColorData, SpeedData, TimeData, EffectData
 
-class FontData:
+class FontData(Serializable):
     """
     Wraps a list of font character glyphs for text display.
     """
@@ -8,18 +10,22 @@ class FontData:
     def __init__(self, font_characters):
         self.font_characters = font_characters
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 9 + sum(
+            font_character.serialized_size() for font_character in self.font_characters
+        )
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(9)  # length
         d.write_short(5)  # type
         d.write_short(len(self.font_characters))
         d.write_checksum()
         for font_character in self.font_characters:
-            d.write_bytes(font_character.serialize())
-        return d.to_bytes()
+            font_character.write_to(d)
 
 
-class FontCharacterData:
+class FontCharacterData(Serializable):
     """
     Wraps a single character glyph. Must be sent before
     the glyph can be displayed in text mode.
@@ -31,8 +37,11 @@ class FontCharacterData:
         self.character = character
         self.bitmap = bitmap
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return len(self.bitmap) + 15
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(len(self.bitmap) + 15)  # length
         d.write_short(13)  # type
         d.write_byte(1)  # always 1?
@@ -42,10 +51,9 @@ class FontCharacterData:
         d.write_byte(len(self.bitmap))
         d.write_bytes(self.bitmap)
         d.write_checksum()
-        return d.to_bytes()
 
 
-class CharacterData:
+class CharacterData(Serializable):
     """
     A single unicode character value.
     """
@@ -53,16 +61,18 @@ class CharacterData:
     def __init__(self, char):
         self.char = char
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        return 9
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(9)  # length
         d.write_short(3)  # type
         d.write_short(ord(self.char))
         d.write_checksum()
-        return d.to_bytes()
 
 
-class TextData:
+class TextData(Serializable):
     """
     This wraps a list of characters. The character glyphs
     must have been sent previously or the device will not
@@ -76,8 +86,12 @@ class TextData:
         self.speed = speed
         self.effects = effects
 
-    def serialize(self):
-        d = ByteWriter()
+    def serialized_size(self):
+        # each character is a ColorData (10) and a CharacterData (9)
+        return 10 + len(self.text) * 19 + 8 + 10 + 8
+
+    def write_to(self, d):
+        d.start_checksum()
         d.write_int(10)  # length
         d.write_short(4)  # type
         d.write_short(len(self.text))
@@ -85,11 +99,10 @@ class TextData:
         d.write_checksum()
         for i, character in enumerate(self.text):
             if self.colors is not None:
-                d.write_bytes(self.colors[i].serialize())
+                self.colors[i].write_to(d)
             else:
-                d.write_bytes(ColorData(255, 255, 255).serialize())
-            d.write_bytes(CharacterData(character).serialize())
-        d.write_bytes(SpeedData(self.speed).serialize())
-        d.write_bytes(TimeData(0).serialize())
-        d.write_bytes(EffectData(self.effects).serialize())
-        return d.to_bytes()
+                ColorData(255, 255, 255).write_to(d)
+            CharacterData(character).write_to(d)
+        SpeedData(self.speed).write_to(d)
+        TimeData(0).write_to(d)
+        EffectData(self.effects).write_to(d)
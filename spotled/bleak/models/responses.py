@@ -28,6 +28,24 @@ class SendingDataResponse:
         self.command_type = d.read_short()
 
 
+class SendingDataFinishResponse:
+    """
+    This response is sent from the device after SendingDataFinishCommand.
+    The layout of its content is not confirmed on real devices: it is read
+    like SendingDataResponse, a serial number followed by an error byte,
+    which is also what spotled.simulator sends (1 if the data did not
+    arrive intact). Until it is confirmed, a non-zero error_code is only
+    logged. Replies too short to carry a status are treated as success.
+    """
+
+    def __init__(self, content):
+        self.error_code = 0
+        if len(content) >= 3:
+            d = ByteReader(content)
+            self.serial_no = d.read_short()
+            self.error_code = d.read_byte()
+
+
 class ContinueSendingResponse:
     """
     This response is send from the device after it has finished processing
@@ -46,6 +64,13 @@ class PauseSendingResponse:
     """
     This response is sent from the device when it has an error reading sent data.
     Usually this indicates an invalid MTU (your packets are too big or too small)
+
+    offset is the number of bytes of the current window the device kept,
+    counted from the continue_from of the last ContinueSendingResponse (or
+    the start of the payload), so the host resends from continue_from +
+    offset. It is a single byte: how devices with buffers over 255 bytes
+    report pauses further into a window is not known, spotled.simulator
+    keeps at most 255 bytes of the window and reports that.
     """
 
     def __init__(self, content):
@@ -112,6 +137,7 @@ def getCommandResponse(data):
 
     response_map = {
         2: SendingDataResponse,
+        4: SendingDataFinishResponse,
         255: ContinueSendingResponse,
         254: PauseSendingResponse,
         19: DisplayInfoResponse,
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateScheduler:
+    """
+    Latest-wins updates for one LedConnection. Updates are grouped by kind
+    (display contents, brightness, screen mode) and at most one of each kind
+    waits while a transfer is running: submitting a newer one replaces it,
+    so a device that is fed faster than it can receive skips the stale
+    states and always ends up showing the newest one. A kind keeps its place
+    in the queue when replaced, so no kind can starve the others. With
+    cancel_in_flight a new update also aborts a running transfer of the same
+    kind instead of waiting for it.
+    """
+
+    DISPLAY = "display"
+    BRIGHTNESS = "brightness"
+    SCREEN_MODE = "screen_mode"
+
+    def __init__(self, connection, cancel_in_flight=False):
+        self.connection = connection
+        self.cancel_in_flight = cancel_in_flight
+        # kind -> (update, future) waiting to be sent
+        self._pending = OrderedDict()
+        self._current_kind = None
+        self._current = None
+        self._worker = None
+        self.sent = 0
+        self.superseded = 0
+
+    def submit(self, kind, update):
+        """
+        Schedules update, a function returning an awaitable that applies it,
+        replacing a pending update of the same kind. Returns a future
+        resolved with True once it was applied, False if a newer update
+        superseded it, or the exception applying it raised.
+        """
+        future = asyncio.get_running_loop().create_future()
+        previous = self._pending.get(kind)
+        if previous is not None:
+            self._supersede(previous[1])
+        self._pending[kind] = (update, future)
+
+        if (
+            self.cancel_in_flight
+            and self._current is not None
+            and self._current_kind == kind
+        ):
+            self._current.cancel()
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        return future
+
+    def _supersede(self, future):
+        self.superseded += 1
+        if not future.done():
+            future.set_result(False)
+
+    async def _run(self):
+        while self._pending:
+            kind, (update, future) = self._pending.popitem(last=False)
+            self._current_kind = kind
+            self._current = asyncio.ensure_future(update())
+            try:
+                # wait without passing our own cancellation on to the update
+                await asyncio.wait([self._current])
+            except asyncio.CancelledError:
+                self._current.cancel()
+                self._supersede(future)
+                raise
+            finally:
+                task = self._current
+                self._current = self._current_kind = None
+
+            if task.cancelled():
+                # aborted by a newer update of the same kind
+                self._supersede(future)
+            elif task.exception() is not None:
+                logger.warning("Updating %s failed: %r", kind, task.exception())
+                if not future.done():
+                    future.set_exception(task.exception())
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(True)
+
+    async def flush(self):
+        """
+        Waits until every scheduled update was applied or superseded.
+        """
+        while self._worker is not None and not self._worker.done():
+            await asyncio.wait([self._worker])
+
+    async def close(self):
+        """
+        Stops the scheduler, dropping pending updates and aborting a running one.
+        """
+        for _, future in self._pending.values():
+            self._supersede(future)
+        self._pending.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.wait([self._worker])
+
+    def set_text(self, text, **kwargs):
+        return self.submit(
+            self.DISPLAY, lambda: self.connection.set_text(text, **kwargs)
+        )
+
+    def set_text_lines(self, text, **kwargs):
+        return self.submit(
+            self.DISPLAY, lambda: self.connection.set_text_lines(text, **kwargs)
+        )
+
+    def send_data(self, data_command, **kwargs):
+        """
+        Schedules a data command that replaces the display contents.
+        """
+        return self.submit(
+            self.DISPLAY, lambda: self.connection.send_data(data_command, **kwargs)
+        )
+
+    def clear(self):
+        return self.submit(self.DISPLAY, self.connection.clear)
+
+    def set_brightness(self, brightness):
+        return self.submit(
+            self.BRIGHTNESS, lambda: self.connection.set_brightness(brightness)
+        )
+
+    def set_screen_mode(self, mode):
+        return self.submit(
+            self.SCREEN_MODE, lambda: self.connection.set_screen_mode(mode)
+        )
@@ -0,0 +1,246 @@
+"""
+Records the traffic between a LedConnection and its device to a JSONL file
+and replays it, to reproduce slow or failing transfers seen in the field.
+
+A trace starts with a header line, followed by one event per line:
+
+    {"trace": "spotled", "version": 1, "created": 1760000000.0, ...}
+    {"t": 0.000123, "event": "cmd", "data": "0b01000180040000012a"}
+
+t is the time in seconds since the recording started, taken from a
+monotonic clock. event is one of connect and disconnect, cmd and data for
+writes to the command and data characteristics, and notify for
+notifications from the device. data is hex encoded.
+
+The command line interface is in spotled.bleak.tracetool.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from .models.commands import SendDataCommand
+from .models.responses import *
+from .dispatch import match_response
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+WRITE_EVENTS = ("cmd", "data")
+
+# command types of the writes that open and close a transfer
+_START_COMMAND = 1
+_FINISH_COMMAND = 3
+_DATA_COMMAND_HEADER_SIZE = 15
+
+
+class TraceEvent:
+    def __init__(self, time, event, data=b""):
+        self.time = time
+        self.event = event
+        self.data = data
+
+    def __repr__(self):
+        return f"<TraceEvent {self.time:.6f} {self.event} {self.data.hex()}>"
+
+
+class TraceRecorder:
+    """
+    Appends trace events to path. The file is line buffered, so a trace is
+    complete up to the last event even if the process dies; close it once
+    the connection is no longer used (LedConnection.disconnect does so for
+    recorders it created). Recording after close appends to the file
+    again. metadata is stored in the header.
+    """
+
+    def __init__(self, path, **metadata):
+        self.path = path
+        self._file = open(path, "w", buffering=1)
+        self._started = time.monotonic()
+        self._write(
+            dict(
+                trace="spotled", version=TRACE_VERSION, created=time.time(), **metadata
+            )
+        )
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def record(self, event, data=b""):
+        if self._file.closed:
+            # the connection was used again after closing, keep appending
+            self._file = open(self.path, "a", buffering=1)
+        self._write(
+            {
+                "t": round(time.monotonic() - self._started, 6),
+                "event": event,
+                "data": bytes(data).hex(),
+            }
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class TracingClient:
+    """
+    Wraps a BleakClient (or a stand-in such as SimulatedBleakClient) and
+    records connects, writes and notifications to a TraceRecorder. Anything
+    else is passed through to the wrapped client.
+    """
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _event(self, characteristic):
+        from . import DATA_CHARACTERISTIC_UUID
+
+        if isinstance(characteristic, int):
+            characteristic = self.client.services.get_characteristic(characteristic)
+        uuid = str(getattr(characteristic, "uuid", characteristic)).lower()
+        return "data" if uuid == DATA_CHARACTERISTIC_UUID else "cmd"
+
+    async def connect(self, **kwargs):
+        await self.client.connect(**kwargs)
+        self.recorder.record("connect")
+
+    async def disconnect(self):
+        self.recorder.record("disconnect")
+        await self.client.disconnect()
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        self.recorder.record(self._event(characteristic), data)
+        await self.client.write_gatt_char(characteristic, data, response=response)
+
+    async def start_notify(self, characteristic, callback, **kwargs):
+        def traced(sender, data):
+            self.recorder.record("notify", data)
+            return callback(sender, data)
+
+        await self.client.start_notify(characteristic, traced, **kwargs)
+
+
+def read_trace(path):
+    """
+    Returns the header and the list of TraceEvents of a trace file.
+    """
+    with open(path) as fh:
+        header = json.loads(fh.readline())
+        if header.get("trace") != "spotled":
+            raise ValueError(f"{path} is not a SpotLED trace.")
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version {header.get('version')}.")
+        events = [
+            TraceEvent(entry["t"], entry["event"], bytes.fromhex(entry["data"]))
+            for entry in map(json.loads, fh)
+        ]
+    return header, events
+
+
+def trace_data_commands(events):
+    """
+    Reassembles the SendDataCommands of the transfers in events that were
+    finished, the command header already stripped off so they can be sent
+    again as they are. Data resent after a PauseSendingResponse replaces
+    what was written before, like on the device.
+    """
+    commands = []
+    payload = None
+    acked = 0
+    for event in events:
+        if event.event == "data" and payload is not None:
+            payload += event.data
+        elif event.event == "notify" and payload is not None:
+            try:
+                response = getCommandResponse(event.data)
+            except Exception:
+                continue
+            if type(response) == ContinueSendingResponse:
+                acked = response.continue_from
+            elif type(response) == PauseSendingResponse:
+                del payload[acked + response.offset :]
+        elif event.event == "cmd" and len(event.data) > 2:
+            if event.data[1] == _START_COMMAND:
+                payload = bytearray()
+                acked = 0
+            elif event.data[1] == _FINISH_COMMAND and payload is not None:
+                if len(payload) >= _DATA_COMMAND_HEADER_SIZE:
+                    command = SendDataCommand(
+                        bytes(payload[_DATA_COMMAND_HEADER_SIZE:])
+                    )
+                    command.command_type = int.from_bytes(payload[4:6], "big")
+                    commands.append(command)
+                payload = None
+    return commands
+
+
+async def replay_trace(events, connection, speed=None, sync=True, sync_timeout=1.0):
+    """
+    Sends the writes in events to the device of connection, a LedConnection,
+    and returns a summary of the replay. With speed the original timing is
+    kept, scaled by speed (2 replays twice as fast); otherwise writes are
+    sent as fast as possible. With sync every write and disconnect first
+    waits for as many notifications as the device had sent before it in
+    the trace, so flow control stays in step, giving up after sync_timeout
+    seconds. Disconnects in the trace are replayed, writes reconnect as
+    needed. Pass trace to the LedConnection to record the replay itself.
+    """
+    notifications = connection.dispatcher.subscribe(match_response())
+    summary = dict(writes=0, expected_notifications=0, notifications=0, sync_timeouts=0)
+    started = time.monotonic()
+    first = events[0].time if events else 0.0
+
+    async def catch_up():
+        while summary["notifications"] < summary["expected_notifications"]:
+            try:
+                await asyncio.wait_for(notifications.get(), sync_timeout)
+            except asyncio.TimeoutError:
+                summary["sync_timeouts"] += 1
+                logger.warning(
+                    "Replay got %s of %s notifications, continuing",
+                    summary["notifications"],
+                    summary["expected_notifications"],
+                )
+                return
+            summary["notifications"] += 1
+
+    try:
+        for event in events:
+            if event.event == "notify":
+                summary["expected_notifications"] += 1
+                continue
+            if event.event not in WRITE_EVENTS and event.event != "disconnect":
+                continue
+
+            if speed:
+                delay = started + (event.time - first) / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if sync:
+                await catch_up()
+
+            if event.event == "disconnect":
+                await connection.connection.disconnect()
+                continue
+            await connection._ensure_connection()
+            handle = (
+                connection.data_handle
+                if event.event == "data"
+                else connection.cmd_handle
+            )
+            await connection.connection.write_gatt_char(
+                handle, event.data, response=False if event.event == "data" else None
+            )
+            summary["writes"] += 1
+
+        # replies to the last writes, and any the device sent on top
+        await catch_up()
+        summary["notifications"] += notifications.qsize()
+    finally:
+        connection.dispatcher.unsubscribe(notifications)
+    summary["duration"] = time.monotonic() - started
+    return summary
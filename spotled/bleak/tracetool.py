@@ -0,0 +1,71 @@
+"""
+Inspects and replays traces recorded with LedConnection(trace=...), see
+spotled.bleak.trace.
+
+    python -m spotled.bleak.tracetool payloads TRACE
+    python -m spotled.bleak.tracetool replay TRACE (--address ADDRESS | --simulate) [--speed 1] [--record REPLAY]
+"""
+import argparse
+import asyncio
+import json
+
+from . import LedConnection
+from .trace import read_trace, replay_trace, trace_data_commands
+from ..simulator import SimulatedBleakClient, SimulatedDevice
+
+
+async def _replay_main(args):
+    header, events = read_trace(args.trace)
+    if args.simulate:
+        device = SimulatedDevice(address=header.get("address") or "5E:00:00:00:00:01")
+        connection = LedConnection(
+            device.address,
+            cache=None,
+            client=SimulatedBleakClient(device),
+            trace=args.record,
+        )
+    else:
+        connection = LedConnection(args.address, trace=args.record)
+    try:
+        summary = await replay_trace(
+            events, connection, speed=args.speed, sync=not args.no_sync
+        )
+    finally:
+        await connection.disconnect()
+    print(json.dumps(summary, indent=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay SpotLED traces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    payloads = commands.add_parser(
+        "payloads", help="print the content of every transfer as hex"
+    )
+    payloads.add_argument("trace")
+
+    replay = commands.add_parser("replay", help="send the writes of a trace again")
+    replay.add_argument("trace")
+    target = replay.add_mutually_exclusive_group(required=True)
+    target.add_argument("--address", help="replay to the device with this address")
+    target.add_argument(
+        "--simulate", action="store_true", help="replay to a simulated device"
+    )
+    replay.add_argument(
+        "--speed", type=float, help="keep the original timing, scaled by this factor"
+    )
+    replay.add_argument(
+        "--no-sync", action="store_true", help="do not wait for notifications"
+    )
+    replay.add_argument("--record", help="record the replay to this trace file")
+    args = parser.parse_args()
+
+    if args.command == "payloads":
+        for command in trace_data_commands(read_trace(args.trace)[1]):
+            print(command.content.hex())
+    else:
+        asyncio.run(_replay_main(args))
+
+
+if __name__ == "__main__":
+    main()
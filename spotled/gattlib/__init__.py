@@ -1,9 +1,17 @@
 from gattlib import GATTRequester
-from threading import Event
+from threading import Lock
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from enum import Enum
+import json
+import logging
+import os
+import queue
+import tempfile
 import time
 import os.path
 
+logger = logging.getLogger(__name__)
+
 class ByteWriter:
     """
     A class for writing bytes into binary blob by type sequentially.
@@ -92,6 +100,63 @@ def _discover_handles(req):
 
     return cmd_handle, data_handle
 
+def _device_cache_path():
+    """
+    The device cache shared with the bleak backend: $SPOTLED_CACHE, or
+    spotled/devices.json in the user's cache directory.
+    """
+    path = os.environ.get('SPOTLED_CACHE')
+    if path:
+        return path
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'spotled', 'devices.json')
+
+# the device cache entries are kept in memory, along with the path and the
+# (mtime, size) of the file they were read from; hold the lock to use them
+_device_cache_lock = Lock()
+_device_cache = {'path': None, 'stamp': None, 'entries': {}}
+
+def _device_cache_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _load_device_cache():
+    # the file is only parsed again when another process changed it
+    path = _device_cache_path()
+    stamp = _device_cache_stamp(path)
+    if _device_cache['path'] == path and _device_cache['stamp'] == stamp:
+        return _device_cache['entries']
+    try:
+        with open(path) as fh:
+            entries = json.load(fh)
+    except (OSError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    _device_cache.update(path=path, stamp=stamp, entries=entries)
+    return entries
+
+def _store_device_cache(entries):
+    # the cache only saves time, failing to write it is not an error
+    path = _device_cache_path()
+    directory = os.path.dirname(path) or '.'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='devices.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(entries, fh, indent=1, sort_keys=True)
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+    _device_cache.update(path=path, stamp=_device_cache_stamp(path), entries=entries)
+
 
 class SendingDataStartCommand:
     """
@@ -530,6 +595,22 @@ class SendingDataResponse:
         self.error_code = d.read_byte()
         self.command_type = d.read_short()
 
+class SendingDataFinishResponse:
+    """
+    This response is sent from the device after SendingDataFinishCommand.
+    The layout of its content is not confirmed on real devices: it is read
+    like SendingDataResponse, a serial number followed by an error byte,
+    which is also what spotled.simulator sends (1 if the data did not
+    arrive intact). Until it is confirmed, a non-zero error_code is only
+    logged.
+    """
+    def __init__(self, content):
+        self.error_code = 0
+        if len(content) >= 3:
+            d = ByteReader(content)
+            self.serial_no = d.read_short()
+            self.error_code = d.read_byte()
+
 class ContinueSendingResponse:
     """
     This response is send from the device after it has finished processing
@@ -549,7 +630,7 @@ class PauseSendingResponse:
     Usually this indicates an invalid MTU (your packets are too big or too small)
     """
     def __init__(self, content):
-        assert len(content) == 8
+        assert len(content) == 6
         d = ByteReader(content)
         self.serial_no = d.read_short()
         self.command_type = d.read_short()
@@ -605,6 +686,9 @@ def getCommandResponse(data):
     if (response.command_type == 2):
         return SendingDataResponse(response.content)
 
+    if (response.command_type == 4):
+        return SendingDataFinishResponse(response.content)
+
     if (response.command_type == 255):
         return ContinueSendingResponse(response.content)
 
@@ -622,6 +706,129 @@ def getCommandResponse(data):
 
     return response
 
+# the response each query command is answered with
+RESPONSE_TYPES = {
+    GetBufferSizeCommand: BufferSizeResponse,
+    GetDisplayInfoCommand: DisplayInfoResponse,
+    GetVersionCommand: VersionResponse,
+}
+QUERY_RESPONSES = tuple(RESPONSE_TYPES.values())
+FLOW_CONTROL_RESPONSES = (ContinueSendingResponse, PauseSendingResponse)
+
+def match_response(response_type=None, serial_no=None, exclude=()):
+    """
+    Builds a predicate for ResponseDispatcher matching responses of
+    response_type (a class or tuple of classes, any type if None) that are
+    not instances of exclude. If serial_no is given, responses carrying a
+    serial number must carry this one.
+    """
+    def match(response):
+        if response_type is not None and not isinstance(response, response_type):
+            return False
+        if exclude and isinstance(response, exclude):
+            return False
+        if serial_no is not None:
+            return getattr(response, 'serial_no', serial_no) == serial_no
+        return True
+    return match
+
+class ResponseDispatcher:
+    """
+    Parses notifications from the command characteristic and routes every
+    response to the request waiting for it. Requests register before
+    writing their command: expect for a single reply, subscribe for a
+    stream of replies such as the flow control of a transfer. Responses
+    nobody is waiting for, like the late reply to a request that already
+    timed out, are logged and dropped; the last of them is kept for
+    take_unclaimed. Notifications arrive on the gattlib thread, so
+    registrations are guarded by a lock.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._waiters = []
+        self._subscribers = []
+        self._unclaimed = None
+
+    def expect(self, match):
+        """
+        Returns a future resolved with the first response accepted by match.
+        Cancel the future to unregister it.
+        """
+        future = Future()
+        with self._lock:
+            self._waiters.append((match, future))
+        return future
+
+    def subscribe(self, match):
+        """
+        Returns a queue receiving every response accepted by match
+        until it is passed to unsubscribe.
+        """
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.append((match, q))
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers = [(match, s) for match, s in self._subscribers if s is not q]
+
+    def dispatch(self, data):
+        """
+        Hands a raw notification to whoever is waiting for it. Single replies
+        take precedence over subscriptions, older requests over newer ones.
+        """
+        try:
+            response = getCommandResponse(data)
+        except Exception:
+            logger.warning("Dropping malformed notification %s", bytes(data).hex())
+            return
+
+        with self._lock:
+            self._waiters = [(m, f) for m, f in self._waiters if not f.done()]
+            for i, (match, future) in enumerate(self._waiters):
+                if match(response) and future.set_running_or_notify_cancel():
+                    del self._waiters[i]
+                    future.set_result(response)
+                    return
+
+            for match, q in self._subscribers:
+                if match(response):
+                    q.put_nowait(response)
+                    return
+
+            self._unclaimed = response
+
+        logger.debug("Dropping unexpected %s (serial %s)",
+            type(response).__name__, getattr(response, 'serial_no', None))
+
+    def take_unclaimed(self):
+        """
+        Returns and forgets the last response nobody was waiting for, if any.
+        """
+        with self._lock:
+            response, self._unclaimed = self._unclaimed, None
+        return response
+
+class TransferError(Exception):
+    """
+    The device could not receive a transfer. Like a TimeoutError, it is
+    retried by send_data and raised once all attempts failed.
+    """
+
+def _wait_for(future, timeout, what):
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError("Timeout exceeded waiting for %s." % what)
+
+def _wait_for_queue(q, timeout, what):
+    try:
+        return q.get(timeout=timeout)
+    except queue.Empty:
+        raise TimeoutError("Timeout exceeded waiting for %s." % what)
+
 def parse_yaff_font(fontfile):
     font = {}
     with open(fontfile) as fh:
@@ -802,36 +1009,102 @@ def lines_to_frames(lines, font_data, align=Align.CENTER, width=48, lines_per_fr
     return raster_frames
 
 class LedConnection:
-    def __init__(self, address):
+    def __init__(self, address, use_cache=True, requester=None):
+        """
+        With use_cache, handles and display properties are remembered
+        per device address, so reconnecting skips discovery and queries.
+        requester replaces the GATTRequester created for address, e.g.
+        with a SimulatedGATTRequester.
+        """
         self.mtu = 23
-        self.connection = GATTRequester(address)
+        # lowered when the device pauses, so reconnecting keeps it
+        self.max_mtu = None
+        self.address = address
+        self.use_cache = use_cache
+        self.connection = GATTRequester(address) if requester is None else requester
         self.connection.on_connect = lambda mtu: self._set_mtu(mtu)
         self._ensure_connection()
         self.connection.write_by_handle(0x0f, b'\x00\x00\x00\x01') # request notifications
+        self.dispatcher = ResponseDispatcher()
+        cached = self._cached()
+        if 'cmd_handle' in cached and 'data_handle' in cached:
+            self.cmd_handle, self.data_handle = cached['cmd_handle'], cached['data_handle']
+        else:
+            self.cmd_handle, self.data_handle = _discover_handles(self.connection)
+            self._update_cache(cmd_handle=self.cmd_handle, data_handle=self.data_handle)
         self.connection.on_notification = lambda handle, data: self._on_notification(handle, data)
-        self.cmd_handle, self.data_handle = _discover_handles(self.connection)
-        
-        self.current_wait_event = Event()
-        self.last_data = None
+
+        # transfers share the data characteristic and cannot be interleaved
+        self._transfer_lock = Lock()
         self.data_serial_no = 0
         self.command_serial_no = 0
 
-        self.buffer_size = self.query_command(GetBufferSizeCommand()).buffer_size
+        if 'capabilities' in cached:
+            self._apply_capabilities(cached['capabilities'])
+            self.brightness = cached.get('brightness')
+            return
+
+        version = self.query_command(GetVersionCommand())
         display_info = self.query_command(GetDisplayInfoCommand())
-        self.width = display_info.width
-        self.height = display_info.height
-        self.frame_limit = display_info.frame_limit
+        capabilities = {
+            'firmware': [version.device_type, version.device_revision, version.software_revision],
+            'buffer_size': self.query_command(GetBufferSizeCommand()).buffer_size,
+            'width': display_info.width,
+            'height': display_info.height,
+            'frame_limit': display_info.frame_limit,
+            'color_depth': display_info.color_depth,
+        }
+        self._apply_capabilities(capabilities)
         self.brightness = display_info.brightness
-        self.color_depth = display_info.color_depth
+        self._update_cache(capabilities=capabilities, brightness=self.brightness)
+
+    def _apply_capabilities(self, capabilities):
+        self.firmware = tuple(capabilities['firmware'])
+        self.buffer_size = capabilities['buffer_size']
+        self.width = capabilities['width']
+        self.height = capabilities['height']
+        self.frame_limit = capabilities['frame_limit']
+        self.color_depth = capabilities['color_depth']
+
+    def _cached(self):
+        if not self.use_cache:
+            return {}
+        with _device_cache_lock:
+            return dict(_load_device_cache().get(self.address.upper(), {}))
+
+    def _update_cache(self, **values):
+        if not self.use_cache:
+            return
+        with _device_cache_lock:
+            entries = _load_device_cache()
+            entry = entries.setdefault(self.address.upper(), {})
+            # compare in JSON form, tuples and lists are both stored as lists
+            changed = {key: value for key, value in values.items()
+                       if key not in entry or json.dumps(entry[key]) != json.dumps(value)}
+            if changed:
+                entry.update(json.loads(json.dumps(changed)))
+                _store_device_cache(entries)
+
+    def _forget_cache(self):
+        if not self.use_cache:
+            return
+        with _device_cache_lock:
+            entries = _load_device_cache()
+            if entries.pop(self.address.upper(), None) is not None:
+                _store_device_cache(entries)
 
     def _on_notification(self, handle, data):
         if handle == self.cmd_handle:
-            self.last_data = data
-            self.current_wait_event.set()
+            self.dispatcher.dispatch(data)
 
     def _set_mtu(self, mtu):
-        self.mtu = mtu
+        self.mtu = mtu if self.max_mtu is None else min(mtu, self.max_mtu)
     
+    def _fall_back_mtu(self):
+        if self.mtu <= 23:
+            raise TransferError("The device cannot read even the smallest writes.")
+        self.mtu = self.max_mtu = 23
+
     def _next_data_serial_no(self):
         self.data_serial_no = (self.data_serial_no + 1) & 0xffffffff
         return self.data_serial_no
@@ -860,32 +1133,44 @@ class LedConnection:
         Used for basic commands and data sending flow control.
         """
         self._ensure_connection()
-        self.current_wait_event.clear()
+        # a reply to this command is what wait_for_response returns
+        self.dispatcher.take_unclaimed()
         self.connection.write_cmd(self.cmd_handle, command.serialize())
 
     def query_command(self, command, timeout=0.2, attempts=5):
         """
         Send a control command to the device and wait for a response.
         Used for basic commands and data sending flow control.
+        Only the response type the command is answered with is accepted,
+        see RESPONSE_TYPES.
         """
+        match = match_response(RESPONSE_TYPES.get(type(command)))
         for i in range(attempts + 1):
+            # register before writing so a fast reply cannot be missed
+            response = self.dispatcher.expect(match)
             try:
-                self._ensure_connection()
-                self.current_wait_event.clear()
-                self.connection.write_cmd(self.cmd_handle, command.serialize())
-                return self.wait_for_response(timeout)
+                self.send_command(command)
+                return _wait_for(response, timeout, "GATT response")
             except TimeoutError:
                 if i == attempts:
                     raise
                 self.connection.disconnect()
+            finally:
+                response.cancel()
 
     def wait_for_response(self, timeout=0.2):
         """
-        Wait for and return a response, usually from a command sent via send_command.
+        Wait for and return the next response no other request is waiting for,
+        usually from a command sent via send_command. A response that arrived
+        since the last send_command is returned right away.
         """
-        if not self.current_wait_event.wait(timeout):
-            raise TimeoutError("Timeout exceeded waiting for GATT response.")
-        return getCommandResponse(self.last_data)
+        # register first, a reply arriving meanwhile resolves the future
+        response = self.dispatcher.expect(match_response())
+        unclaimed = self.dispatcher.take_unclaimed()
+        if unclaimed is not None:
+            response.cancel()
+            return unclaimed
+        return _wait_for(response, timeout, "GATT response")
 
     def _send_data_internal(self, data_command, timeout=0.2):
         self._ensure_connection()
@@ -893,46 +1178,74 @@ class LedConnection:
         serial_no = self._next_command_serial_no()
 
         payload = data_command.serialize()
-        self.send_command(SendingDataStartCommand(serial_no, data_command.command_type, len(payload)))
-        response = self.wait_for_response(timeout)
-        assert type(response) == SendingDataResponse
-        assert response.serial_no == serial_no
-        assert response.command_type == data_command.command_type
-        assert response.error_code == 0
-
-        seek = 0
-        sent_payloads = 0
-        send_size = self.mtu - 3
-        send_count = self.buffer_size // send_size
-
-        while seek < len(payload):
-            self.current_wait_event.clear()
-            self.connection.write_cmd(self.data_handle, payload[seek:seek+send_size])
-            sent_payloads += 1
-            seek += send_size
-
-            if sent_payloads >= send_count:
-                sent_payloads = 0
-                response = self.wait_for_response(timeout)
-                assert type(response) == ContinueSendingResponse
-                assert response.serial_no == serial_no
-                assert response.command_type == data_command.command_type
-                seek = response.continue_from
-        
-        self.send_command(SendingDataFinishCommand(serial_no, data_command.command_type, len(payload)))
-        self.wait_for_response(timeout)
+        # responses of other transfers carry other serial numbers and are dropped
+        started = self.dispatcher.expect(match_response(SendingDataResponse, serial_no))
+        acks = self.dispatcher.subscribe(match_response(FLOW_CONTROL_RESPONSES, serial_no))
+        finished = None
+        try:
+            self.send_command(SendingDataStartCommand(serial_no, data_command.command_type, len(payload)))
+            response = _wait_for(started, timeout, "the transfer to start")
+            assert response.command_type == data_command.command_type
+            assert response.error_code == 0
+
+            seek = 0
+            sent_payloads = 0
+            send_size = self.mtu - 3
+            send_count = self.buffer_size // send_size
+
+            while seek < len(payload):
+                self.connection.write_cmd(self.data_handle, payload[seek:seek+send_size])
+                sent_payloads += 1
+                seek += send_size
+
+                if sent_payloads >= send_count:
+                    sent_payloads = 0
+                    response = _wait_for_queue(acks, timeout, "the device to accept more data")
+                    assert response.command_type == data_command.command_type
+                    if type(response) == PauseSendingResponse:
+                        # the device could not read the writes, usually because of
+                        # their size; start over with smaller ones
+                        self._fall_back_mtu()
+                        raise TransferError("The device paused the transfer at offset %s." % response.offset)
+                    seek = response.continue_from
+
+            finished = self.dispatcher.expect(match_response(
+                serial_no=serial_no, exclude=FLOW_CONTROL_RESPONSES + QUERY_RESPONSES))
+            self.send_command(SendingDataFinishCommand(serial_no, data_command.command_type, len(payload)))
+            response = _wait_for(finished, timeout, "the transfer to finish")
+            # the last window is never acked, a pause for its writes only
+            # shows up now; the retry then uses smaller writes
+            while not acks.empty():
+                pause = acks.get_nowait()
+                if type(pause) == PauseSendingResponse:
+                    self._fall_back_mtu()
+                    raise TransferError("The device paused the transfer at offset %s." % pause.offset)
+            if getattr(response, 'error_code', 0) != 0:
+                # the status layout is unconfirmed, see SendingDataFinishResponse
+                logger.warning("The device reported status %s finishing the transfer.", response.error_code)
+        finally:
+            started.cancel()
+            if finished is not None:
+                finished.cancel()
+            self.dispatcher.unsubscribe(acks)
 
     def send_data(self, data_command, timeout=0.2, attempts=5):
         """
         Send a data command to the device.
         Currently only SendDataCommand is used, which accepts raw serialized data.
         """
+        with self._transfer_lock:
+            self._send_data_retrying(data_command, timeout, attempts)
+
+    def _send_data_retrying(self, data_command, timeout, attempts):
         for i in range(attempts + 1):
             try:
                 self._send_data_internal(data_command, timeout)
                 return
-            except TimeoutError:
+            except (TimeoutError, TransferError):
                 if i == attempts:
+                    # what we remember about the device may be what is wrong
+                    self._forget_cache()
                     raise
                 self.connection.disconnect()
 
@@ -942,6 +1255,7 @@ class LedConnection:
         """
         self.send_data(SendDataCommand(BrightnessData(brightness).serialize()))
         self.brightness = brightness
+        self._update_cache(brightness=brightness)
 
     def set_screen_mode(self, mode: ScreenMode):
         """
@@ -0,0 +1,443 @@
+"""
+An in-process SPOTLED device for exercising both backends without hardware.
+
+SimulatedDevice implements the command and data protocol. SimulatedBleakClient
+and SimulatedGATTRequester expose it through the BleakClient and GATTRequester
+interfaces the backends use, so it can be passed to either LedConnection:
+
+    device = SimulatedDevice(mtu=185, buffer_size=512, write_latency=0.002)
+    sender = spotled.LedConnection(device.address, client=SimulatedBleakClient(device))
+"""
+import asyncio
+import random
+import struct
+import threading
+
+from .bleak.models.byte import ByteReader
+
+SERVICE_UUID = "0000ff20-0000-1000-8000-00805f9b34fb"
+CMD_CHARACTERISTIC_UUID = "0000ff21-0000-1000-8000-00805f9b34fb"
+DATA_CHARACTERISTIC_UUID = "0000ff22-0000-1000-8000-00805f9b34fb"
+
+SERVICE_HANDLE = 12
+CMD_HANDLE = 15
+DATA_HANDLE = 18
+
+DATA_COMMAND_HEADER_SIZE = 15
+
+
+def _response(command_type, content):
+    return bytes((len(content) + 2, command_type)) + content
+
+
+def _checksum(data):
+    value = sum(data)
+    if value > 255:
+        value = (~value) + 1
+    return value & 255
+
+
+class SimulatedDevice:
+    """
+    The protocol state machine of a SPOTLED badge. handle_command and
+    handle_data take the bytes written to the command and data
+    characteristics and return the notifications the device answers with.
+
+    The data window behaves like the real device as far as it is known:
+    a ContinueSendingResponse is sent after buffer_size // (mtu - 3) writes,
+    or earlier once another full sized write would not fit into
+    buffer_size. Writes longer than mtu - 3 cannot be read and are answered
+    with a PauseSendingResponse whose offset is the position in the current
+    window to resend from; until the host got that notification, further
+    writes are discarded. The offset is a single byte, so in windows past
+    255 bytes the device keeps only their first 255 bytes and the host
+    resends the rest. Lost writes are simply missing, so the window
+    never fills and the host has to time out and retry.
+
+    Transports use write_latency, notify_latency, jitter, loss and
+    notification_loss to delay and drop traffic, drawing from a random
+    generator seeded with seed.
+    """
+
+    def __init__(
+        self,
+        address="5E:00:00:00:00:01",
+        width=48,
+        height=12,
+        color_depth=16,
+        frame_limit=20,
+        brightness=50,
+        buffer_size=128,
+        mtu=23,
+        firmware=(1, 1, 1),
+        connect_latency=0.0,
+        write_latency=0.0,
+        notify_latency=0.0,
+        jitter=0.0,
+        loss=0.0,
+        notification_loss=0.0,
+        seed=None,
+    ):
+        self.address = address
+        self.width = width
+        self.height = height
+        self.color_depth = color_depth
+        self.frame_limit = frame_limit
+        self.brightness = brightness
+        self.buffer_size = buffer_size
+        self.mtu = mtu
+        self.firmware = firmware
+        self.connect_latency = connect_latency
+        self.write_latency = write_latency
+        self.notify_latency = notify_latency
+        self.jitter = jitter
+        self.loss = loss
+        self.notification_loss = notification_loss
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # payloads of completed data commands, header stripped
+        self.received = []
+        self.stats = dict.fromkeys(
+            (
+                "commands",
+                "data_writes",
+                "data_bytes",
+                "lost_writes",
+                "discarded_writes",
+                "lost_notifications",
+                "continues",
+                "pauses",
+                "transfers",
+                "failed_transfers",
+            ),
+            0,
+        )
+        self._transfer = None
+        self._paused = False
+
+    def notification_delay(self):
+        return self.notify_latency + self.random.uniform(0, self.jitter)
+
+    def drop_write(self):
+        if self.loss and self.random.random() < self.loss:
+            self.stats["lost_writes"] += 1
+            return True
+        return False
+
+    def drop_notification(self):
+        if self.notification_loss and self.random.random() < self.notification_loss:
+            self.stats["lost_notifications"] += 1
+            return True
+        return False
+
+    def notification_delivered(self, data):
+        # the host now knows about the pause and resends from its offset
+        if data[1:2] == b"\xfe":
+            self._paused = False
+
+    def handle_command(self, data):
+        with self._lock:
+            self.stats["commands"] += 1
+            if data == b"\x00\x00\x00\x01":
+                # enables notifications, not answered
+                return []
+            d = ByteReader(bytes(data))
+            d.read_byte()  # length
+            command_type = d.read_byte()
+            if command_type == 1:
+                return self._start_transfer(d)
+            if command_type == 3:
+                return self._finish_transfer(d)
+            if command_type == 16:
+                device_type, device_revision, software_revision = self.firmware
+                return [
+                    _response(
+                        17,
+                        b"\x00\x00\x00"
+                        + struct.pack(
+                            ">HII", device_type, device_revision, software_revision
+                        ),
+                    )
+                ]
+            if command_type == 18:
+                return [
+                    _response(
+                        19,
+                        b"\x00\x00\x00"
+                        + struct.pack(
+                            ">HHBBBB",
+                            self.width,
+                            self.height,
+                            self.color_depth,
+                            self.frame_limit,
+                            self.brightness,
+                            0,
+                        ),
+                    )
+                ]
+            if command_type == 20:
+                return [_response(21, b"\x00\x00\x00" + struct.pack(">I", self.buffer_size))]
+            return []
+
+    def _start_transfer(self, d):
+        serial_no = d.read_short()
+        command_type = d.read_short()
+        length = d.read_int()
+        self._transfer = {
+            "serial_no": serial_no,
+            "command_type": command_type,
+            "length": length,
+            "data": bytearray(),
+            "window": 0,
+            "window_writes": 0,
+        }
+        self._paused = False
+        return [_response(2, struct.pack(">HBH", serial_no, 0, command_type))]
+
+    def _finish_transfer(self, d):
+        serial_no = d.read_short()
+        transfer = self._transfer
+        self._transfer = None
+        error = 1
+        if (
+            transfer is not None
+            and transfer["serial_no"] == serial_no
+            and len(transfer["data"]) == transfer["length"]
+        ):
+            payload = bytes(transfer["data"])
+            header = payload[:DATA_COMMAND_HEADER_SIZE]
+            if _checksum(header[:-1]) == header[-1]:
+                error = 0
+                self.received.append(payload[DATA_COMMAND_HEADER_SIZE:])
+                self._apply(payload[DATA_COMMAND_HEADER_SIZE:])
+        self.stats["transfers" if error == 0 else "failed_transfers"] += 1
+        return [_response(4, struct.pack(">HB", serial_no, error))]
+
+    def _apply(self, content):
+        # keeps the brightness reported by GetDisplayInfoCommand current
+        if len(content) == 8:
+            d = ByteReader(content)
+            length = d.read_int()
+            data_type = d.read_short()
+            if length == 8 and data_type == 14:  # BrightnessData
+                self.brightness = d.read_byte()
+
+    def handle_data(self, data):
+        with self._lock:
+            transfer = self._transfer
+            if transfer is None or self._paused:
+                self.stats["discarded_writes"] += 1
+                return []
+            self.stats["data_writes"] += 1
+            if len(data) > self.mtu - 3:
+                # the write could not be read, ask for the rest of the window
+                # again. The offset has to fit into a byte, data kept past it
+                # is dropped and resent by the host
+                offset = min(transfer["window"], 255)
+                del transfer["data"][
+                    len(transfer["data"]) - transfer["window"] + offset :
+                ]
+                transfer["window"] = offset
+                self._paused = True
+                self.stats["pauses"] += 1
+                return [
+                    _response(
+                        254,
+                        struct.pack(
+                            ">HHBB",
+                            transfer["serial_no"],
+                            transfer["command_type"],
+                            0,
+                            offset,
+                        ),
+                    )
+                ]
+            self.stats["data_bytes"] += len(data)
+            transfer["data"] += data
+            transfer["window"] += len(data)
+            transfer["window_writes"] += 1
+            write_size = self.mtu - 3
+            if (
+                transfer["window_writes"] >= max(self.buffer_size // write_size, 1)
+                or transfer["window"] + write_size > self.buffer_size
+            ):
+                transfer["window"] = transfer["window_writes"] = 0
+                self.stats["continues"] += 1
+                return [
+                    _response(
+                        255,
+                        struct.pack(
+                            ">HHI",
+                            transfer["serial_no"],
+                            transfer["command_type"],
+                            len(transfer["data"]),
+                        ),
+                    )
+                ]
+            return []
+
+
+class SimulatedCharacteristic:
+    def __init__(self, handle, uuid):
+        self.handle = handle
+        self.uuid = uuid
+
+
+class SimulatedService:
+    def __init__(self, handle, uuid, characteristics):
+        self.handle = handle
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+    def get_characteristic(self, uuid):
+        return next((c for c in self.characteristics if c.uuid == uuid), None)
+
+
+class SimulatedServiceCollection:
+    def __init__(self):
+        self.cmd = SimulatedCharacteristic(CMD_HANDLE, CMD_CHARACTERISTIC_UUID)
+        self.data = SimulatedCharacteristic(DATA_HANDLE, DATA_CHARACTERISTIC_UUID)
+        self.services = {
+            SERVICE_HANDLE: SimulatedService(
+                SERVICE_HANDLE, SERVICE_UUID, [self.cmd, self.data]
+            )
+        }
+
+    def get_service(self, specifier):
+        if isinstance(specifier, int):
+            return self.services.get(specifier)
+        return next((s for s in self.services.values() if s.uuid == specifier), None)
+
+    def get_characteristic(self, specifier):
+        for service in self.services.values():
+            for characteristic in service.characteristics:
+                if specifier in (characteristic.handle, characteristic.uuid):
+                    return characteristic
+        return None
+
+
+class SimulatedBleakClient:
+    """
+    Stands in for BleakClient, driving a SimulatedDevice on the running event loop.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.services = SimulatedServiceCollection()
+        self.is_connected = False
+        self._callback = None
+
+    @property
+    def address(self):
+        return self.device.address
+
+    @property
+    def mtu_size(self):
+        return self.device.mtu
+
+    async def connect(self):
+        await asyncio.sleep(self.device.connect_latency)
+        self.is_connected = True
+
+    async def disconnect(self):
+        self.is_connected = False
+        self._callback = None
+
+    async def start_notify(self, characteristic, callback):
+        self._callback = callback
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if not self.is_connected:
+            raise ConnectionError("Not connected.")
+        data = bytes(data)
+        if not isinstance(characteristic, SimulatedCharacteristic):
+            # bleak also accepts handles and UUIDs
+            characteristic = self.services.get_characteristic(characteristic)
+        if self.device.write_latency:
+            await asyncio.sleep(self.device.write_latency)
+        if characteristic is self.services.data:
+            if self.device.drop_write():
+                return
+            notifications = self.device.handle_data(data)
+        else:
+            notifications = self.device.handle_command(data)
+        loop = asyncio.get_running_loop()
+        for notification in notifications:
+            if not self.device.drop_notification():
+                loop.call_later(
+                    self.device.notification_delay(), self._notify, notification
+                )
+
+    def _notify(self, data):
+        self.device.notification_delivered(data)
+        if self._callback is not None and self.is_connected:
+            self._callback(self.services.cmd, bytearray(data))
+
+
+class SimulatedGATTRequester:
+    """
+    Stands in for gattlib's GATTRequester, driving a SimulatedDevice.
+    Notifications are delivered on timer threads, like gattlib's own thread.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self._connected = False
+
+    def on_notification(self, handle, data):
+        pass
+
+    def on_connect(self, mtu):
+        pass
+
+    def is_connected(self):
+        return self._connected
+
+    def connect(self):
+        if self.device.connect_latency:
+            threading.Event().wait(self.device.connect_latency)
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def discover_primary(self):
+        return [{"uuid": SERVICE_UUID, "start": SERVICE_HANDLE, "end": DATA_HANDLE + 1}]
+
+    def discover_characteristics(self, start, end):
+        return [
+            {"uuid": CMD_CHARACTERISTIC_UUID, "value_handle": CMD_HANDLE},
+            {"uuid": DATA_CHARACTERISTIC_UUID, "value_handle": DATA_HANDLE},
+        ]
+
+    def write_by_handle(self, handle, data):
+        pass
+
+    def write_cmd(self, handle, data):
+        if not self._connected:
+            raise ConnectionError("Not connected.")
+        data = bytes(data)
+        if self.device.write_latency:
+            threading.Event().wait(self.device.write_latency)
+        if handle == DATA_HANDLE:
+            if self.device.drop_write():
+                return
+            notifications = self.device.handle_data(data)
+        else:
+            notifications = self.device.handle_command(data)
+        for notification in notifications:
+            if not self.device.drop_notification():
+                timer = threading.Timer(
+                    self.device.notification_delay(), self._notify, (notification,)
+                )
+                timer.daemon = True
+                timer.start()
+
+    def _notify(self, data):
+        self.device.notification_delivered(data)
+        if self._connected:
+            # gattlib passes the ATT opcode and handle along with the value
+            self.on_notification(
+                CMD_HANDLE, b"\x1b" + CMD_HANDLE.to_bytes(2, "little") + data
+            )
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import pytest
+
+from spotled import BrightnessData, LedConnection, SendDataCommand, TransferTimeouts
+from spotled.bleak import DEFAULT_MTU, MTU_FALLBACK
+from spotled.bleak.models.commands import GetVersionCommand
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+PAYLOAD = bytes(range(256)) * 4
+
+
+def connect(device, timeouts=None, client=None):
+    return LedConnection(
+        device.address,
+        timeouts=timeouts,
+        cache=None,
+        client=client or SimulatedBleakClient(device),
+    )
+
+
+def test_timeouts_coerce_a_number():
+    timeouts = TransferTimeouts.coerce(0.5)
+    assert (timeouts.command, timeouts.start, timeouts.ack, timeouts.finish) == (
+        0.5,
+        0.5,
+        0.5,
+        0.5,
+    )
+    assert timeouts.total is None
+    assert TransferTimeouts.coerce(timeouts) is timeouts
+
+
+def test_query_command_times_out():
+    device = SimulatedDevice(notify_latency=0.5)
+
+    async def main():
+        connection = connect(device, TransferTimeouts(command=0.02))
+        await connection._ensure_connection()
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await connection.query_command(GetVersionCommand(), attempts=0)
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.3
+
+
+def test_lost_writes_time_out_every_attempt():
+    device = SimulatedDevice()
+
+    async def main():
+        connection = connect(device, TransferTimeouts.coerce(0.02))
+        await connection._init()
+        # from now on every data write is lost, so no window is ever acked
+        device.loss = 1.0
+        with pytest.raises(TimeoutError):
+            await connection.send_data(SendDataCommand(PAYLOAD), attempts=1)
+        return connection.metrics.last
+
+    transfer = asyncio.run(main())
+    assert transfer.attempts == 2
+    assert isinstance(transfer.error, TimeoutError)
+    assert device.received == []
+
+
+def test_total_timeout_bounds_the_whole_transfer():
+    device = SimulatedDevice(write_latency=0.01)
+
+    async def main():
+        connection = connect(device, TransferTimeouts(total=0.1))
+        await connection._init()
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await connection.send_data(SendDataCommand(PAYLOAD))
+        elapsed = time.monotonic() - started
+        # the connection is still usable afterwards
+        await connection.send_data(SendDataCommand(BrightnessData(10)), 1.0)
+        return elapsed
+
+    assert asyncio.run(main()) < 0.5
+    assert device.brightness == 10
+
+
+def test_connect_times_out():
+    device = SimulatedDevice(connect_latency=1.0)
+
+    async def main():
+        connection = connect(device, TransferTimeouts(connect=0.05))
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await connection._init()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.5
+
+
+class CountingClient(SimulatedBleakClient):
+    """
+    Counts connects and fails the first start_notify calls.
+    """
+
+    def __init__(self, device, notify_failures=0):
+        super().__init__(device)
+        self.connects = 0
+        self.notify_failures = notify_failures
+
+    async def connect(self):
+        self.connects += 1
+        await super().connect()
+
+    async def start_notify(self, characteristic, callback):
+        if self.notify_failures:
+            self.notify_failures -= 1
+            raise OSError("Notifications could not be enabled.")
+        await super().start_notify(characteristic, callback)
+
+
+def test_concurrent_calls_connect_once():
+    device = SimulatedDevice(connect_latency=0.02)
+    client = CountingClient(device)
+
+    async def main():
+        connection = connect(device, client=client)
+        await asyncio.gather(*(connection._ensure_connection() for _ in range(5)))
+        await connection._init()
+
+    asyncio.run(main())
+    assert client.connects == 1
+
+
+def test_failed_setup_disconnects():
+    device = SimulatedDevice()
+    client = CountingClient(device, notify_failures=1)
+
+    async def main():
+        connection = connect(device, client=client)
+        with pytest.raises(OSError):
+            await connection._init()
+        assert not client.is_connected
+        # the next call connects and sets up again instead of using the
+        # half set up connection
+        await connection._init()
+        await connection.send_data(SendDataCommand(BrightnessData(30)))
+
+    asyncio.run(main())
+    assert client.connects == 2
+    assert device.brightness == 30
+
+
+def test_mtu_fallback_ladder():
+    connection = connect(SimulatedDevice())
+    connection.mtu = 517
+    steps = []
+    for _ in range(len(MTU_FALLBACK) + 1):
+        connection._reduce_mtu()
+        steps.append(connection.mtu)
+
+    assert steps == [*MTU_FALLBACK, DEFAULT_MTU]
+    assert connection.max_mtu == DEFAULT_MTU
+
+    # values between the steps go to the next lower one
+    connection.mtu = 100
+    connection._reduce_mtu()
+    assert connection.mtu == connection.max_mtu == 64
+
+
+class MtuClient(SimulatedBleakClient):
+    def __init__(self, device, mtu_size):
+        super().__init__(device)
+        self._mtu_size = mtu_size
+
+    @property
+    def mtu_size(self):
+        if self._mtu_size is None:
+            raise NotImplementedError
+        return self._mtu_size
+
+
+@pytest.mark.parametrize(
+    "mtu_size, max_mtu, expected",
+    [(247, None, 247), (247, 128, 128), (64, 128, 64), (5, None, 23), (None, None, 23)],
+)
+def test_negotiated_mtu(mtu_size, max_mtu, expected):
+    device = SimulatedDevice()
+    connection = connect(device, client=MtuClient(device, mtu_size))
+    connection.max_mtu = max_mtu
+
+    asyncio.run(connection._ensure_connection())
+    assert connection.mtu == expected
+
+
+def test_lowered_mtu_survives_reconnects():
+    device = SimulatedDevice(mtu=64, buffer_size=256)
+    connection = connect(device, client=MtuClient(device, 247))
+
+    async def main():
+        await connection._init()
+        await connection.send_data(SendDataCommand(bytes(1000)))
+        mtu = connection.mtu
+        await connection.connection.disconnect()
+        await connection.send_data(SendDataCommand(bytes(1000)))
+        return mtu
+
+    assert asyncio.run(main()) == 64
+    assert connection.mtu == 64
+    assert connection.metrics.last.pauses == 0
+    assert device.received == [bytes(1000)] * 2
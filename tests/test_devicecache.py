@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import spotled.gattlib as gattlib_backend
+from spotled import LedConnection, TransferTimeouts
+from spotled.bleak.devicecache import DeviceCache
+from spotled.simulator import (
+    SimulatedBleakClient,
+    SimulatedDevice,
+    SimulatedGATTRequester,
+)
+
+ADDRESS = "5e:00:00:00:00:01"
+
+
+def touch_later(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def counted_reads(monkeypatch):
+    reads = []
+    real_load = json.load
+
+    def load(fh):
+        reads.append(fh.name)
+        return real_load(fh)
+
+    monkeypatch.setattr(json, "load", load)
+    return reads
+
+
+def test_device_cache_round_trips(tmp_path):
+    path = str(tmp_path / "spotled" / "devices.json")
+    cache = DeviceCache(path)
+    assert cache.get(ADDRESS) == {}
+
+    cache.update(ADDRESS, cmd_handle=15, firmware=(1, 2, 3))
+
+    assert DeviceCache(path).get(ADDRESS.upper()) == {
+        "cmd_handle": 15,
+        "firmware": [1, 2, 3],
+    }
+    cache.forget(ADDRESS)
+    assert DeviceCache(path).get(ADDRESS) == {}
+
+
+def test_device_cache_reads_the_file_once(tmp_path, counted_reads):
+    cache = DeviceCache(str(tmp_path / "devices.json"))
+    cache.update(ADDRESS, brightness=50)
+    counted_reads.clear()
+
+    for _ in range(5):
+        assert cache.get(ADDRESS) == {"brightness": 50}
+    assert counted_reads == []
+
+
+def test_device_cache_writes_only_changes(tmp_path):
+    path = tmp_path / "devices.json"
+    cache = DeviceCache(str(path))
+    cache.update(ADDRESS, brightness=50, firmware=(1, 1, 1))
+    stamp = os.stat(path).st_mtime_ns
+    os.utime(path, ns=(0, 0))
+
+    # the same values, tuples included, do not rewrite the file
+    cache.update(ADDRESS, brightness=50, firmware=(1, 1, 1))
+    cache.forget("5E:00:00:00:00:02")
+    assert os.stat(path).st_mtime_ns == 0
+
+    cache.update(ADDRESS, brightness=60)
+    assert os.stat(path).st_mtime_ns >= stamp
+    assert os.listdir(tmp_path) == ["devices.json"]
+
+
+def test_device_cache_sees_changes_of_other_processes(tmp_path):
+    path = tmp_path / "devices.json"
+    cache = DeviceCache(str(path))
+    cache.update(ADDRESS, brightness=50)
+
+    path.write_text(json.dumps({ADDRESS.upper(): {"brightness": 70}}))
+    touch_later(path)
+
+    assert cache.get(ADDRESS) == {"brightness": 70}
+
+
+def test_device_cache_ignores_unreadable_files(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text("[1, 2")
+    assert DeviceCache(str(path)).get(ADDRESS) == {}
+
+    # an unwritable location keeps the values in memory
+    cache = DeviceCache(str(path / "devices.json"))
+    cache.update(ADDRESS, brightness=50)
+    assert cache.get(ADDRESS) == {"brightness": 50}
+
+
+def connect_gattlib(device):
+    connection = gattlib_backend.LedConnection(
+        device.address, requester=SimulatedGATTRequester(device)
+    )
+    connection.disconnect()
+    return connection
+
+
+def test_gattlib_cache_reads_and_writes_only_changes(
+    tmp_path, monkeypatch, counted_reads
+):
+    path = tmp_path / "devices.json"
+    monkeypatch.setenv("SPOTLED_CACHE", str(path))
+    device = SimulatedDevice()
+
+    connect_gattlib(device)
+    first_queries = device.stats["commands"]
+    stamp = os.stat(path).st_mtime_ns
+    counted_reads.clear()
+
+    connection = connect_gattlib(device)
+    # the second connection skipped the queries and left the file alone
+    assert device.stats["commands"] == first_queries
+    assert os.stat(path).st_mtime_ns == stamp
+    assert counted_reads == []
+    assert connection.buffer_size == device.buffer_size
+
+    # the bleak backend reads the same entries
+    assert DeviceCache(str(path)).get(device.address)["capabilities"]["width"] == 48
+
+
+def test_gattlib_cache_sees_changes_of_other_processes(tmp_path, monkeypatch):
+    path = tmp_path / "devices.json"
+    monkeypatch.setenv("SPOTLED_CACHE", str(path))
+    device = SimulatedDevice()
+    connect_gattlib(device)
+
+    DeviceCache(str(path)).forget(device.address)
+    touch_later(path)
+    commands = device.stats["commands"]
+    connect_gattlib(device)
+
+    # the entry was gone, so the device was queried again
+    assert device.stats["commands"] > commands
+
+
+def open_connection(device, cache):
+    """
+    Connects to device, waits for the background revalidation and returns
+    the connection and the number of commands the device received.
+    """
+
+    async def main():
+        commands = device.stats["commands"]
+        connection = LedConnection(
+            device.address,
+            timeouts=TransferTimeouts.coerce(0.05),
+            cache=cache,
+            client=SimulatedBleakClient(device),
+        )
+        await connection._init()
+        capabilities = (connection.width, connection.buffer_size)
+        if connection.revalidation is not None:
+            await connection.revalidation
+        await connection.disconnect()
+        return connection, capabilities, device.stats["commands"] - commands
+
+    return asyncio.run(main())
+
+
+def test_cached_capabilities_are_used_right_away(tmp_path):
+    cache = DeviceCache(str(tmp_path / "devices.json"))
+    device = SimulatedDevice(buffer_size=256)
+    first, _, first_commands = open_connection(device, cache)
+    assert first.revalidation is None
+
+    connection, capabilities, commands = open_connection(device, cache)
+
+    assert capabilities == (48, 256)
+    # enabling notifications and the version query
+    assert commands == 2 < first_commands
+    assert cache.get(device.address)["capabilities"]["firmware"] == [1, 1, 1]
+
+
+def test_changed_firmware_updates_capabilities(tmp_path):
+    cache = DeviceCache(str(tmp_path / "devices.json"))
+    device = SimulatedDevice()
+    open_connection(device, cache)
+
+    device.firmware = (1, 2, 0)
+    device.width = 96
+    connection, capabilities, _ = open_connection(device, cache)
+
+    # the cached values are used until the revalidation finishes
+    assert capabilities[0] == 48
+    assert connection.width == 96
+    assert connection.firmware == (1, 2, 0)
+    cached = cache.get(device.address)["capabilities"]
+    assert (cached["firmware"], cached["width"]) == ([1, 2, 0], 96)
+
+
+def test_failed_revalidation_keeps_cached_capabilities(tmp_path, caplog):
+    cache = DeviceCache(str(tmp_path / "devices.json"))
+    device = SimulatedDevice()
+    open_connection(device, cache)
+
+    device.notification_loss = 1.0
+    device.width = 96
+    connection, _, _ = open_connection(device, cache)
+
+    assert connection.width == 48
+    assert cache.get(device.address)["capabilities"]["width"] == 48
+    assert "Could not revalidate" in caplog.text
@@ -0,0 +1,137 @@
+import asyncio
+import struct
+import time
+
+import spotled.gattlib as gattlib_backend
+from spotled import (
+    ContinueSendingResponse,
+    GetVersionCommand,
+    LedConnection,
+    PauseSendingResponse,
+    SendingDataResponse,
+    VersionResponse,
+)
+from spotled.bleak.dispatch import (
+    FLOW_CONTROL_RESPONSES,
+    ResponseDispatcher,
+    match_response,
+)
+from spotled.simulator import (
+    SimulatedBleakClient,
+    SimulatedDevice,
+    SimulatedGATTRequester,
+)
+
+
+def notification(command_type, content):
+    return bytes((len(content) + 2, command_type)) + content
+
+
+def continue_sending(serial_no, continue_from=128):
+    return notification(255, struct.pack(">HHI", serial_no, 32772, continue_from))
+
+
+def sending_data(serial_no):
+    return notification(2, struct.pack(">HBH", serial_no, 0, 32772))
+
+
+def test_stale_flow_control_is_not_routed_to_the_current_transfer():
+    async def main():
+        dispatcher = ResponseDispatcher()
+        acks = dispatcher.subscribe(match_response(FLOW_CONTROL_RESPONSES, 2))
+
+        # left over from the transfer with serial number 1, which timed out
+        dispatcher.dispatch(continue_sending(1))
+        assert acks.empty()
+        stale = dispatcher.take_unclaimed()
+        assert isinstance(stale, ContinueSendingResponse)
+        assert stale.serial_no == 1
+
+        dispatcher.dispatch(continue_sending(2, 256))
+        response = acks.get_nowait()
+        assert response.serial_no == 2
+        assert response.continue_from == 256
+        assert dispatcher.take_unclaimed() is None
+
+    asyncio.run(main())
+
+
+def test_late_reply_does_not_resolve_newer_request():
+    async def main():
+        dispatcher = ResponseDispatcher()
+        started = dispatcher.expect(match_response(SendingDataResponse, 2))
+        dispatcher.dispatch(sending_data(1))
+        assert not started.done()
+
+        dispatcher.dispatch(sending_data(2))
+        assert started.result().serial_no == 2
+
+    asyncio.run(main())
+
+
+def test_waiters_take_precedence_over_subscribers():
+    async def main():
+        dispatcher = ResponseDispatcher()
+        acks = dispatcher.subscribe(match_response(FLOW_CONTROL_RESPONSES))
+        timed_out = dispatcher.expect(match_response())
+        first = dispatcher.expect(match_response())
+        second = dispatcher.expect(match_response())
+        timed_out.cancel()
+
+        dispatcher.dispatch(continue_sending(1))
+        assert isinstance(first.result(), ContinueSendingResponse)
+        assert not second.done()
+        assert acks.empty()
+
+        dispatcher.dispatch(continue_sending(1))
+        dispatcher.dispatch(notification(254, struct.pack(">HHBB", 1, 32772, 0, 40)))
+        assert isinstance(second.result(), ContinueSendingResponse)
+        assert isinstance(acks.get_nowait(), PauseSendingResponse)
+
+    asyncio.run(main())
+
+
+def test_malformed_notifications_are_dropped():
+    async def main():
+        dispatcher = ResponseDispatcher()
+        waiter = dispatcher.expect(match_response())
+        dispatcher.dispatch(b"\x05\xff\x00")
+        assert not waiter.done()
+        assert dispatcher.take_unclaimed() is None
+
+    asyncio.run(main())
+
+
+def test_wait_for_response_returns_reply_that_arrived_first():
+    async def main():
+        device = SimulatedDevice()
+        connection = LedConnection(
+            device.address, cache=None, client=SimulatedBleakClient(device)
+        )
+        await connection._init()
+        try:
+            # a stale reply must not be mistaken for the next one
+            connection.dispatcher.dispatch(sending_data(7))
+            await connection.send_command(GetVersionCommand())
+            # the reply is delivered before anybody waits for it
+            await asyncio.sleep(0.01)
+            assert isinstance(await connection.wait_for_response(), VersionResponse)
+        finally:
+            await connection.disconnect()
+
+    asyncio.run(main())
+
+
+def test_gattlib_wait_for_response_returns_reply_that_arrived_first():
+    device = SimulatedDevice()
+    connection = gattlib_backend.LedConnection(
+        device.address, use_cache=False, requester=SimulatedGATTRequester(device)
+    )
+    try:
+        connection.dispatcher.dispatch(b"\x00\x00\x00" + sending_data(7))
+        connection.send_command(gattlib_backend.GetVersionCommand())
+        time.sleep(0.05)
+        response = connection.wait_for_response()
+        assert isinstance(response, gattlib_backend.VersionResponse)
+    finally:
+        connection.disconnect()
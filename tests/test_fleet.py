@@ -0,0 +1,226 @@
+import asyncio
+
+import pytest
+
+from spotled import (
+    BrightnessData,
+    LedConnection,
+    LedFleet,
+    SendDataCommand,
+    TransferError,
+)
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+
+def simulated_connection(device, **options):
+    return LedConnection(
+        device.address, cache=None, client=SimulatedBleakClient(device), **options
+    )
+
+
+def make_devices(count, **kwargs):
+    return [
+        SimulatedDevice(address=f"5E:00:00:00:00:{i:02X}", **kwargs)
+        for i in range(1, count + 1)
+    ]
+
+
+def run_fleet(devices, operation, **fleet_options):
+    """
+    Runs operation(fleet) on a fleet of the simulated devices and returns
+    the fleet and what operation returned.
+    """
+
+    async def main():
+        fleet = LedFleet(connection_factory=simulated_connection, **fleet_options)
+        for device in devices:
+            fleet.add(device)
+        try:
+            return fleet, await operation(fleet)
+        finally:
+            await fleet.disconnect()
+
+    return asyncio.run(main())
+
+
+def test_fleet_reports_every_device():
+    devices = make_devices(3)
+    bad = devices[1].address
+
+    async def operation(connection):
+        if connection.connection.address == bad:
+            raise TransferError("unreachable")
+        return connection.width
+
+    async def run(fleet):
+        results = await fleet.run(operation)
+        return results, list(fleet.connections)
+
+    fleet, (results, connected) = run_fleet(devices, run)
+
+    assert [r.address for r in results] == [d.address for d in devices]
+    assert [r.ok for r in results] == [True, False, True]
+    assert results[0].result == 48
+    assert isinstance(results[1].error, TransferError)
+    assert all(r.latency >= 0 for r in results)
+    # the failed device is reconnected from scratch next time
+    assert bad not in connected
+    assert len(connected) == 2
+
+
+def test_fleet_keeps_connections_after_content_errors():
+    devices = make_devices(2)
+
+    async def operation(connection):
+        raise ValueError("too many frames")
+
+    async def run(fleet):
+        results = await fleet.run(operation)
+        return results, len(fleet.connections)
+
+    _, (results, connected) = run_fleet(devices, run)
+    assert not any(r.ok for r in results)
+    assert connected == 2
+
+
+def test_fleet_limits_concurrency():
+    devices = make_devices(6)
+    running = []
+    most = []
+
+    async def operation(connection):
+        running.append(connection)
+        most.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(connection)
+
+    run_fleet(devices, lambda fleet: fleet.run(operation), max_concurrency=2)
+    assert max(most) == 2
+
+
+def test_fleet_evicts_least_recently_used_connections():
+    devices = make_devices(3)
+    addresses = [d.address for d in devices]
+
+    async def run(fleet):
+        await fleet.connect(addresses[:2])
+        # using the first device again makes the second the least recently used
+        await fleet.set_brightness(20, addresses[:1])
+        second = fleet.connections[addresses[1]]
+        await fleet.set_brightness(30, addresses[2:])
+        return second.connection.is_connected, list(fleet.connections)
+
+    fleet, (second_connected, connected) = run_fleet(
+        devices, run, max_concurrency=1, max_connections=2
+    )
+
+    assert connected == [addresses[0], addresses[2]]
+    assert not second_connected
+    assert [d.brightness for d in devices] == [20, 50, 30]
+    # metrics survive the connection
+    assert fleet.metrics[addresses[2]].last.ok
+
+
+def test_fleet_needs_a_connection_per_concurrent_operation():
+    with pytest.raises(ValueError):
+        LedFleet(max_concurrency=4, max_connections=2)
+
+
+class CountingClient(SimulatedBleakClient):
+    connects = 0
+
+    async def connect(self):
+        CountingClient.connects += 1
+        await super().connect()
+
+
+def test_fleet_connects_each_device_once(monkeypatch):
+    devices = make_devices(2, connect_latency=0.01)
+    monkeypatch.setattr(CountingClient, "connects", 0)
+
+    def counting_connection(device, **options):
+        return LedConnection(
+            device.address, cache=None, client=CountingClient(device), **options
+        )
+
+    async def run(fleet):
+        # both operations wait for the same connection attempt
+        await asyncio.gather(
+            fleet.set_brightness(10),
+            fleet.send_data(SendDataCommand(BrightnessData(10))),
+        )
+
+    async def main():
+        fleet = LedFleet(connection_factory=counting_connection)
+        for device in devices:
+            fleet.add(device)
+        await run(fleet)
+        await fleet.disconnect()
+
+    asyncio.run(main())
+    assert CountingClient.connects == 2
+    assert [d.brightness for d in devices] == [10, 10]
+
+
+def test_broadcast_renders_once_per_display():
+    devices = make_devices(3)
+    devices[2].width = 96
+    renders = []
+
+    def render(connection):
+        renders.append(connection.width)
+        return bytes([connection.width]) * 10
+
+    fleet, results = run_fleet(devices, lambda fleet: fleet.broadcast(render))
+
+    assert all(r.ok for r in results)
+    assert sorted(renders) == [48, 96]
+    assert [d.received for d in devices] == [
+        [bytes([48]) * 10],
+        [bytes([48]) * 10],
+        [bytes([96]) * 10],
+    ]
+
+
+def test_broadcast_text_lines_matches_set_text_lines():
+    devices = make_devices(2)
+    devices[1].width, devices[1].height = 96, 16
+    text = "The quick brown fox jumps over the lazy dog"
+
+    async def run(fleet):
+        await fleet.set_text_lines(text, font="5x8", line_height=8)
+        await fleet.broadcast_text_lines(text, font="5x8", line_height=8)
+
+    run_fleet(devices, run)
+    for device in devices:
+        assert len(device.received) == 2
+        assert device.received[0] == device.received[1]
+
+
+def test_broadcast_render_errors_are_shared_per_display():
+    devices = make_devices(3)
+    devices[0].frame_limit = 1
+    renders = []
+
+    def render(connection):
+        renders.append(connection)
+        raise ValueError("cannot render")
+
+    async def run(fleet):
+        text_results = await fleet.broadcast_text_lines(
+            "many lines of text " * 20, font="4x6"
+        )
+        raw_results = await fleet.broadcast(render)
+        return text_results, raw_results, len(fleet.connections)
+
+    _, (text_results, raw_results, connected) = run_fleet(devices, run)
+
+    # the first device cannot show that many frames, the others can
+    assert [r.ok for r in text_results] == [False, True, True]
+    assert isinstance(text_results[0].error, ValueError)
+    # all devices share a display, so render ran once and its error is reused
+    assert len(renders) == 1
+    assert len({id(r.error) for r in raw_results}) == 1
+    assert isinstance(raw_results[0].error, ValueError)
+    # content errors keep the connections
+    assert connected == 3
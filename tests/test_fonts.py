@@ -0,0 +1,313 @@
+import os
+import threading
+
+import pytest
+
+from spotled.bleak import fontops
+from spotled.bleak.fontops import (
+    Font,
+    FontRegistry,
+    GlyphCache,
+    LazyYaffFont,
+    find_and_load_font,
+    find_char_in_font,
+    glyph_cache,
+    pack_glyph,
+    parse_font,
+    parse_yaff_font,
+)
+from spotled.bleak.fontpack import PackedFont, compile_font, write_packed_font
+
+DRAW_FONT = """\
+41: -#-
+    #-#
+    ###
+42: ##-
+    ###
+    ##-
+"""
+
+
+def write_font(path, content=DRAW_FONT):
+    path.write_text(content)
+    return str(path)
+
+
+def touch_later(path):
+    # a new modification time, however coarse the file system clock is
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_registry_returns_cached_font(tmp_path):
+    registry = FontRegistry()
+    path = write_font(tmp_path / "a.draw")
+
+    font = registry.load(path)
+    assert isinstance(font, Font)
+    assert font["A"] == (".1.", "1.1", "111")
+    assert registry.load(path) is font
+    assert path in registry
+    assert len(registry) == 1
+
+
+def test_registry_reloads_changed_font(tmp_path):
+    registry = FontRegistry()
+    path = write_font(tmp_path / "a.draw")
+    font = registry.load(path)
+
+    write_font(tmp_path / "a.draw", DRAW_FONT.replace("#-#", "###"))
+    touch_later(path)
+    reloaded = registry.load(path)
+
+    assert reloaded is not font
+    assert reloaded["A"] == (".1.", "111", "111")
+    # the stale version is dropped, not kept next to the new one
+    assert len(registry) == 1
+    assert registry.memory_size == reloaded.memory_size
+
+
+def test_registry_evicts_least_recently_used(tmp_path):
+    paths = [write_font(tmp_path / f"{name}.draw") for name in "abc"]
+    size = FontRegistry().load(paths[0]).memory_size
+    registry = FontRegistry(max_bytes=2 * size)
+
+    first = registry.load(paths[0])
+    registry.load(paths[1])
+    # using the first font again makes the second the least recently used
+    assert registry.load(paths[0]) is first
+    registry.load(paths[2])
+
+    assert paths[0] in registry
+    assert paths[1] not in registry
+    assert paths[2] in registry
+    assert registry.memory_size == 2 * size
+
+
+def test_registry_keeps_a_font_larger_than_its_budget(tmp_path):
+    registry = FontRegistry(max_bytes=1)
+    paths = [write_font(tmp_path / f"{name}.draw") for name in "ab"]
+
+    registry.load(paths[0])
+    font = registry.load(paths[1])
+
+    assert len(registry) == 1
+    assert registry.load(paths[1]) is font
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    fontops.font_registry.clear()
+    glyph_cache.clear()
+    yield tmp_path / "cache"
+    fontops.font_registry.clear()
+    glyph_cache.clear()
+
+
+def test_packed_font_round_trips(tmp_path):
+    source = parse_font(
+        os.path.join(os.path.dirname(fontops.__file__), "../fonts/5x7.yaff")
+    )
+    path = str(tmp_path / "5x7.spf")
+    write_packed_font(source, path)
+
+    font = PackedFont(path)
+    assert len(font) == len(source)
+    assert set(font) == set(source)
+    for char, glyph in source.items():
+        assert font[char] == tuple(glyph)
+        width, height, _ = font.glyph_bitmap(char)
+        assert (width, height) == (len(glyph[0]) if glyph else 0, len(glyph))
+    with pytest.raises(KeyError):
+        font.glyph_bitmap("\uffff")
+
+
+def test_packed_font_glyphs_match_parsed_font(tmp_path):
+    with_space = DRAW_FONT + "20: ---\n    ---\n"
+    path = compile_font(
+        write_font(tmp_path / "a.draw", with_space), str(tmp_path / "a.spf")
+    )
+    font = PackedFont(path)
+    # C is missing and falls back to the space
+    for char in ("A", "B", " ", "C"):
+        for min_height, min_width in ((0, 0), (6, 0), (5, 7)):
+            assert fontops._pack_char(font, char, min_height, min_width) == pack_glyph(
+                find_char_in_font(char, font), min_height, min_width
+            )
+
+
+def test_glyph_cache_reads_packed_bitmaps(tmp_path, monkeypatch):
+    path = compile_font(write_font(tmp_path / "a.draw"), str(tmp_path / "a.spf"))
+    font = FontRegistry().load(path)
+    expected = pack_glyph(font["A"], 6)
+
+    def no_rows(self, char):
+        raise AssertionError("glyph decoded to rows")
+
+    monkeypatch.setattr(PackedFont, "__getitem__", no_rows)
+    glyph_cache.clear()
+    assert glyph_cache.get(font, "A", 6) == expected
+
+
+def test_bundled_fonts_compile_into_the_user_cache(cache_home):
+    fonts_dir = os.path.join(os.path.dirname(fontops.__file__), "../fonts")
+    before = set(os.listdir(fonts_dir))
+
+    font = find_and_load_font("5x7")
+
+    assert isinstance(font, PackedFont)
+    assert font.cache_key[0].startswith(str(cache_home / "spotled" / "fonts"))
+    assert set(os.listdir(fonts_dir)) == before
+
+
+def test_concurrent_loads_compile_a_font_once(cache_home, monkeypatch):
+    compiled = []
+    real_compile = fontops.compile_font
+
+    def counting_compile(fontfile, dest=None):
+        compiled.append(fontfile)
+        return real_compile(fontfile, dest)
+
+    monkeypatch.setattr(fontops, "compile_font", counting_compile)
+    fonts = []
+    threads = [
+        threading.Thread(target=lambda: fonts.append(find_and_load_font("6x9")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(compiled) == 1
+    assert len(fonts) == 8
+    assert all(font["A"] == fonts[0]["A"] for font in fonts)
+    # no temporary files left behind
+    assert [
+        name.endswith(".spf") for name in os.listdir(cache_home / "spotled" / "fonts")
+    ] == [True]
+
+
+def test_unwritable_cache_falls_back_to_the_source(cache_home):
+    cache_home.parent.mkdir(exist_ok=True)
+    cache_home.write_text("not a directory")
+
+    font = find_and_load_font("5x7")
+
+    assert not isinstance(font, PackedFont)
+    assert font["A"]
+
+
+YAFF_FONT = """\
+name: test
+
+0x41:
+    .@.
+    @.@
+    @@@
+
+u+0042:
+    @@.
+    @@@
+    @@.
+"""
+
+
+def test_lazy_yaff_font_matches_parsed_font(cache_home, tmp_path):
+    path = write_font(tmp_path / "a.yaff", YAFF_FONT)
+    font = LazyYaffFont(path)
+
+    assert dict(font) == {k: tuple(v) for k, v in parse_yaff_font(path).items()}
+    assert "A" in font and "C" not in font
+    with pytest.raises(KeyError):
+        font["C"]
+
+
+def test_lazy_yaff_font_reuses_its_index(cache_home, tmp_path, monkeypatch):
+    path = write_font(tmp_path / "a.yaff", YAFF_FONT)
+    LazyYaffFont(path)
+    assert os.listdir(cache_home / "spotled" / "fonts") == [
+        os.path.basename(fontops.font_cache_path(path, "idx"))
+    ]
+    # nothing is written next to the font
+    assert sorted(os.listdir(tmp_path)) == ["a.yaff", "cache"]
+
+    def no_scan(self):
+        raise AssertionError("font scanned again")
+
+    monkeypatch.setattr(LazyYaffFont, "_scan", no_scan)
+    assert LazyYaffFont(path)["B"] == ("11.", "111", "11.")
+
+
+def test_lazy_yaff_font_rescans_a_changed_font(cache_home, tmp_path):
+    path = write_font(tmp_path / "a.yaff", YAFF_FONT)
+    LazyYaffFont(path)
+
+    write_font(tmp_path / "a.yaff", YAFF_FONT.replace("u+0042", "u+0043"))
+    touch_later(path)
+    font = LazyYaffFont(path)
+
+    assert "B" not in font
+    assert font["C"] == ("11.", "111", "11.")
+
+
+def test_lazy_yaff_font_without_a_writable_cache(cache_home, tmp_path):
+    cache_home.write_text("not a directory")
+    path = write_font(tmp_path / "a.yaff", YAFF_FONT)
+
+    assert LazyYaffFont(path)["A"] == (".1.", "1.1", "111")
+    assert sorted(os.listdir(tmp_path)) == ["a.yaff", "cache"]
+
+
+def test_glyph_cache_counts_hits_and_misses(tmp_path):
+    font = FontRegistry().load(write_font(tmp_path / "a.draw"))
+    cache = GlyphCache()
+
+    first = cache.get(font, "A", 6)
+    assert cache.get(font, "A", 6) is first
+    cache.get(font, "A", 7)
+    cache.get(font, "B", 6)
+
+    assert cache.stats() == {"hits": 1, "misses": 3, "entries": 3, "max_entries": 4096}
+    assert first == pack_glyph(font["A"], 6)
+
+
+def test_glyph_cache_evicts_least_recently_used(tmp_path):
+    font = FontRegistry().load(write_font(tmp_path / "a.draw"))
+    cache = GlyphCache(max_entries=2)
+
+    a = cache.get(font, "A")
+    cache.get(font, "B")
+    cache.get(font, "A")
+    cache.get(font, "A", 6)
+
+    # B was the least recently used
+    assert cache.get(font, "A") is a
+    assert cache.stats()["entries"] == 2
+    cache.get(font, "B")
+    assert cache.misses == 4
+
+
+def test_glyph_cache_batches_lookups(tmp_path):
+    font = FontRegistry().load(write_font(tmp_path / "a.draw"))
+    cache = GlyphCache()
+    a = cache.get(font, "A", 6)
+
+    glyphs = cache.get_many(font, "AB", 6)
+
+    assert glyphs["A"] is a
+    assert glyphs["B"] == pack_glyph(font["B"], 6)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.get(font, "B", 6) is glyphs["B"]
+
+
+def test_glyph_cache_skips_fonts_without_a_cache_key():
+    cache = GlyphCache()
+    font = {"A": (".1", "1.")}
+
+    assert cache.get(font, "A") == pack_glyph(font["A"])
+    assert cache.get_many(font, "A") == {"A": pack_glyph(font["A"])}
+    assert cache.stats()["entries"] == 0
+    cache.clear()
+    assert (cache.hits, cache.misses) == (0, 0)
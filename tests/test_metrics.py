@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+from spotled import BrightnessData, LedConnection, SendDataCommand
+from spotled.bleak.metrics import (
+    TRANSFER_PHASES,
+    Histogram,
+    TransferMetrics,
+    TransferRecord,
+    prometheus_text,
+)
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+
+def record(pauses=0, attempts=1, error=None, bytes_sent=100):
+    transfer = TransferRecord("5E:00:00:00:00:01", 32772, bytes_sent)
+    transfer.attempts = attempts
+    transfer.pauses = pauses
+    transfer.bytes_sent = bytes_sent
+    transfer.finish(error)
+    return transfer
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+    assert histogram.sum == 2.65
+
+
+def test_metrics_aggregate_transfers():
+    metrics = TransferMetrics()
+    seen = []
+    metrics.listeners.append(seen.append)
+
+    metrics.record(record(pauses=2, attempts=3))
+    metrics.record(record(error=TimeoutError(), bytes_sent=50))
+
+    counters = metrics.counters
+    assert (counters["transfers"], counters["failed_transfers"]) == (1, 1)
+    assert counters["bytes_sent"] == 150
+    assert (counters["pauses"], counters["retries"]) == (2, 2)
+    assert metrics.histograms["duration"].count == 2
+    assert len(seen) == 2 and metrics.last is seen[1]
+    # the snapshot is plain JSON
+    assert json.loads(json.dumps(metrics.snapshot()))["counters"] == counters
+
+    metrics.reset()
+    assert metrics.counters["transfers"] == 0 and metrics.last is None
+
+
+def test_failing_listener_does_not_break_recording(caplog):
+    metrics = TransferMetrics()
+
+    def listener(transfer):
+        raise RuntimeError("broken")
+
+    metrics.listeners.append(listener)
+    metrics.record(record())
+
+    assert metrics.counters["transfers"] == 1
+    assert "listener failed" in caplog.text
+
+
+def test_connection_records_phases():
+    device = SimulatedDevice(notify_latency=0.001)
+
+    async def main():
+        connection = LedConnection(
+            device.address, cache=None, client=SimulatedBleakClient(device)
+        )
+        await connection._init()
+        await connection.send_data(SendDataCommand(bytes(1000)))
+        await connection.send_data(SendDataCommand(BrightnessData(10)))
+        await connection.disconnect()
+        return connection.metrics
+
+    metrics = asyncio.run(main())
+    assert metrics.counters["transfers"] == 2
+    assert metrics.counters["bytes_sent"] == device.stats["data_bytes"]
+    assert metrics.counters["continues"] == device.stats["continues"]
+    assert all(metrics.histograms[phase].count == 2 for phase in TRANSFER_PHASES)
+    assert metrics.histograms["stalls"].sum > 0
+
+
+def parse_prometheus(text):
+    families = {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name not in families, f"{name} declared twice"
+            families[name] = kind
+        else:
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return families, samples
+
+
+def test_prometheus_text_declares_each_family_once():
+    first, second = TransferMetrics(), TransferMetrics()
+    first.record(record(pauses=1))
+    second.record(record(error=TimeoutError()))
+    second.record(record())
+
+    families, samples = parse_prometheus(
+        prometheus_text(
+            [({"address": "a"}, first), ({"address": 'b"\\'}, second)], "led"
+        )
+    )
+
+    assert families["led_transfers_total"] == "counter"
+    assert families["led_transfer_duration_seconds"] == "histogram"
+    assert samples['led_transfers_total{address="a"}'] == 1
+    assert samples['led_transfers_total{address="b\\"\\\\"}'] == 1
+    assert samples['led_failed_transfers_total{address="b\\"\\\\"}'] == 1
+    assert samples['led_pauses_total{address="a"}'] == 1
+    assert samples['led_transfer_duration_seconds_bucket{address="a",le="+Inf"}'] == 1
+    assert samples['led_transfer_writes_seconds_count{address="b\\"\\\\"}'] == 2
+
+
+def test_prometheus_text_without_labels():
+    metrics = TransferMetrics(buckets=(1.0,))
+    metrics.record(record())
+
+    families, samples = parse_prometheus(metrics.to_prometheus())
+    assert samples["spotled_transfers_total"] == 1
+    assert samples['spotled_transfer_duration_seconds_bucket{le="1.0"}'] == 1
+    assert len(families) == len(TransferMetrics.COUNTERS) + 1 + len(TRANSFER_PHASES)
@@ -0,0 +1,190 @@
+import random
+
+import spotled.gattlib as reference
+from spotled import (
+    AnimationData,
+    BrightnessData,
+    ColorData,
+    Effect,
+    FontData,
+    FrameData,
+    NumberBarData,
+    ScreenModeData,
+    SendDataCommand,
+    SendingDataFinishCommand,
+    SendingDataStartCommand,
+    TextData,
+    create_font_characters,
+    find_and_load_font,
+)
+from spotled.bleak.models.byte import ByteReader, ByteWriter
+
+
+def test_byte_writer_grows_past_its_preallocated_size():
+    d = ByteWriter(3)
+    d.write_byte(1)
+    d.write_int(0x02030405)
+    d.write_bytes(bytes(range(6, 40)))
+    d.write_short(0x2829)
+
+    expected = bytes(range(1, 42))
+    assert d.to_bytes() == expected
+    assert bytes(d.getbuffer()) == expected
+    assert len(d.content) >= len(expected)
+
+
+def test_byte_writer_leaves_unused_space_out():
+    d = ByteWriter(16)
+    d.write_shorts([1, 0x10203])
+    assert d.to_bytes() == b"\x00\x01\x02\x03"
+
+
+def write_random(rng, writers, count):
+    for _ in range(count):
+        kind = rng.randrange(4)
+        value = rng.getrandbits(32)
+        for d in writers:
+            if kind == 0:
+                d.write_byte(value)
+            elif kind == 1:
+                d.write_short(value)
+            elif kind == 2:
+                d.write_int(value)
+            else:
+                d.write_bytes(value.to_bytes(4, "big") * (value % 5))
+
+
+def test_running_checksum_matches_rescanning_checksum():
+    rng = random.Random(9)
+    for _ in range(50):
+        d, expected = ByteWriter(rng.randrange(64)), reference.ByteWriter()
+        write_random(rng, (d, expected), rng.randrange(40))
+        d.write_checksum()
+        expected.write_checksum()
+        assert d.to_bytes() == expected.to_bytes()
+
+
+def test_nested_checksums_restart_the_sum():
+    rng = random.Random(10)
+    d, expected = ByteWriter(), reference.ByteWriter()
+    for writer in (d, expected):
+        writer.write_int(0xFFFFFFFF)
+    # the checksums cover what follows the last start_checksum, including
+    # earlier checksum bytes
+    for _ in range(5):
+        for writer in (d, expected):
+            writer.start_checksum()
+        write_random(rng, (d, expected), 10)
+        for writer in (d, expected):
+            writer.write_checksum()
+        write_random(rng, (d, expected), 3)
+        for writer in (d, expected):
+            writer.write_checksum()
+    assert d.to_bytes() == expected.to_bytes()
+
+
+def test_checksum_of_nothing_is_zero():
+    d = ByteWriter()
+    d.write_bytes(b"\xff\xff")
+    d.start_checksum()
+    d.write_checksum()
+    assert d.to_bytes() == b"\xff\xff\x00"
+
+
+def test_integers_are_truncated_like_the_string_pipeline():
+    values = [0, 1, 255, 256, 0xFFFF, 0x10000, 0xFFFFFFFF, 0x123456789, -1, -300]
+    d, expected = ByteWriter(), reference.ByteWriter()
+    for value in values:
+        for writer in (d, expected):
+            writer.write_byte(value)
+            writer.write_short(value)
+            writer.write_int(value)
+    d.write_shorts(values)
+    for value in values:
+        expected.write_short(value)
+    assert d.to_bytes() == expected.to_bytes()
+
+
+def test_byte_reader_reads_what_was_written():
+    d = ByteWriter()
+    d.write_byte(7)
+    d.write_short(0xBEEF)
+    d.write_int(0xDEADBEEF)
+    d.write_bytes(b"tail")
+    data = d.to_bytes()
+
+    for content in (data, bytearray(data), memoryview(data)):
+        r = ByteReader(content)
+        assert r.read_byte() == 7
+        assert r.read_short() == 0xBEEF
+        assert r.read_int() == 0xDEADBEEF
+        assert bytes(r.read_bytes(4)) == b"tail"
+        assert r.current_pos == len(data)
+
+
+def test_font_and_text_data_match_string_pipeline():
+    text = "Hello, Wörld! 123"
+    colors = [ColorData(i * 10, 255 - i, i) for i in range(len(text))]
+    font_characters = create_font_characters(text, find_and_load_font("6x12"), 16)
+    reference_characters = reference.create_font_characters(
+        text, reference.find_and_load_font("6x12"), 16
+    )
+
+    cases = [
+        (
+            FontData(font_characters),
+            reference.FontData(reference_characters),
+        ),
+        (
+            TextData(text, 30, Effect.SCROLL_LEFT),
+            reference.TextData(text, 30, reference.Effect.SCROLL_LEFT),
+        ),
+        (
+            TextData(text, 0, Effect.NONE, colors),
+            reference.TextData(
+                text,
+                0,
+                reference.Effect.NONE,
+                [reference.ColorData(i * 10, 255 - i, i) for i in range(len(text))],
+            ),
+        ),
+        (NumberBarData(list(range(16))), reference.NumberBarData(list(range(16)))),
+        (BrightnessData(73), reference.BrightnessData(73)),
+        (ScreenModeData(2), reference.ScreenModeData(2)),
+        (
+            AnimationData(
+                [FrameData(48, 12, bytes(range(72)), depth=1)], 0, 0, Effect.NONE
+            ),
+            reference.AnimationData(
+                [reference.FrameData(48, 12, bytes(range(72)))],
+                0,
+                0,
+                reference.Effect.NONE,
+            ),
+        ),
+    ]
+    for data, expected in cases:
+        expected = expected.serialize()
+        assert data.serialize() == expected
+        assert bytes(data.serialize_view()) == expected
+        # the preallocated buffer is sized exactly
+        assert data.serialized_size() == len(expected)
+        command = SendDataCommand(data)
+        command.serial_no = 0x01020304
+        command.command_type = 32773
+        reference_command = reference.SendDataCommand(expected)
+        reference_command.serial_no = 0x01020304
+        reference_command.command_type = 32773
+        assert command.serialize() == reference_command.serialize()
+
+
+def test_control_commands_match_string_pipeline():
+    for command, expected in [
+        (SendingDataStartCommand, reference.SendingDataStartCommand),
+        (SendingDataFinishCommand, reference.SendingDataFinishCommand),
+    ]:
+        for serial_no, length in [(1, 0), (0xFFFF, 0x01020304), (513, 4096)]:
+            assert (
+                command(serial_no, 32772, length).serialize()
+                == expected(serial_no, 32772, length).serialize()
+            )
@@ -0,0 +1,161 @@
+import random
+import string
+
+import pytest
+
+# the gattlib backend still builds everything from "." and "1" strings
+# with ByteWriter, the reference the packed pipeline has to match
+import spotled.gattlib as reference
+from spotled import (
+    Align,
+    Effect,
+    SendDataCommand,
+    find_and_load_font,
+    gen_bitmap,
+    gen_color_bitmap,
+    lines_to_frames,
+    reflow_text,
+    render_frames,
+    render_line,
+    text_lines_animation,
+)
+from spotled.bleak import graphics
+
+# font, line height, display width and height
+GEOMETRIES = [
+    ("4x6", 6, 48, 12),
+    ("5x7", 7, 48, 14),
+    ("5x8", 8, 96, 16),
+    ("6x9", 9, 40, 9),
+    ("6x10", 10, 64, 20),
+    ("6x12", 12, 48, 12),
+]
+
+CHARACTERS = string.ascii_letters + string.digits + string.punctuation + "  é☃"
+
+
+def random_text(rng, length):
+    return "".join(rng.choice(CHARACTERS) for _ in range(length))
+
+
+def reference_font(font):
+    # the reference pads glyphs in place, so it gets a font of its own
+    return reference.find_and_load_font(font)
+
+
+@pytest.mark.parametrize("font, line_height, width, height", GEOMETRIES)
+@pytest.mark.parametrize("align", list(Align))
+def test_render_frames_matches_string_pipeline(font, line_height, width, height, align):
+    rng = random.Random(f"{font} {align}")
+    font_data = find_and_load_font(font)
+    reference_font_data = reference_font(font)
+    lines_per_frame = height // line_height
+    for length in (0, 1, 7, 40, 200):
+        text = random_text(rng, length)
+        # reflowed text, and lines too wide for the display that overflow
+        for lines in (reflow_text(text, font_data, width), text.split(" ")):
+            frames = render_frames(
+                lines, font_data, align, width, lines_per_frame, line_height
+            )
+            text_frames = lines_to_frames(
+                lines, font_data, align, width, lines_per_frame, line_height
+            )
+            expected = reference.lines_to_frames(
+                lines,
+                reference_font_data,
+                reference.Align[align.name],
+                width,
+                lines_per_frame,
+                line_height,
+            )
+            assert text_frames == expected
+            assert [bytes(frame) for frame in frames] == [
+                reference.gen_bitmap(*frame) for frame in expected
+            ]
+
+
+@pytest.mark.parametrize("font, line_height, width, height", GEOMETRIES)
+def test_text_lines_animation_matches_string_pipeline(font, line_height, width, height):
+    text = random_text(random.Random(font), 120)
+    animation = text_lines_animation(
+        text,
+        width,
+        height,
+        align=Align.LEFT,
+        font=font,
+        frame_duration=1.5,
+        line_height=line_height,
+        effect=Effect.SCROLL_UP,
+        speed=40,
+    )
+
+    reference_font_data = reference_font(font)
+    lines = reference.reflow_text(text, reference_font_data, width)
+    frames = reference.lines_to_frames(
+        lines,
+        reference_font_data,
+        reference.Align.LEFT,
+        width,
+        height // line_height,
+        line_height,
+    )
+    expected = reference.AnimationData(
+        [
+            reference.FrameData(width, height, reference.gen_bitmap(*frame))
+            for frame in frames
+        ],
+        1500,
+        40,
+        reference.Effect.SCROLL_UP,
+    ).serialize()
+
+    assert animation.serialize() == expected
+    assert bytes(animation.serialize_view()) == expected
+    command = SendDataCommand(animation)
+    assert command.serialize() == reference.SendDataCommand(expected).serialize()
+
+
+def test_render_line_matches_gen_bitmap():
+    font_data = find_and_load_font("5x7")
+    for line in ("A", "Hello, world"):
+        frame = render_line(line, font_data, 9)
+        rows = lines_to_frames([line], font_data, Align.LEFT, frame.width, 1, 9)[0]
+        assert frame.width == 5 * len(line)
+        assert frame.height == 9
+        assert bytes(frame) == reference.gen_bitmap(*rows)
+    assert render_line("", font_data, 9).width == 0
+
+
+def test_render_frames_rejects_glyphs_taller_than_the_line():
+    with pytest.raises(ValueError):
+        render_frames(["Hi"], find_and_load_font("6x12"), line_height=6)
+
+
+def random_rows(rng, width, height, characters):
+    return [
+        "".join(rng.choice(characters) for _ in range(width)) for _ in range(height)
+    ]
+
+
+@pytest.mark.parametrize("width, height", [(48, 12), (45, 12), (128, 32), (3, 2)])
+@pytest.mark.parametrize("true_char", ["1", ".", "x"])
+def test_gen_bitmap_matches_string_pipeline(monkeypatch, width, height, true_char):
+    rng = random.Random(f"{width}x{height} {true_char}")
+    rows = random_rows(rng, width, height, ".1x")
+    for min_len in (0, 5, 64):
+        expected = reference.gen_bitmap(*rows, min_len=min_len, true_char=true_char)
+        assert gen_bitmap(*rows, min_len=min_len, true_char=true_char) == expected
+        monkeypatch.setattr(graphics, "numpy", None)
+        assert gen_bitmap(*rows, min_len=min_len, true_char=true_char) == expected
+        monkeypatch.undo()
+
+
+@pytest.mark.parametrize("width, height", [(48, 12), (128, 32), (3, 2)])
+def test_gen_color_bitmap_matches_string_pipeline(monkeypatch, width, height):
+    rng = random.Random(width * height)
+    color_map = {".": (0, 0, 0), "1": (255, 0, 16), "r": (1, 2, 3, 4)}
+    rows = random_rows(rng, width, height, ".1r")
+    expected = reference.gen_color_bitmap(*rows, color_map=color_map)
+    assert gen_color_bitmap(*rows, color_map=color_map) == expected
+    monkeypatch.setattr(graphics, "numpy", None)
+    assert gen_color_bitmap(*rows, color_map=color_map) == expected
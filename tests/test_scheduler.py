@@ -0,0 +1,124 @@
+import asyncio
+
+from spotled import BrightnessData, LedConnection, SendDataCommand, UpdateScheduler
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+
+def payload(i):
+    # several windows long, so a transfer is still running when the next update comes
+    return bytes([i]) * 400
+
+
+def slow_device():
+    return SimulatedDevice(write_latency=0.001)
+
+
+def run_scheduler(device, updates, cancel_in_flight=False):
+    """
+    Runs updates(scheduler) against device and returns the scheduler and
+    the results of the futures updates returned.
+    """
+
+    async def main():
+        connection = LedConnection(
+            device.address, cache=None, client=SimulatedBleakClient(device)
+        )
+        await connection._init()
+        scheduler = UpdateScheduler(connection, cancel_in_flight=cancel_in_flight)
+        try:
+            futures = await updates(scheduler)
+            await scheduler.flush()
+            return scheduler, [future.result() for future in futures]
+        finally:
+            await scheduler.close()
+            await connection.disconnect()
+
+    return asyncio.run(main())
+
+
+def test_newer_updates_supersede_pending_ones():
+    async def updates(scheduler):
+        futures = [scheduler.send_data(SendDataCommand(payload(0)))]
+        await asyncio.sleep(0.01)
+        futures += [
+            scheduler.send_data(SendDataCommand(payload(i))) for i in range(1, 5)
+        ]
+        return futures
+
+    device = slow_device()
+    scheduler, results = run_scheduler(device, updates)
+
+    # the first one was running already, only the newest of the others follows
+    assert results == [True, False, False, False, True]
+    assert device.received == [payload(0), payload(4)]
+    assert scheduler.sent == 2
+    assert scheduler.superseded == 3
+
+
+def test_kinds_do_not_supersede_each_other():
+    async def updates(scheduler):
+        return [
+            scheduler.send_data(SendDataCommand(payload(0))),
+            scheduler.set_brightness(10),
+            scheduler.send_data(SendDataCommand(payload(1))),
+            scheduler.set_brightness(20),
+            scheduler.send_data(SendDataCommand(payload(2))),
+        ]
+
+    device = slow_device()
+    scheduler, results = run_scheduler(device, updates)
+
+    # a kind keeps its place in the queue when it is replaced
+    assert results == [False, False, False, True, True]
+    assert device.received == [payload(2), BrightnessData(20).serialize()]
+    assert device.brightness == 20
+
+
+def test_cancel_in_flight_aborts_the_running_transfer():
+    async def updates(scheduler):
+        first = scheduler.send_data(SendDataCommand(payload(0)))
+        # let the first transfer start writing
+        await asyncio.sleep(0.01)
+        assert device.stats["data_writes"] > 0
+        return [first, scheduler.send_data(SendDataCommand(payload(1)))]
+
+    device = slow_device()
+    scheduler, results = run_scheduler(device, updates, cancel_in_flight=True)
+
+    assert results == [False, True]
+    assert device.received == [payload(1)]
+    assert scheduler.sent == 1
+    assert scheduler.superseded == 1
+
+
+def test_running_transfer_finishes_without_cancel_in_flight():
+    async def updates(scheduler):
+        first = scheduler.send_data(SendDataCommand(payload(0)))
+        await asyncio.sleep(0.01)
+        return [first, scheduler.send_data(SendDataCommand(payload(1)))]
+
+    device = slow_device()
+    scheduler, results = run_scheduler(device, updates)
+
+    assert results == [True, True]
+    assert device.received == [payload(0), payload(1)]
+
+
+def test_close_drops_pending_updates():
+    device = slow_device()
+
+    async def main():
+        connection = LedConnection(
+            device.address, cache=None, client=SimulatedBleakClient(device)
+        )
+        await connection._init()
+        scheduler = UpdateScheduler(connection)
+        first = scheduler.send_data(SendDataCommand(payload(0)))
+        second = scheduler.send_data(SendDataCommand(payload(1)))
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        await connection.disconnect()
+        return first.result(), second.result()
+
+    assert asyncio.run(main()) == (False, False)
+    assert device.received == []
@@ -0,0 +1,116 @@
+import pytest
+
+from spotled import (
+    ContinueSendingResponse,
+    PauseSendingResponse,
+    SendDataCommand,
+    SendingDataFinishCommand,
+    SendingDataFinishResponse,
+    SendingDataStartCommand,
+)
+from spotled.bleak.models.responses import GenericCommandResponse
+from spotled.simulator import SimulatedDevice
+
+RESPONSES = {
+    4: SendingDataFinishResponse,
+    254: PauseSendingResponse,
+    255: ContinueSendingResponse,
+}
+
+
+def parse(notifications):
+    responses = []
+    for data in notifications:
+        response = GenericCommandResponse(data)
+        responses.append(RESPONSES[response.command_type](response.content))
+    return responses
+
+
+def start(device, payload, serial_no=7):
+    device.handle_command(
+        SendingDataStartCommand(serial_no, 32772, len(payload)).serialize()
+    )
+
+
+def finish(device, payload, serial_no=7):
+    (response,) = parse(
+        device.handle_command(
+            SendingDataFinishCommand(serial_no, 32772, len(payload)).serialize()
+        )
+    )
+    return response
+
+
+def test_device_acks_full_windows():
+    device = SimulatedDevice(mtu=23, buffer_size=128)
+    payload = SendDataCommand(bytes(range(200))).serialize()
+    start(device, payload)
+
+    acks = []
+    for i in range(0, len(payload), 20):
+        acks += parse(device.handle_data(payload[i : i + 20]))
+
+    # six 20 byte writes fit into the 128 byte buffer
+    assert [ack.continue_from for ack in acks] == [120]
+    assert finish(device, payload).error_code == 0
+    assert device.received == [bytes(range(200))]
+
+
+def test_device_discards_writes_until_the_pause_arrives():
+    device = SimulatedDevice(mtu=23, buffer_size=128)
+    payload = SendDataCommand(bytes(100)).serialize()
+    start(device, payload)
+
+    device.handle_data(payload[:20])
+    (pause,) = parse(device.handle_data(payload[20:60]))
+    assert pause.offset == 20
+    assert device.handle_data(payload[20:40]) == []
+    assert device.stats["discarded_writes"] == 1
+
+    device.notification_delivered(bytes((8, 254)))
+    for i in range(20, len(payload), 20):
+        device.handle_data(payload[i : i + 20])
+    assert finish(device, payload).error_code == 0
+
+
+@pytest.mark.parametrize("kept", [200, 255, 291, 388])
+def test_pause_offset_fits_into_a_byte(kept):
+    device = SimulatedDevice(mtu=100, buffer_size=512)
+    payload = SendDataCommand(bytes(range(256)) * 4).serialize()
+    start(device, payload)
+
+    # writes of up to 97 bytes until kept bytes are in the window
+    seek = 0
+    while seek < kept:
+        end = min(seek + 97, kept)
+        assert device.handle_data(payload[seek:end]) == []
+        seek = end
+    (pause,) = parse(device.handle_data(payload[seek : seek + 200]))
+
+    assert pause.offset == min(kept, 255)
+    device.notification_delivered(bytes((8, 254)))
+    # resending from the offset completes the payload
+    for i in range(pause.offset, len(payload), 97):
+        device.handle_data(payload[i : i + 97])
+    assert finish(device, payload).error_code == 0
+    assert device.received == [bytes(range(256)) * 4]
+
+
+def test_incomplete_transfer_fails():
+    device = SimulatedDevice()
+    payload = SendDataCommand(bytes(50)).serialize()
+    start(device, payload)
+    device.handle_data(payload[:20])
+
+    assert finish(device, payload).error_code == 1
+    assert device.stats["failed_transfers"] == 1
+    assert device.received == []
+
+
+def test_seeded_loss_is_reproducible():
+    def lost(seed):
+        device = SimulatedDevice(loss=0.5, seed=seed)
+        return [device.drop_write() for _ in range(50)]
+
+    assert lost(3) == lost(3)
+    assert 0 < sum(lost(3)) < 50
@@ -0,0 +1,79 @@
+import asyncio
+
+from spotled import BrightnessData, LedConnection, SendDataCommand
+from spotled.bleak.trace import read_trace, replay_trace, trace_data_commands
+from spotled.simulator import SimulatedBleakClient, SimulatedDevice
+
+PAYLOADS = [bytes(range(256)) * 3, bytes(100)]
+
+
+class MtuClient(SimulatedBleakClient):
+    """
+    Claims a larger MTU than the device takes, so the first transfer is
+    paused and resent.
+    """
+
+    mtu_size = 247
+
+
+def record_session(path, device):
+    async def main():
+        connection = LedConnection(
+            device.address, cache=None, client=MtuClient(device), trace=str(path)
+        )
+        await connection._init()
+        for payload in PAYLOADS:
+            await connection.send_data(SendDataCommand(payload))
+        await connection.disconnect()
+        await connection.send_data(SendDataCommand(BrightnessData(20)))
+        await connection.disconnect()
+        return connection
+
+    return asyncio.run(main())
+
+
+def test_trace_reassembles_sent_payloads(tmp_path):
+    device = SimulatedDevice(mtu=64, buffer_size=256)
+    connection = record_session(tmp_path / "session.jsonl", device)
+
+    header, events = read_trace(tmp_path / "session.jsonl")
+
+    assert header["address"] == device.address
+    assert device.stats["pauses"] > 0
+    # the recorder reopened after the first disconnect
+    assert [e.event for e in events].count("connect") == 2
+    assert [e.event for e in events].count("disconnect") == 2
+    assert connection.trace._file.closed
+    commands = trace_data_commands(events)
+    assert [c.content for c in commands] == device.received
+    assert commands[-1].command_type == SendDataCommand(BrightnessData(20)).command_type
+
+
+def test_replay_sends_the_same_payloads(tmp_path):
+    recorded = SimulatedDevice(mtu=64, buffer_size=256)
+    record_session(tmp_path / "session.jsonl", recorded)
+    _, events = read_trace(tmp_path / "session.jsonl")
+    device = SimulatedDevice(mtu=64, buffer_size=256)
+
+    async def main():
+        connection = LedConnection(
+            device.address,
+            cache=None,
+            client=MtuClient(device),
+            trace=str(tmp_path / "replay.jsonl"),
+        )
+        try:
+            return await replay_trace(events, connection, sync_timeout=0.5)
+        finally:
+            await connection.disconnect()
+
+    summary = asyncio.run(main())
+
+    assert device.received == recorded.received
+    assert device.brightness == 20
+    assert summary["sync_timeouts"] == 0
+    assert summary["writes"] == sum(e.event in ("cmd", "data") for e in events)
+    assert summary["notifications"] == summary["expected_notifications"]
+    # the replay recorded itself and carries the same transfers
+    _, replayed = read_trace(tmp_path / "replay.jsonl")
+    assert [c.content for c in trace_data_commands(replayed)] == device.received
@@ -0,0 +1,285 @@
+import asyncio
+
+import pytest
+
+import spotled.gattlib as gattlib_backend
+from spotled import (
+    BrightnessData,
+    LedConnection,
+    SendDataCommand,
+    TransferError,
+    TransferTimeouts,
+)
+from spotled.simulator import (
+    DATA_HANDLE,
+    SimulatedBleakClient,
+    SimulatedDevice,
+    SimulatedGATTRequester,
+)
+
+# long enough for many windows of the default 128 byte buffer
+PAYLOAD = bytes(range(256)) * 12
+TIMEOUT = 0.05
+
+
+def chunk_count(mtu):
+    return -(-SendDataCommand(PAYLOAD).serialized_size() // (mtu - 3))
+
+
+class CreditCheckingClient(SimulatedBleakClient):
+    """
+    Remembers the most data the host ever had in flight, that is written
+    past the last position a ContinueSendingResponse confirmed.
+    """
+
+    def __init__(self, device):
+        super().__init__(device)
+        self.written = self.confirmed = self.most_in_flight = 0
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if response is False:
+            self.written += len(data)
+            self.most_in_flight = max(
+                self.most_in_flight, self.written - self.confirmed
+            )
+        elif data[1:2] == b"\x01":
+            self.written = self.confirmed = 0
+        await super().write_gatt_char(characteristic, data, response=response)
+
+    def _notify(self, data):
+        if data[1:2] == b"\xff":
+            self.confirmed = int.from_bytes(data[6:10], "big")
+        super()._notify(data)
+
+
+class LargeMtuClient(SimulatedBleakClient):
+    # claims a larger MTU than the device can read
+    mtu_size = 247
+
+
+class DroppingClient(SimulatedBleakClient):
+    """
+    Loses the data writes whose zero based numbers are in drop.
+    """
+
+    def __init__(self, device, drop):
+        super().__init__(device)
+        self.drop = drop
+        self.data_writes = 0
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if response is False:
+            self.data_writes += 1
+            if self.data_writes - 1 in self.drop:
+                return
+        await super().write_gatt_char(characteristic, data, response=response)
+
+
+def send(device, client=None, payload=PAYLOAD):
+    """
+    Sends payload to device over a bleak connection and returns the
+    connection and the exception send_data raised, if any.
+    """
+
+    async def main():
+        connection = LedConnection(
+            device.address,
+            timeouts=TransferTimeouts.coerce(TIMEOUT),
+            cache=None,
+            client=client or SimulatedBleakClient(device),
+        )
+        await connection._init()
+        try:
+            await connection.send_data(SendDataCommand(payload))
+        except (TimeoutError, TransferError) as e:
+            return connection, e
+        finally:
+            await connection.disconnect()
+        return connection, None
+
+    return asyncio.run(main())
+
+
+def test_bleak_transfer_stays_within_credit_window():
+    device = SimulatedDevice(mtu=64, buffer_size=128, notify_latency=0.002)
+    client = CreditCheckingClient(device)
+    connection, error = send(device, client)
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    assert 0 < client.most_in_flight <= device.buffer_size
+    transfer = connection.metrics.last
+    assert transfer.continues > 0
+    assert transfer.pauses == transfer.retries == 0
+    assert transfer.bytes_sent == device.stats["data_bytes"]
+
+
+def test_bleak_pause_lowers_mtu():
+    device = SimulatedDevice(mtu=64, buffer_size=128)
+    connection, error = send(device, LargeMtuClient(device))
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    assert connection.metrics.last.pauses > 0
+    assert connection.mtu <= device.mtu
+    assert connection.max_mtu == connection.mtu
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [BrightnessData(30), bytes(100), bytes(400)],
+    ids=["brightness", "100 bytes", "400 bytes"],
+)
+def test_bleak_pause_after_the_last_write_lowers_mtu(payload):
+    # everything fits into a single window, which is never acked
+    device = SimulatedDevice(mtu=23, buffer_size=512)
+    connection, error = send(device, LargeMtuClient(device), payload)
+
+    assert error is None
+    expected = payload if isinstance(payload, bytes) else payload.serialize()
+    assert device.received == [expected]
+    # every pause steps down the MTU ladder and retries
+    transfer = connection.metrics.last
+    assert transfer.retries == transfer.pauses > 0
+    assert connection.mtu == connection.max_mtu <= device.mtu
+
+
+def test_bleak_pauses_are_bounded():
+    # even the default MTU is too large for this device
+    device = SimulatedDevice(mtu=20)
+    connection, error = send(device)
+
+    assert isinstance(error, TransferError)
+    assert device.received == []
+    transfer = connection.metrics.last
+    assert transfer.retries == 5
+    assert transfer.pauses == transfer.attempts
+
+
+def test_bleak_lost_write_is_retried():
+    device = SimulatedDevice(buffer_size=128)
+    connection, error = send(device, DroppingClient(device, {3}))
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    assert connection.metrics.last.retries == 1
+
+
+def test_bleak_finish_status_is_logged(caplog):
+    # a write lost in the last window only shows in the finish status, whose
+    # layout is unconfirmed, so it is reported instead of retried
+    device = SimulatedDevice(buffer_size=128)
+    connection, error = send(device, DroppingClient(device, {chunk_count(23) - 1}))
+
+    assert error is None
+    assert device.received == []
+    assert device.stats["failed_transfers"] == 1
+    assert connection.metrics.last.retries == 0
+    assert "reported status 1" in caplog.text
+
+
+class LargeMtuRequester(SimulatedGATTRequester):
+    def connect(self):
+        super().connect()
+        # gattlib reports the negotiated MTU through on_connect
+        self.on_connect(64)
+
+
+class DroppingRequester(SimulatedGATTRequester):
+    """
+    Loses the data writes whose zero based numbers are in drop.
+    """
+
+    def __init__(self, device, drop):
+        super().__init__(device)
+        self.drop = drop
+        self.data_writes = 0
+
+    def write_cmd(self, handle, data):
+        if handle == DATA_HANDLE:
+            self.data_writes += 1
+            if self.data_writes - 1 in self.drop:
+                return
+        super().write_cmd(handle, data)
+
+
+def gattlib_send(device, requester=None, payload=PAYLOAD):
+    """
+    Sends payload to device over a gattlib connection and returns the
+    connection and the exception send_data raised, if any.
+    """
+    connection = gattlib_backend.LedConnection(
+        device.address,
+        use_cache=False,
+        requester=requester or SimulatedGATTRequester(device),
+    )
+    try:
+        connection.send_data(gattlib_backend.SendDataCommand(payload), timeout=TIMEOUT)
+    except (TimeoutError, gattlib_backend.TransferError) as e:
+        return connection, e
+    finally:
+        connection.disconnect()
+    return connection, None
+
+
+def test_gattlib_transfer_waits_for_every_window():
+    device = SimulatedDevice(buffer_size=128, notify_latency=0.002)
+    connection, error = gattlib_send(device)
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    windows = chunk_count(23) // (device.buffer_size // 20)
+    assert device.stats["continues"] == windows
+    assert device.stats["data_writes"] == chunk_count(23)
+
+
+def test_gattlib_pause_falls_back_to_default_mtu():
+    device = SimulatedDevice(buffer_size=128)
+    connection, error = gattlib_send(device, LargeMtuRequester(device))
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    assert device.stats["pauses"] > 0
+    assert connection.mtu == connection.max_mtu == 23
+
+
+@pytest.mark.parametrize(
+    "payload", [bytes(100), bytes(400)], ids=["100 bytes", "400 bytes"]
+)
+def test_gattlib_pause_after_the_last_write_falls_back(payload):
+    device = SimulatedDevice(buffer_size=512)
+    connection, error = gattlib_send(device, LargeMtuRequester(device), payload)
+
+    assert error is None
+    assert device.received == [payload]
+    assert device.stats["pauses"] > 0
+    assert connection.mtu == connection.max_mtu == 23
+
+
+def test_gattlib_pauses_are_bounded():
+    device = SimulatedDevice(mtu=20)
+    connection, error = gattlib_send(device)
+
+    assert isinstance(error, gattlib_backend.TransferError)
+    assert device.received == []
+    assert device.stats["transfers"] == 0
+
+
+def test_gattlib_lost_write_is_retried():
+    device = SimulatedDevice(buffer_size=128)
+    connection, error = gattlib_send(device, DroppingRequester(device, {3}))
+
+    assert error is None
+    assert device.received == [PAYLOAD]
+    assert device.stats["failed_transfers"] == 0
+
+
+def test_gattlib_finish_status_is_logged(caplog):
+    device = SimulatedDevice(buffer_size=128)
+    lost = chunk_count(23) - 1
+    connection, error = gattlib_send(device, DroppingRequester(device, {lost}))
+
+    assert error is None
+    assert device.received == []
+    assert device.stats["failed_transfers"] == 1
+    assert "reported status 1" in caplog.text